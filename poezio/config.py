@@ -92,8 +92,17 @@ DEFAULT_CONFIG = {
         'load_log': 10,
         'log_dir': '',
         'log_errors': True,
+        'log_flush_interval': 1.0,
+        'log_flush_size': 16384,
+        'log_fd_idle_timeout': 600,
+        'log_max_open_files': 128,
+        'log_scrollback': True,
+        'log_search_index': True,
+        'log_segment_compression': 'gzip',
+        'log_segment_period': '',
         'max_lines_in_memory': 2048,
         'max_messages_in_memory': 2048,
+        'max_fps': 30,
         'max_nick_length': 25,
         'muc_history_length': 50,
         'notify_messages': True,
@@ -11,7 +11,7 @@ the roster.
 
 from collections import defaultdict
 import logging
-from typing import Dict, Iterator, List, Optional, Union
+from typing import Any, Dict, Iterator, List, Optional, Union
 
 from poezio.common import safeJID
 from slixmpp import JID
@@ -78,6 +78,11 @@ class Contact:
         self.gaming = {}  # type: Dict[str, str]
         self.mood = ''
         self.activity = ''
+        # the keys of the contact for each roster_sort, see
+        # roster_sorting.contact_sort_key()
+        self.sort_keys = {}  # type: Dict[str, Any]
+        # the resources, by decreasing priority, until changed() is called
+        self._resources = None  # type: Optional[List[Resource]]
 
     @property
     def groups(self) -> List[str]:
@@ -125,9 +130,30 @@ class Contact:
     @property
     def resources(self) -> Iterator[Resource]:
         """List of the available resources as Resource objects"""
-        return (Resource('%s%s' % (self.bare_jid, ('/' + key)
-                                   if key else ''), self.__item.resources[key])
-                for key in self.__item.resources.keys())
+        return iter(self._sorted_resources())
+
+    def _sorted_resources(self) -> List[Resource]:
+        """
+        The cached Resource objects, by decreasing priority (they read
+        the presence data of slixmpp, which is updated in place)
+        """
+        resources = self._resources
+        if resources is None or len(resources) != len(self.__item.resources):
+            resources = self._resources = sorted(
+                (Resource('%s%s' % (self.bare_jid, ('/' + key)
+                                    if key else ''), data)
+                 for key, data in self.__item.resources.items()),
+                key=lambda resource: resource.priority,
+                reverse=True)
+        return resources
+
+    def changed(self):
+        """
+        Forget the cached resources and sort keys, after a presence or
+        a roster update (see Roster.modified())
+        """
+        self._resources = None
+        self.sort_keys.clear()
 
     @property
     def subscription(self) -> str:
@@ -175,12 +201,11 @@ class Contact:
 
     def get_resources(self) -> List[Resource]:
         """Return all resources, sorted by priority """
-        compare_resources = lambda x: x.priority
-        return sorted(self.resources, key=compare_resources, reverse=True)
+        return list(self._sorted_resources())
 
     def get_highest_priority_resource(self) -> Optional[Resource]:
         """Return the resource with the highest priority"""
-        resources = self.get_resources()
+        resources = self._sorted_resources()
         if resources:
             return resources[0]
         return None
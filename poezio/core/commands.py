@@ -15,11 +15,14 @@ from slixmpp.xmlstream.handler import Callback
 from slixmpp.xmlstream.matcher import StanzaPath
 
 from poezio import common
+from poezio import log_search
+from poezio import log_stats
 from poezio import pep
 from poezio import tabs
 from poezio.bookmarks import Bookmark
 from poezio.common import safeJID
 from poezio.config import config, DEFAULT_CONFIG, options as config_opts
+from poezio.logger import logger
 from poezio import multiuserchat as muc
 from poezio.plugin import PluginConfig
 from poezio.roster import roster
@@ -951,6 +954,53 @@ class CommandCore:
         if len(args) == 2:
             tab.command_say(args[1])
 
+    @command_args_parser.raw
+    def search(self, args):
+        """
+        /search [room:<jid>] [nick:<nick>] [after:<date>] [before:<date>] <terms>
+        """
+        try:
+            terms, filters = log_search.parse_query(common.shell_split(args))
+        except ValueError as exc:
+            return self.core.information(str(exc), 'Error')
+        if not terms:
+            return self.help('search')
+        search = logger.get_search()
+        if search is None:
+            return self.core.information(
+                'The search in the logs is disabled (see log_search_index)',
+                'Error')
+        # index the pending messages first, the search comes after them
+        logger.flush()
+        tab = tabs.SearchTab(self.core, search, args, terms, filters)
+        self.core.add_tab(tab, True)
+
+    @command_args_parser.quoted(0, 1)
+    def logstats(self, args):
+        """
+        /logstats [room]
+        """
+        if args is None:
+            return self.help('logstats')
+        jid = safeJID(args[0]).full if args else None
+
+        def show(future):
+            try:
+                stats = future.result()
+            except Exception:
+                log.error('Unable to compute the log statistics',
+                          exc_info=True)
+                return self.core.information(
+                    'Unable to compute the log statistics', 'Error')
+            title = 'Statistics of the logs of %s:' % jid if jid else \
+                'Statistics of the logs:'
+            # only the last month, the whole series is in poezio_logs
+            self.core.information(
+                '\n'.join([title] + log_stats.format_stats(
+                    stats, last_days=30)), 'Info')
+
+        logger.get_stats(jid).add_done_callback(show)
+
     @command_args_parser.ignored
     def xml_tab(self):
         """/xml_tab"""
@@ -115,6 +115,13 @@ class Core:
 
         self.size = SizeManager(self)
 
+        # Redraws requested with schedule_refresh() are coalesced and
+        # done at most once per frame (see the max_fps option)
+        self._refresh_scheduled = False
+        self._refresh_window_needed = False
+        self._refresh_tab_win_needed = False
+        self._last_refresh = 0.0
+
         # Set to True whenever we consider that we have been disconnected
         # from the server because of a legitimate reason (bad credentials,
         # or explicit disconnect from the user for example), in that case we
@@ -237,6 +244,7 @@ class Core:
             ('message_error', self.handler.on_error_message),
             ('message_xform', self.handler.on_data_form),
             ('no_auth', self.handler.on_no_auth),
+            ('presence_available', self.handler.on_presence_available),
             ('presence_error', self.handler.on_presence_error),
             ('receipt_received', self.handler.on_receipt),
             ('roster_subscription_authorized',
@@ -321,6 +329,7 @@ class Core:
             ('theme', self.on_theme_config_change),
             ('themes_dir', theming.update_themes_dir),
             ('use_bookmarks_method', self.on_bookmarks_method_config_change),
+            ('use_log', logger.on_use_log_change),
             ('vertical_tab_list_size',
              self.on_vertical_tab_list_config_change),
         ]
@@ -539,6 +548,7 @@ class Core:
 
     def exit(self, event=None):
         log.debug("exit(%s)", event)
+        logger.flush()
         asyncio.get_event_loop().stop()
 
     def on_exception(self, typ, value, trace):
@@ -1304,6 +1314,47 @@ class Core:
         self.doupdate()
         curses.curs_set(nocursor)
 
+    def schedule_refresh(self, tab_win_only: bool = False) -> None:
+        """
+        Request a redraw of the current tab (or of the tab list and input
+        only, if tab_win_only is True), instead of doing it right away.
+
+        All the requests made until the event loop is idle are handled
+        by a single redraw, and there are at most max_fps of them per
+        second, so that a burst of stanzas does not redraw the screen
+        for each one of them.
+        """
+        if tab_win_only:
+            self._refresh_tab_win_needed = True
+        else:
+            self._refresh_window_needed = True
+        if self._refresh_scheduled:
+            return
+        self._refresh_scheduled = True
+        loop = asyncio.get_event_loop()
+        max_fps = config.get('max_fps')
+        delay = 0.0
+        if max_fps > 0:
+            delay = self._last_refresh + 1 / max_fps - loop.time()
+        if delay > 0:
+            loop.call_later(delay, loop.idle_call, self._do_scheduled_refresh)
+        else:
+            loop.idle_call(self._do_scheduled_refresh)
+
+    def _do_scheduled_refresh(self) -> None:
+        "Do the redraw requested with schedule_refresh()"
+        self._refresh_scheduled = False
+        self._last_refresh = asyncio.get_event_loop().time()
+        refresh_window = self._refresh_window_needed
+        refresh_tab_win = self._refresh_tab_win_needed
+        self._refresh_window_needed = self._refresh_tab_win_needed = False
+        if not self.running:
+            return
+        if refresh_window:
+            self.refresh_window()
+        elif refresh_tab_win:
+            self.refresh_tab_win()
+
     def refresh_tab_win(self) -> None:
         """
         Refresh the window containing the tab list
@@ -1806,6 +1857,27 @@ class Core:
             completion=self.completion.remove_bookmark)
         self.register_command(
             'xml_tab', self.command.xml_tab, shortdesc='Open an XML tab.')
+        self.register_command(
+            'search',
+            self.command.search,
+            usage='[room:<jid>] [nick:<nick>] [after:<date>] '
+            '[before:<date>] <terms>',
+            desc='Search the given terms in the logs, and list the matching '
+            'messages in a new tab, the most recent first. A term ending '
+            'with * matches the words starting with it, and "quoted words" '
+            'match a whole phrase. The results can be restricted to a room '
+            'or a contact, to a nick, and to the messages received after or '
+            'before a date (YYYY-MM-DD, or YYYY-MM-DDTHH:MM).',
+            shortdesc='Search in the logs.')
+        self.register_command(
+            'logstats',
+            self.command.logstats,
+            usage='[room]',
+            desc='Show statistics of the logs of a room or a contact, or of '
+            'all the conversations: the number of messages per day (of the '
+            'last 30 days), the top '
+            'talkers, the busiest hours and the size of the logs.',
+            shortdesc='Show statistics of the logs.')
         self.register_command(
             'runkey',
             self.command.runkey,
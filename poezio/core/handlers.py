@@ -478,6 +478,7 @@ class HandlerCore:
             contact.name = item['nick']['nick']
         else:
             contact.name = ''
+        roster.modified(contact.bare_jid)
 
     def on_gaming_event(self, message):
         """
@@ -528,7 +529,7 @@ class HandlerCore:
         contact = roster[message['from'].bare]
         if not contact:
             return
-        roster.modified()
+        roster.modified(contact.bare_jid)
         item = message['pubsub_event']['items']['item']
         old_mood = contact.mood
         if item.xml.find('{http://jabber.org/protocol/mood}mood') is not None:
@@ -566,7 +567,7 @@ class HandlerCore:
         contact = roster[message['from'].bare]
         if not contact:
             return
-        roster.modified()
+        roster.modified(contact.bare_jid)
         item = message['pubsub_event']['items']['item']
         old_activity = contact.activity
         if item.xml.find(
@@ -612,7 +613,7 @@ class HandlerCore:
         contact = roster[message['from'].bare]
         if not contact:
             return
-        roster.modified()
+        roster.modified(contact.bare_jid)
         item = message['pubsub_event']['items']['item']
         old_tune = contact.tune
         if item.xml.find('{http://jabber.org/protocol/tune}tune') is not None:
@@ -711,16 +712,9 @@ class HandlerCore:
             tab.last_sent_message = message
 
         if tab is self.core.tabs.current_tab:
-            tab.text_win.refresh()
-            tab.info_header.refresh(tab, tab.text_win, user=tab.own_user)
-            tab.input.refresh()
-            self.core.doupdate()
+            self.core.schedule_refresh()
         elif tab.state != old_state:
-            self.core.refresh_tab_win()
-            current = self.core.tabs.current_tab
-            if hasattr(current, 'input') and current.input:
-                current.input.refresh()
-            self.core.doupdate()
+            self.core.schedule_refresh(tab_win_only=True)
 
         if 'message' in config.get('beep_on').split():
             if (not config.get_by_tabname('disable_beep', room_from)
@@ -951,7 +945,7 @@ class HandlerCore:
                 '/accept <jid> or /deny <jid> in the roster '
                 'tab to accept or reject the query.' % jid, 'Roster')
             self.core.tabs.first().state = 'highlight'
-            roster.modified()
+            roster.modified(jid)
         if isinstance(self.core.tabs.current_tab, tabs.RosterInfoTab):
             self.core.refresh_window()
 
@@ -965,7 +959,7 @@ class HandlerCore:
         if contact.pending_out:
             contact.pending_out = False
 
-        roster.modified()
+        roster.modified(jid)
 
         if isinstance(self.core.tabs.current_tab, tabs.RosterInfoTab):
             self.core.refresh_window()
@@ -976,7 +970,7 @@ class HandlerCore:
         contact = roster[jid]
         if not contact:
             return
-        roster.modified()
+        roster.modified(jid)
         self.core.information(
             '%s does not want to receive your status anymore.' % jid, 'Roster')
         self.core.tabs.first().state = 'highlight'
@@ -989,7 +983,7 @@ class HandlerCore:
         contact = roster[jid]
         if not contact:
             return
-        roster.modified()
+        roster.modified(jid)
         if contact.pending_out:
             self.core.information('%s rejected your contact proposal' % jid,
                                   'Roster')
@@ -1004,6 +998,19 @@ class HandlerCore:
 
     ### Presence-related handlers ###
 
+    def on_presence_available(self, presence):
+        """
+        slixmpp updated the resource of a contact, 'changed_status' is
+        only triggered when its show or its status changed, not its
+        priority
+        """
+        if presence.match('presence/muc') or presence.xml.find(
+                '{http://jabber.org/protocol/muc#user}x') is not None:
+            return
+        jid = presence['from']
+        if jid.bare in roster:
+            roster.modified(jid.bare)
+
     def on_presence(self, presence):
         if presence.match('presence/muc') or presence.xml.find(
                 '{http://jabber.org/protocol/muc#user}x') is not None:
@@ -1018,7 +1025,7 @@ class HandlerCore:
                 tab.unlock()
         if contact is None:
             return
-        roster.modified()
+        roster.modified(jid.bare)
         contact.error = None
         self.core.events.trigger('normal_presence', presence,
                                  contact[jid.full])
@@ -1026,18 +1033,16 @@ class HandlerCore:
         if tab:
             tab.update_status(
                 Status(show=presence['show'], message=presence['status']))
-        if isinstance(self.core.tabs.current_tab, tabs.RosterInfoTab):
-            self.core.refresh_window()
-        elif self.core.tabs.current_tab == tab:
-            tab.refresh()
-            self.core.doupdate()
+        if (isinstance(self.core.tabs.current_tab, tabs.RosterInfoTab)
+                or self.core.tabs.current_tab == tab):
+            self.core.schedule_refresh()
 
     def on_presence_error(self, presence):
         jid = presence['from']
         contact = roster[jid.bare]
         if not contact:
             return
-        roster.modified()
+        roster.modified(jid.bare)
         contact.error = presence['error']['type'] + ': ' + presence['error']['condition']
         # TODO:  reset chat states status on presence error
 
@@ -1066,9 +1071,9 @@ class HandlerCore:
             jid.bare, '\x195}%s is \x191}offline' % name)
         self.core.information('\x193}%s \x195}is \x191}offline' % name,
                               'Roster')
-        roster.modified()
+        roster.modified(jid.bare)
         if isinstance(self.core.tabs.current_tab, tabs.RosterInfoTab):
-            self.core.refresh_window()
+            self.core.schedule_refresh()
 
     def on_got_online(self, presence):
         """
@@ -1083,7 +1088,7 @@ class HandlerCore:
             # Todo, handle presence coming from contacts not in roster
             return
         roster.connected += 1
-        roster.modified()
+        roster.modified(jid.bare)
         if not logger.log_roster_change(jid.bare, 'got online'):
             self.core.information('Unable to write in the log file', 'Error')
         resource = Resource(
@@ -1108,7 +1113,7 @@ class HandlerCore:
             self.core.add_information_message_to_conversation_tab(
                 jid.bare, '\x195}%s is \x194}online' % name)
         if isinstance(self.core.tabs.current_tab, tabs.RosterInfoTab):
-            self.core.refresh_window()
+            self.core.schedule_refresh()
 
     def on_groupchat_presence(self, presence):
         """
@@ -0,0 +1,312 @@
+"""
+Full-text search in the conversation logs.
+
+The messages are stored in an SQLite database next to the log files,
+with an FTS5 index on their text. The Logger feeds it with the messages
+it logs, and rebuild() indexes the existing log files in bulk (this is
+what ``poezio_logs --rebuild-search-index`` does). The database is only
+used in a thread of its own, so that the insertions and the searches
+do not block the event loop.
+"""
+
+import calendar
+import logging
+import sqlite3
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+from poezio import common
+from poezio.logger import (LogMessage, SEGMENT_DIR, parse_log_line,
+                           read_log_lines)
+
+log = logging.getLogger(__name__)
+
+# the name of the database, in the log directory. No jid starts with a
+# dot, so it can not be the log file of a conversation
+SEARCH_DB = '.search.db'
+# the files of the log directory that are not conversations
+NOT_CONVERSATIONS = {'roster.log', 'errors.log'}
+
+# the log directory can be large: don’t sync the database for each
+# transaction, and let the searches read it while it is written
+PRAGMAS = """
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    jid TEXT NOT NULL,
+    nick TEXT NOT NULL,
+    time INTEGER NOT NULL,
+    txt TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_jid_time ON messages (jid, time);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts
+    USING fts5(txt, content='messages', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS messages_insert AFTER INSERT ON messages
+BEGIN
+    INSERT INTO messages_fts(rowid, txt) VALUES (new.id, new.txt);
+END;
+"""
+
+# (jid, nick, UTC time in seconds since the epoch, text)
+Row = Tuple[str, str, int, str]
+
+SEARCH_FILTERS = ('room', 'nick', 'after', 'before')
+DATE_FORMATS = ('%Y-%m-%d', '%Y-%m-%dT%H:%M', '%Y-%m-%dT%H:%M:%S')
+
+
+def _utc_seconds(local_time: datetime) -> int:
+    return calendar.timegm(common.get_utc_time(local_time).timetuple())
+
+
+def parse_date(value: str) -> Optional[datetime]:
+    """
+    Parse a date given to /search, like 2017-03-01 or 2017-03-01T12:30
+    """
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+    return None
+
+
+def parse_query(args: Iterable[str]) -> Tuple[List[str], dict]:
+    """
+    Split the arguments of /search into the searched terms and the
+    filters given as room:<jid>, nick:<nick>, after:<date> or
+    before:<date>. Raise ValueError for an invalid date.
+    """
+    terms = []
+    filters = {}
+    for arg in args:
+        name, sep, value = arg.partition(':')
+        if not sep or name not in SEARCH_FILTERS or not value:
+            terms.append(arg)
+        elif name in ('after', 'before'):
+            date = parse_date(value)
+            if date is None:
+                raise ValueError('Invalid date: %s' % value)
+            filters[name] = date
+        else:
+            filters[name] = value
+    return terms, filters
+
+
+def match_expression(terms: Iterable[str]) -> str:
+    """
+    Build an FTS5 query matching all the terms. Each one is quoted so that
+    the query syntax can not be misused, but a trailing * still searches
+    for a prefix.
+    """
+    expression = []
+    for term in terms:
+        prefix = term.endswith('*')
+        term = term.rstrip('*')
+        if not term:
+            continue
+        expression.append('"%s"%s' % (term.replace('"', '""'),
+                                      '*' if prefix else ''))
+    return ' '.join(expression)
+
+
+class LogSearch:
+    """
+    The search database of a log directory. It is opened on first use,
+    and disabled if it can not be (for example if SQLite was built
+    without FTS5). It is only used in the thread of the executor, one
+    operation after the other: a search sees the messages of the commits
+    made before it.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._db = None  # type: Optional[sqlite3.Connection]
+        self._failed = False
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        # the rows not inserted yet, see commit()
+        self._pending = []  # type: List[Row]
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        if self._db is None and not self._failed:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._db = sqlite3.connect(
+                    str(self.path), check_same_thread=False)
+                self._db.executescript(PRAGMAS + SCHEMA)
+            except sqlite3.Error:
+                log.error(
+                    'Unable to open the search database (%s)',
+                    self.path,
+                    exc_info=True)
+                self._failed = True
+                self._close()
+        return self._db
+
+    def close(self) -> None:
+        """Close the database, once the pending operations are done"""
+        self._executor.submit(self._close)
+        self._executor.shutdown()
+
+    def _close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def add(self, jid: str, nick: str, utc_time: datetime, txt: str) -> None:
+        """Queue a message to be indexed by the next commit()"""
+        self._pending.append((jid, nick or '',
+                              calendar.timegm(utc_time.timetuple()), txt))
+
+    def commit(self) -> Future:
+        """
+        Index the queued messages, in a single transaction. Return the
+        future success.
+        """
+        rows = self._pending
+        self._pending = []
+        if not rows:
+            done = Future()  # type: Future
+            done.set_result(True)
+            return done
+        return self._executor.submit(self._insert, rows)
+
+    def _insert(self, rows: Iterable[Row]) -> bool:
+        db = self._connect()
+        if db is None:
+            return False
+        try:
+            with db:
+                db.executemany(
+                    'INSERT INTO messages (jid, nick, time, txt) '
+                    'VALUES (?, ?, ?, ?)', rows)
+        except sqlite3.Error:
+            log.error(
+                'Unable to update the search database (%s)',
+                self.path,
+                exc_info=True)
+            return False
+        return True
+
+    def search(self,
+               terms: Iterable[str],
+               room: Optional[str] = None,
+               nick: Optional[str] = None,
+               after: Optional[datetime] = None,
+               before: Optional[datetime] = None,
+               limit: int = 100,
+               offset: int = 0) -> Future:
+        """
+        Find the (jid, nick, local time, text) of the messages matching
+        all the terms and the given filters, the most recent first, and
+        paged with limit and offset. after and before are local times.
+        Return the future list, which raises sqlite3.Error if the
+        database can not be used.
+        """
+        return self._executor.submit(self._search, list(terms), room, nick,
+                                     after, before, limit, offset)
+
+    def _search(self, terms: List[str], room: Optional[str],
+                nick: Optional[str], after: Optional[datetime],
+                before: Optional[datetime], limit: int,
+                offset: int) -> List[Tuple[str, str, datetime, str]]:
+        db = self._connect()
+        if db is None:
+            raise sqlite3.OperationalError('the search database is disabled')
+        query = ('SELECT m.jid, m.nick, m.time, m.txt FROM messages_fts '
+                 'JOIN messages AS m ON m.id = messages_fts.rowid '
+                 'WHERE messages_fts MATCH ?')
+        params = [match_expression(terms)]  # type: List
+        if room is not None:
+            query += ' AND m.jid = ?'
+            params.append(room)
+        if nick is not None:
+            query += ' AND m.nick = ?'
+            params.append(nick)
+        if after is not None:
+            query += ' AND m.time >= ?'
+            params.append(_utc_seconds(after))
+        if before is not None:
+            query += ' AND m.time < ?'
+            params.append(_utc_seconds(before))
+        query += ' ORDER BY m.time DESC, m.id DESC LIMIT ? OFFSET ?'
+        params += [limit, offset]
+        return [(jid, nick,
+                 common.get_local_time(datetime.utcfromtimestamp(time)), txt)
+                for jid, nick, time, txt in db.execute(query, params)]
+
+    def rebuild(self, log_dir: Path) -> int:
+        """
+        Index all the messages of the log files in log_dir again, and
+        return how many there are, once it is done
+        """
+        self._pending = []
+        return self._executor.submit(self._rebuild, log_dir).result()
+
+    def _rebuild(self, log_dir: Path) -> int:
+        db = self._connect()
+        if db is None:
+            return 0
+        try:
+            with db:
+                db.execute('DELETE FROM messages')
+                db.execute("INSERT INTO messages_fts(messages_fts) "
+                           "VALUES('delete-all')")
+        except sqlite3.Error:
+            log.error(
+                'Unable to clear the search database (%s)',
+                self.path,
+                exc_info=True)
+            return 0
+        total = 0
+        for path in conversation_logs(log_dir):
+            rows = list(read_log_file(path))
+            if self._insert(rows):
+                total += len(rows)
+        return total
+
+
+def conversation_logs(log_dir: Path) -> List[Path]:
+    """
+    Return the log files of the conversations in log_dir, with the ones
+    which only have closed segments
+    """
+    names = set()
+    segments = log_dir / SEGMENT_DIR
+    if segments.is_dir():
+        names.update(path.name for path in segments.iterdir()
+                     if path.is_dir())
+    names.update(path.name for path in log_dir.iterdir()
+                 if not path.name.startswith('.') and path.is_file())
+    return [log_dir / name for name in sorted(names - NOT_CONVERSATIONS)]
+
+
+def read_log_file(path: Path) -> Iterable[Row]:
+    """
+    Read the messages of a log file and of its closed segments (not the
+    info lines), as rows for the search database
+    """
+    jid = path.name.replace('\\', '/')
+    item = None
+    lines = []  # type: List[str]
+    for line in read_log_lines(path):
+        line = line.rstrip('\n')
+        if line.startswith(' '):
+            lines.append(line[1:])
+            continue
+        if isinstance(item, LogMessage):
+            yield _log_row(jid, item, lines)
+        item = parse_log_line(line)
+        lines = []
+    if isinstance(item, LogMessage):
+        yield _log_row(jid, item, lines)
+
+
+def _log_row(jid: str, item: LogMessage, lines: List[str]) -> Row:
+    txt = '\n'.join([item.text] + lines)
+    return jid, item.nick, calendar.timegm(item.time.timetuple()), txt
@@ -0,0 +1,299 @@
+"""
+Statistics of the conversation logs: the messages per day, the top
+talkers, the busiest hours and the size of the logs.
+
+The files are scanned by chunks, memory-mapped when they are not
+compressed, only looking for the headers of the messages. The results
+of each file (closed segment or current log file) are cached in a JSON
+file of the log directory, and scanned again when its size or its
+modification time changes. A current log file which only grew is only
+scanned from its previous end.
+"""
+
+import io
+import json
+import logging
+import lzma
+import mmap
+import os
+import re
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, IO, Iterable, List, Optional, Tuple
+
+from poezio.logger import local_time, log_parts, open_log_file
+
+log = logging.getLogger(__name__)
+
+# the name of the cache, in the log directory
+STATS_CACHE = '.stats.json'
+STATS_VERSION = 1
+CHUNK_SIZE = 1 << 22
+# the ten minutes bucket ('YYYYMMDDTHH:M') and the nick of each message,
+# the info lines are not counted
+MESSAGE_HEADER_RE = re.compile(
+    rb'^MR (\d{8}T\d{2}:\d)\d:\d{2}Z \d+ <(.+?)> \xc2\xa0', re.MULTILINE)
+
+
+class LogStats:
+    """
+    The number of messages of some logs per UTC ten minutes bucket (they
+    are converted to local days and hours when reported) and per nick,
+    and the size of the logs in bytes (uncompressed)
+    """
+
+    def __init__(self):
+        self.buckets = Counter()  # type: Counter
+        self.nicks = Counter()  # type: Counter
+        self.size = 0
+
+    def __len__(self) -> int:
+        return sum(self.buckets.values())
+
+    def update(self, other: 'LogStats') -> None:
+        self.buckets.update(other.buckets)
+        self.nicks.update(other.nicks)
+        self.size += other.size
+
+    def scan(self, data: Any, start: int = 0,
+             end: Optional[int] = None) -> None:
+        """
+        Count the messages of data (bytes or mmap) between the offsets
+        start and end, which are at the start of a line
+        """
+        pairs = Counter(
+            MESSAGE_HEADER_RE.findall(data, start,
+                                      len(data) if end is None else end))
+        for (bucket, nick), count in pairs.items():
+            self.buckets[bucket.decode()] += count
+            self.nicks[nick.decode(errors='replace')] += count
+
+    def per_day(self) -> List[Tuple[str, int]]:
+        "The number of messages of each local day, in order"
+        days = Counter()  # type: Counter
+        for bucket, count in self.buckets.items():
+            days[_local_bucket(bucket).strftime('%Y-%m-%d')] += count
+        return sorted(days.items())
+
+    def per_hour(self) -> List[int]:
+        "The number of messages in each local hour of the day"
+        hours = [0] * 24
+        for bucket, count in self.buckets.items():
+            hours[_local_bucket(bucket).hour] += count
+        return hours
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            'buckets': self.buckets,
+            'nicks': self.nicks,
+            'size': self.size
+        }
+
+    @staticmethod
+    def from_json(value: Dict[str, Any]) -> 'LogStats':
+        stats = LogStats()
+        stats.buckets.update(value['buckets'])
+        stats.nicks.update(value['nicks'])
+        stats.size = value['size']
+        return stats
+
+
+def _local_bucket(bucket: str) -> datetime:
+    utc_time = datetime.strptime(bucket + '0', '%Y%m%dT%H:%M')
+    return local_time(int((utc_time - datetime(1970, 1, 1)).total_seconds()))
+
+
+def scan_file(path: Path, stats: LogStats, start: int = 0) -> None:
+    """
+    Add the messages of a log file or a segment to stats, from the
+    offset start (for a file which is not compressed)
+    """
+    with open_log_file(path) as fd:
+        if isinstance(fd, io.BufferedReader):
+            _scan_mmap(fd, stats, start)
+            return
+        # the compressed segments are decompressed by chunks, cut after
+        # their last line
+        rest = b''
+        while True:
+            chunk = fd.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            data = rest + chunk
+            end = data.rfind(b'\n') + 1
+            stats.scan(data, 0, end)
+            stats.size += end
+            rest = data[end:]
+        stats.scan(rest)
+        stats.size += len(rest)
+
+
+def _scan_mmap(fd: IO[bytes], stats: LogStats, start: int) -> None:
+    size = os.fstat(fd.fileno()).st_size
+    if size <= start:
+        return
+    with mmap.mmap(fd.fileno(), 0, prot=mmap.PROT_READ) as data:
+        while start < size:
+            end = min(start + CHUNK_SIZE, size)
+            cut = data.rfind(b'\n', start, end)
+            if end < size and cut >= start:
+                end = cut + 1
+            stats.scan(data, start, end)
+            start = end
+    stats.size = size
+
+
+class StatsCache:
+    """
+    The statistics of the files of a log directory, cached in its
+    STATS_CACHE file
+    """
+
+    def __init__(self, log_dir: Path):
+        self.path = log_dir / STATS_CACHE
+        self.log_dir = log_dir
+        self._entries = None  # type: Optional[Dict[str, Dict[str, Any]]]
+        self._changed = False
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if self._entries is None:
+            self._entries = {}
+            try:
+                with self.path.open() as fd:
+                    cache = json.load(fd)
+                if cache.get('version') == STATS_VERSION:
+                    self._entries = cache['files']
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError, KeyError, AttributeError):
+                log.error(
+                    'Unable to read the log statistics cache (%s)',
+                    self.path,
+                    exc_info=True)
+        return self._entries
+
+    def get(self, path: Path) -> LogStats:
+        """
+        The statistics of a log file or a segment, scanned again if it
+        changed since they were cached
+        """
+        entries = self._load()
+        key = str(path.relative_to(self.log_dir))
+        try:
+            stat = path.stat()
+        except OSError:
+            entries.pop(key, None)
+            return LogStats()
+        entry = entries.get(key)
+        if entry is not None and entry['size'] == stat.st_size and \
+                entry['mtime'] == stat.st_mtime_ns:
+            return LogStats.from_json(entry['stats'])
+        stats = LogStats()
+        start = 0
+        if entry is not None and path.parent == self.log_dir and \
+                entry['inode'] == stat.st_ino and \
+                entry['size'] < stat.st_size:
+            # the messages were appended to a current log file (they are
+            # replaced, not truncated, when their segments are closed)
+            stats = LogStats.from_json(entry['stats'])
+            start = entry['size']
+        try:
+            scan_file(path, stats, start)
+        except (OSError, EOFError, ValueError, lzma.LZMAError):
+            log.error(
+                'Unable to read the log file (%s)', path, exc_info=True)
+            return LogStats()
+        entries[key] = {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'inode': stat.st_ino,
+            'stats': stats.to_json()
+        }
+        self._changed = True
+        return stats
+
+    def save(self) -> None:
+        if not self._changed:
+            return
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        try:
+            with tmp.open('w') as fd:
+                json.dump({
+                    'version': STATS_VERSION,
+                    'files': self._entries
+                }, fd)
+            os.replace(str(tmp), str(self.path))
+            self._changed = False
+        except OSError:
+            log.error(
+                'Unable to write the log statistics cache (%s)',
+                self.path,
+                exc_info=True)
+
+
+def log_stats(logs: Iterable[Path]) -> LogStats:
+    """
+    The statistics of log files and of their closed segments, cached in
+    the directory of each of them
+    """
+    caches = {}  # type: Dict[Path, StatsCache]
+    stats = LogStats()
+    for log_path in logs:
+        log_dir = log_path.parent
+        if log_dir not in caches:
+            caches[log_dir] = StatsCache(log_dir)
+        for part in log_parts(log_path):
+            stats.update(caches[log_dir].get(part))
+    for cache in caches.values():
+        cache.save()
+    return stats
+
+
+def stats_report(stats: LogStats) -> Dict[str, Any]:
+    "The statistics as a JSON object, for poezio_logs --stats --json"
+    return {
+        'messages': len(stats),
+        'size': stats.size,
+        'days': dict(stats.per_day()),
+        'nicks': dict(stats.nicks.most_common()),
+        'hours': stats.per_hour(),
+    }
+
+
+def format_stats(stats: LogStats, top: int = 10,
+                 last_days: Optional[int] = None) -> List[str]:
+    """
+    The lines of a report of the statistics, with the messages of each
+    day, or of the last_days ones only
+    """
+    if not stats.buckets:
+        return ['No message in the logs (%s bytes)' % stats.size]
+    days = stats.per_day()
+    lines = [
+        '%s messages, %s bytes, from %s to %s' % (len(stats), stats.size,
+                                                   days[0][0], days[-1][0]),
+        '%.1f messages per active day, over %s days' % (len(stats) / len(
+            days), len(days)),
+        'Top talkers:'
+    ]
+    for nick, count in stats.nicks.most_common(top):
+        lines.append('  %6s  %s' % (count, nick))
+    if last_days is None:
+        lines.append('Messages per day:')
+        listed = days
+    else:
+        lines.append('Messages per day (the last %s):' % last_days)
+        listed = days[-last_days:]
+    for day, count in listed:
+        lines.append('  %s  %6s' % (day, count))
+    lines.append('Busiest days:')
+    for day, count in sorted(days, key=lambda item: -item[1])[:top]:
+        lines.append('  %6s  %s' % (count, day))
+    lines.append('Busiest hours:')
+    hours = stats.per_hour()
+    busiest = max(hours)
+    for hour, count in enumerate(hours):
+        bar = '#' * (count * 40 // busiest)
+        lines.append('  %02d:00  %6s  %s' % (hour, count, bar))
+    return lines
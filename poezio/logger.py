@@ -9,10 +9,26 @@ The logger module that handles logging of the poezio
 conversations and roster changes
 """
 
+import asyncio
+import calendar
+import gzip
+import lzma
 import mmap
+import os
 import re
-from typing import List, Dict, Optional, IO, Any
-from datetime import datetime
+import shutil
+import struct
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import ExitStack
+from functools import lru_cache
+from itertools import islice
+from pathlib import Path
+from typing import (List, Dict, Iterable, Iterator, Optional, IO, Any,
+                    Pattern, Tuple, Union)
+from datetime import datetime, timedelta
 
 from poezio import common
 from poezio.config import config
@@ -31,6 +47,45 @@ MESSAGE_LOG_RE = re.compile(r'^MR (\d{4})(\d{2})(\d{2})T'
 INFO_LOG_RE = re.compile(r'^MI (\d{4})(\d{2})(\d{2})T'
                          r'(\d{2}):(\d{2}):(\d{2})Z '
                          r'(\d+) (.*)$')
+# the first line of a message, continuation lines start with a space
+LOG_HEADER_RE = re.compile(rb'^M[RI] (\d{8}T\d{2}:\d{2}:\d{2})Z ',
+                           re.MULTILINE)
+
+# the sidecar indexes of the log files are stored in this subdirectory
+# of log_dir, one per log file, with the same name
+INDEX_DIR = '.index'
+# one record per logged message: its UTC time, in seconds since the
+# epoch, and the byte offset of its first line in the log file
+INDEX_RECORD = struct.Struct('<qQ')
+INDEX_MIN_TIME = -2**63
+
+# the closed segments of the log files are stored in this subdirectory of
+# log_dir, in a directory per log file (with the same name), one file per
+# period, named after it (see log_segment_period)
+SEGMENT_DIR = '.segments'
+SEGMENT_PERIODS = {'day': '%Y-%m-%d', 'month': '%Y-%m', 'year': '%Y'}
+# the extension and the open() of each log_segment_compression
+SEGMENT_COMPRESSIONS = {
+    'gzip': ('.gz', gzip.open),
+    'xz': ('.xz', lzma.open),
+    'none': ('', open),
+}
+# the size of 'MR 20170301T12:00:00Z ', the start of a message
+LOG_HEADER_SIZE = 22
+_EPOCH = datetime(1970, 1, 1)
+# lookup tables of the fixed-offset parser of the message headers
+_HEADER_KINDS = {'MR ': True, 'MI ': False}
+_CLOCK_MINUTES = {
+    '%02d:%02d' % (hour, minute): hour * 3600 + minute * 60
+    for hour in range(24) for minute in range(60)
+}
+_CLOCK_SECONDS = {'%02d' % second: second for second in range(60)}
+_NB_LINES = {'%03d ' % nb: nb for nb in range(1000)}
+_BUCKET_SECONDS = tuple(timedelta(seconds=second) for second in range(600))
+
+# a parsed message: its UTC time in seconds since the epoch, its nick
+# (None for the info lines) and its text, see iter_log_messages()
+LogRecord = Tuple[int, Optional[str], str]
 
 
 class LogItem:
@@ -57,6 +112,9 @@ class LogMessage(LogItem):
 
 
 def parse_log_line(msg: str) -> Optional[LogItem]:
+    header = _parse_header(msg)
+    if header is not None:
+        return _log_item(*header)
     match = re.match(MESSAGE_LOG_RE, msg)
     if match:
         return LogMessage(*match.groups())
@@ -67,6 +125,274 @@ def parse_log_line(msg: str) -> Optional[LogItem]:
     return None
 
 
+def _log_item(utc_time: int, nb_lines: int, nick: Optional[str],
+              text: str) -> LogItem:
+    "Build the LogItem of a header parsed by _parse_header()"
+    item = LogInfo.__new__(LogInfo) if nick is None else LogMessage.__new__(
+        LogMessage)
+    item.time = _EPOCH + timedelta(seconds=utc_time)
+    item.nb_lines = nb_lines
+    item.text = text
+    if nick is not None:
+        item.nick = nick
+    return item
+
+
+@lru_cache(maxsize=1024)
+def _stamp_day(day: str) -> Optional[int]:
+    """
+    The UTC time of the start of the 'YYYYMMDD' day of a stamp, in
+    seconds since the epoch, or None if it is not a date
+    """
+    if len(day) != 8 or not day.isdecimal():
+        return None
+    year, month, mday = int(day[0:4]), int(day[4:6]), int(day[6:8])
+    try:
+        datetime(year, month, mday)
+    except ValueError:
+        return None
+    return calendar.timegm((year, month, mday, 0, 0, 0))
+
+
+def _parse_header(line: str) -> Optional[Tuple[int, int, Optional[str], str]]:
+    """
+    Parse the first line of a message by slicing its fields at their
+    fixed offsets: return its UTC time in seconds since the epoch, its
+    number of continuation lines, its nick (None for the MI lines) and
+    its text. Return None if the line does not have the usual layout,
+    parse_log_line() then tries the regexes.
+    """
+    is_message = _HEADER_KINDS.get(line[0:3])
+    if is_message is None or line[11:21:3] != 'T::Z' or line[21:22] != ' ':
+        return None
+    # the tables only have the valid values
+    day = _stamp_day(line[3:11])
+    minutes = _CLOCK_MINUTES.get(line[12:17])
+    seconds = _CLOCK_SECONDS.get(line[18:20])
+    if day is None or minutes is None or seconds is None:
+        return None
+    nb_lines = _NB_LINES.get(line[22:26])
+    if nb_lines is not None:
+        text = line[26:]
+    else:
+        end = line.find(' ', 22)
+        if end < 0 or not line[22:end].isdecimal():
+            return None
+        nb_lines = int(line[22:end])
+        text = line[end + 1:]
+    newline = text.find('\n')
+    if newline >= 0:
+        # only the line ending is allowed, like with the $ of the regexes
+        if newline != len(text) - 1:
+            return None
+        text = text[:-1]
+    nick = None
+    if is_message:
+        # '<nick> \xa0text', the nick has no no-break space
+        nick_end = text.find('\xa0')
+        if (nick_end < 4 or text[0] != '<'
+                or text[nick_end - 2:nick_end] != '> '):
+            return None
+        nick = text[1:nick_end - 2]
+        text = text[nick_end + 1:]
+    return day + minutes + seconds, nb_lines, nick, text
+
+
+@lru_cache(maxsize=4096)
+def _local_bucket(bucket: int) -> datetime:
+    """
+    The local time of the start of a ten minutes bucket (the UTC time
+    in seconds // 600). The time zones change on the hour or the half
+    hour, never inside a bucket.
+    """
+    return common.get_local_time(_EPOCH + timedelta(seconds=bucket * 600))
+
+
+def local_time(utc_time: int) -> datetime:
+    "common.get_local_time() of a UTC time in seconds since the epoch"
+    return _local_bucket(utc_time // 600) + _BUCKET_SECONDS[utc_time % 600]
+
+
+def _index_time(utc_time: datetime) -> int:
+    return calendar.timegm(utc_time.timetuple())
+
+
+def _header_time(stamp: bytes) -> int:
+    """The UTC time of a message, from the stamp of its first line"""
+    return calendar.timegm((int(stamp[0:4]), int(stamp[4:6]),
+                            int(stamp[6:8]), int(stamp[9:11]),
+                            int(stamp[12:14]), int(stamp[15:17])))
+
+
+class _IndexTimes:
+    """
+    Read-only sequence of the times stored in an index, to bisect it
+    without reading it all
+    """
+
+    def __init__(self, data: mmap.mmap):
+        self.data = data
+
+    def __len__(self) -> int:
+        return len(self.data) // INDEX_RECORD.size
+
+    def __getitem__(self, ordinal: int) -> int:
+        return INDEX_RECORD.unpack_from(self.data,
+                                        ordinal * INDEX_RECORD.size)[0]
+
+
+class LogIndex:
+    """
+    Append-only sidecar index of a log file, mapping the time and the
+    ordinal of each message to the byte offset where it starts.
+
+    The times are clamped so that they never decrease (older messages,
+    like MUC history, can be logged after newer ones), which keeps the
+    index sorted and lets it be bisected.
+    """
+
+    def __init__(self, log_path: Path, path: Path):
+        self.log_path = log_path
+        self.path = path
+        # the byte offset in the log file of the next message
+        self.offset = 0
+        self.last_time = INDEX_MIN_TIME
+        # the records not written yet, see write()
+        self.pending = []  # type: List[bytes]
+
+    def add(self, utc_time: datetime, logged_msg: str) -> None:
+        """Index a message, appended to the log file"""
+        self.last_time = max(_index_time(utc_time), self.last_time)
+        self.pending.append(INDEX_RECORD.pack(self.last_time, self.offset))
+        self.offset += len(logged_msg.encode('utf-8'))
+
+    def write(self) -> bool:
+        """Append the pending records to the index file"""
+        if not self.pending:
+            return True
+        records = b''.join(self.pending)
+        self.pending = []
+        try:
+            with self.path.open('ab') as fd:
+                fd.write(records)
+        except OSError:
+            log.error(
+                'Unable to write the log index (%s)', self.path, exc_info=True)
+            return False
+        return True
+
+    def sync(self) -> bool:
+        """
+        Index the messages that were appended to the log file without
+        being indexed (by an older poezio, or because writing the index
+        failed), or index the whole file again if the index does not
+        match it anymore. Only the new part of the log file is read.
+        """
+        self.pending = []
+        self.last_time = INDEX_MIN_TIME
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open('ab+') as index_fd:
+                index_size = index_fd.seek(0, os.SEEK_END)
+                index_size -= index_size % INDEX_RECORD.size
+                try:
+                    log_fd = self.log_path.open('rb')
+                except FileNotFoundError:
+                    index_fd.truncate(0)
+                    self.offset = 0
+                    return True
+                with log_fd:
+                    size = os.fstat(log_fd.fileno()).st_size
+                    if not size:
+                        index_fd.truncate(0)
+                        self.offset = 0
+                        return True
+                    with mmap.mmap(log_fd.fileno(), 0,
+                                   prot=mmap.PROT_READ) as data:
+                        records = self._index_new(index_fd, index_size, data)
+                    index_fd.write(b''.join(records))
+                    self.offset = size
+        except (OSError, ValueError):
+            log.error(
+                'Unable to update the log index (%s)',
+                self.path,
+                exc_info=True)
+            return False
+        return True
+
+    def _index_new(self, index_fd: IO[bytes], index_size: int,
+                   data: mmap.mmap) -> List[bytes]:
+        start = 0
+        if index_size:
+            index_fd.seek(index_size - INDEX_RECORD.size)
+            last_time, offset = INDEX_RECORD.unpack(
+                index_fd.read(INDEX_RECORD.size))
+            if offset < len(data) and LOG_HEADER_RE.match(data, offset):
+                # skip the last indexed message
+                start = offset + 1
+                self.last_time = last_time
+            else:
+                log.debug('Rebuilding the log index (%s)', self.path)
+                index_size = 0
+        index_fd.truncate(index_size)
+        records = []
+        for match in LOG_HEADER_RE.finditer(data, start):
+            msg_time = _header_time(match.group(1))
+            self.last_time = max(msg_time, self.last_time)
+            records.append(INDEX_RECORD.pack(self.last_time, match.start()))
+        return records
+
+    def select(self,
+               start: Optional[datetime] = None,
+               end: Optional[datetime] = None,
+               nb: Optional[int] = None,
+               before: Optional[int] = None) -> Optional[Tuple[int, int]]:
+        """
+        Return the byte range in the log file of the messages logged
+        between the UTC times start (included) and end (excluded), or of
+        the nb last ones before end or before the ordinal before.
+        None if there is no such message.
+        """
+        try:
+            fd = self.path.open('rb')
+        except OSError:
+            return None
+        with fd:
+            if os.fstat(fd.fileno()).st_size < INDEX_RECORD.size:
+                return None
+            with mmap.mmap(fd.fileno(), 0, prot=mmap.PROT_READ) as data:
+                times = _IndexTimes(data)
+                last = len(times)
+                if before is not None:
+                    last = min(max(before, 0), last)
+                if end is not None:
+                    last = bisect_left(times, _index_time(end), 0, last)
+                if nb is not None:
+                    first = max(last - nb, 0)
+                elif start is not None:
+                    first = bisect_left(times, _index_time(start), 0, last)
+                else:
+                    first = 0
+                if first >= last:
+                    return None
+                begin = INDEX_RECORD.unpack_from(
+                    data, first * INDEX_RECORD.size)[1]
+                if last < len(times):
+                    stop = INDEX_RECORD.unpack_from(
+                        data, last * INDEX_RECORD.size)[1]
+                else:
+                    stop = self.offset
+        return begin, stop
+
+    def find(self, utc_time: datetime) -> int:
+        """
+        Return the byte offset of the first message logged at or after
+        the UTC time, or the size of the log file if there is none
+        """
+        byte_range = self.select(start=utc_time)
+        return self.offset if byte_range is None else byte_range[0]
+
+
 class Logger:
     """
     Appends things to files. Error/information/warning logs
@@ -75,10 +401,41 @@ class Logger:
 
     def __init__(self):
         self._roster_logfile = None  # Optional[IO[Any]]
-        # a dict of 'groupchatname': file-object (opened)
-        self._fds = {}  # type: Dict[str, IO[Any]]
+        # a dict of 'groupchatname': file-object (opened), the least
+        # recently used first. At most log_max_open_files are kept open,
+        # and the ones unused for log_fd_idle_timeout seconds are closed;
+        # they are reopened on demand.
+        self._fds = OrderedDict()  # type: OrderedDict[str, IO[Any]]
+        self._fds_last_use = {}  # type: Dict[str, float]
+        # the index of each opened file, see LogIndex
+        self._indexes = {}  # type: Dict[IO[Any], LogIndex]
+        # the period of the first message of each opened file, when
+        # log_segment_period is set, see _check_segment()
+        self._periods = {}  # type: Dict[IO[Any], str]
+        self._idle_handle = None  # type: Optional[asyncio.TimerHandle]
+        # how many times an opened file was reused, or had to be opened
+        self.fd_hits = 0
+        self.fd_misses = 0
+        self._search = None  # type: Optional[LogSearch]
+        # the formatted records waiting to be written, for each file, see
+        # _write() and flush()
+        self._pending = {}  # type: Dict[IO[Any], List[str]]
+        self._pending_size = 0
+        self._flush_handle = None  # type: Optional[asyncio.TimerHandle]
+        # the roster changes of the current event loop iteration, as
+        # (time, jid, message), see log_roster_change()
+        self._roster_changes = []  # type: List[Tuple[float, str, str]]
+        self._roster_handle = None  # type: Optional[asyncio.Handle]
+        # the use_log value of each jid, see _use_log()
+        self._use_log_cache = {}  # type: Dict[str, bool]
 
     def __del__(self):
+        try:
+            self.flush()
+        except:  # Can't write? too bad
+            pass
+        if self._search is not None:
+            self._search.close()
         for opened_file in self._fds.values():
             if opened_file:
                 try:
@@ -89,22 +446,84 @@ class Logger:
     def close(self, jid) -> None:
         jid = str(jid).replace('/', '\\')
         if jid in self._fds:
-            self._fds[jid].close()
+            self._close_fd(jid)
             log.debug('Log file for %s closed.', jid)
-            del self._fds[jid]
         return None
 
     def reload_all(self) -> None:
-        """Close and reload all the file handles (on SIGHUP)"""
-        for opened_file in self._fds.values():
-            if opened_file:
-                opened_file.close()
+        """
+        Close all the file handles (on SIGHUP), they are reopened the next
+        time something is logged in them
+        """
+        self.flush()
+        for room in list(self._fds):
+            self._close_fd(room)
         log.debug('All log file handles closed')
-        for room in self._fds:
-            self._check_and_create_log_dir(room)
-            log.debug('Log handle for %s re-created', room)
         return None
 
+    def _get_fd(self, room: str) -> Optional[IO[Any]]:
+        """
+        Return the opened file for this room, opening it if it is not in
+        the pool (anymore)
+        """
+        fd = self._fds.get(room)
+        if fd is not None:
+            self.fd_hits += 1
+            self._fds.move_to_end(room)
+        else:
+            self.fd_misses += 1
+            fd = self._check_and_create_log_dir(room)
+            if fd is None:
+                return None
+        self._fds_last_use[room] = time.monotonic()
+        timeout = config.get('log_fd_idle_timeout')
+        if timeout > 0 and self._idle_handle is None:
+            self._idle_handle = asyncio.get_event_loop().call_later(
+                timeout, self._close_idle)
+        return fd
+
+    def _close_fd(self, room: str) -> None:
+        """
+        Write the records still pending for this room, and close its file
+        """
+        fd = self._fds.pop(room)
+        self._fds_last_use.pop(room, None)
+        index = self._indexes.pop(fd, None)
+        self._periods.pop(fd, None)
+        records = self._pending.pop(fd, None)
+        if records:
+            self._pending_size -= sum(
+                len(record.encode()) for record in records)
+            if self._write_records(fd, records) and index is not None:
+                index.write()
+        try:
+            fd.close()
+        except OSError:
+            log.error(
+                'Unable to close the log file (%s)',
+                getattr(fd, 'name', fd),
+                exc_info=True)
+
+    def _close_idle(self) -> None:
+        """
+        Close the files that have not been used for log_fd_idle_timeout
+        seconds, and check again when the next one will be.
+        """
+        self._idle_handle = None
+        timeout = config.get('log_fd_idle_timeout')
+        if timeout <= 0:
+            return
+        now = time.monotonic()
+        # the least recently used files come first
+        for room in list(self._fds):
+            idle = now - self._fds_last_use.get(room, now)
+            if idle < timeout:
+                self._idle_handle = asyncio.get_event_loop().call_later(
+                    timeout - idle, self._close_idle)
+                break
+            self._close_fd(room)
+            log.debug('Idle log file for %s closed.', room)
+
     def _check_and_create_log_dir(self, room: str,
                                   open_fd: bool = True) -> Optional[IO[Any]]:
         """
@@ -123,15 +542,207 @@ class Logger:
         if not open_fd:
             return None
         filename = log_dir / room
+        # the period of the first message of the file
+        first = None
+        period = SEGMENT_PERIODS.get(config.get('log_segment_period'))
+        if period is not None:
+            first = self._rotate(room, time.strftime(period, time.gmtime()))
         try:
             fd = filename.open('a', encoding='utf-8')
             self._fds[room] = fd
+            if first is not None:
+                self._periods[fd] = first
+            index = self._new_index(room)
+            if index.sync():
+                self._indexes[fd] = index
+            max_open = config.get('log_max_open_files')
+            while max_open > 0 and len(self._fds) > max_open:
+                self._close_fd(next(iter(self._fds)))
             return fd
         except IOError:
             log.error(
                 'Unable to open the log file (%s)', filename, exc_info=True)
         return None
 
+    def get_search(self) -> Optional['LogSearch']:
+        """
+        Return the full-text search database of the logs, None if
+        log_search_index is disabled
+        """
+        if not config.get('log_search_index'):
+            return None
+        if self._search is None:
+            from poezio.log_search import LogSearch, SEARCH_DB
+            self._search = LogSearch(log_dir / SEARCH_DB)
+        return self._search
+
+    def get_stats(self, jid: Optional[str] = None) -> 'asyncio.Future':
+        """
+        Compute the statistics of the logs of this jid, or of all the
+        conversations, in a thread. Return the future LogStats.
+        """
+        from poezio.log_search import conversation_logs
+        from poezio.log_stats import log_stats
+        self.flush()
+        if jid is None:
+            logs = conversation_logs(log_dir)
+        else:
+            logs = [log_dir / str(jid).replace('/', '\\')]
+        return asyncio.get_event_loop().run_in_executor(None, log_stats, logs)
+
+    @staticmethod
+    def _new_index(jid: str) -> LogIndex:
+        return LogIndex(log_dir / jid, log_dir / INDEX_DIR / jid)
+
+    def _check_segment(self, room: str, fd: IO[Any],
+                       utc_time: datetime) -> Optional[IO[Any]]:
+        """
+        Close the current segment of the log file of this room if the
+        message logged at this time belongs to a newer period, and return
+        the file to write it in.
+        """
+        period = SEGMENT_PERIODS.get(config.get('log_segment_period'))
+        if period is None:
+            return fd
+        name = utc_time.strftime(period)
+        if name <= self._periods.setdefault(fd, name):
+            return fd
+        self._close_fd(room)
+        self._rotate(room, name)
+        return self._get_fd(room)
+
+    @staticmethod
+    def _rotate(room: str, current: str) -> Optional[str]:
+        """
+        Move the messages of the periods before *current* from the log
+        file of this room to its closed segments (see rotate_log), and
+        return the period of the first message left in it. The file must
+        not be opened.
+        """
+        period = SEGMENT_PERIODS[config.get('log_segment_period')]
+        try:
+            moved, first = rotate_log(log_dir / room,
+                                      log_dir / SEGMENT_DIR / room, period,
+                                      current,
+                                      config.get('log_segment_compression'))
+        except OSError:
+            log.error(
+                'Unable to close the log segment of %s', room, exc_info=True)
+            # don’t try again for each message
+            return current
+        if moved:
+            log.debug('Log segment of %s closed.', room)
+            try:
+                (log_dir / INDEX_DIR / room).unlink()
+            except FileNotFoundError:
+                pass
+            except OSError:
+                log.error(
+                    'Unable to remove the log index of %s',
+                    room,
+                    exc_info=True)
+        return first
+
+    def _read_indexed(self, jid: str,
+                      **criteria) -> Optional[List[Dict[str, Any]]]:
+        """
+        Read the messages selected by LogIndex.select() in the log file
+        of this jid
+        """
+        if not config.get_by_tabname('use_log', jid):
+            return None
+        jid = str(jid).replace('/', '\\')
+        self.flush()
+        index = self._new_index(jid)
+        if not index.sync():
+            return None
+        byte_range = index.select(**criteria)
+        if byte_range is None:
+            return []
+        begin, stop = byte_range
+        filename = log_dir / jid
+        try:
+            with filename.open('rb') as fd:
+                fd.seek(begin)
+                data = fd.read(stop - begin)
+        except OSError:
+            log.error(
+                'Unable to read the log file (%s)', filename, exc_info=True)
+            return None
+        return parse_log_data(data).messages()
+
+    @staticmethod
+    def _read_segments(jid: str,
+                       end: Optional[datetime] = None,
+                       start: Optional[datetime] = None,
+                       nb: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Read the messages logged before the local time end (all of them if
+        it is None) and at or after start in the closed segments of the
+        log file of this jid, or the nb last ones. Only the segments of
+        the periods in that range are read.
+        """
+        utc_end = None if end is None else common.get_utc_time(end)
+        utc_start = None if start is None else common.get_utc_time(start)
+        messages = []  # type: List[Dict[str, Any]]
+        for segment in reversed(log_segments(log_dir / jid)):
+            period_start = segment_start(segment)
+            if (utc_end is not None and period_start is not None
+                    and period_start >= utc_end):
+                continue
+            data = read_segment(segment)
+            messages = [
+                message
+                for message in parse_log_data(data).messages()
+                if (end is None or message['time'] < end) and (
+                    start is None or message['time'] >= start)
+            ] + messages
+            if nb is not None and len(messages) >= nb:
+                return messages[-nb:]
+            if (utc_start is not None and period_start is not None
+                    and period_start <= utc_start):
+                break
+        return messages
+
+    def get_logs_between(self, jid: str, start: datetime,
+                         end: datetime) -> Optional[List[Dict[str, Any]]]:
+        """
+        Get the messages logged for this jid between the local times
+        start (included) and end (excluded), using the index of its log
+        file instead of reading all of it. The closed segments of the
+        file are only read if the range starts before it.
+        """
+        utc_start = common.get_utc_time(start)
+        logs = self._read_indexed(
+            jid, start=utc_start, end=common.get_utc_time(end))
+        if logs is None:
+            return None
+        jid = str(jid).replace('/', '\\')
+        if self._new_index(jid).select(end=utc_start) is None:
+            logs = self._read_segments(jid, end, start=start) + logs
+        return logs
+
+    def get_logs_before(self, jid: str, nb: int,
+                        before: Union[datetime, int, None] = None
+                        ) -> Optional[List[Dict[str, Any]]]:
+        """
+        Get the nb messages logged for this jid before a local time, or
+        before the given message ordinal (its position in the current
+        segment of the log file, starting at 0), or the nb last ones.
+        """
+        if nb <= 0:
+            return []
+        if isinstance(before, datetime):
+            logs = self._read_indexed(
+                jid, nb=nb, end=common.get_utc_time(before))
+        else:
+            logs = self._read_indexed(jid, nb=nb, before=before)
+            before = None
+        if logs is None or len(logs) >= nb:
+            return logs
+        jid = str(jid).replace('/', '\\')
+        return self._read_segments(jid, before, nb=nb - len(logs)) + logs
+
     def get_logs(self, jid: str,
                  nb: int = 10) -> Optional[List[Dict[str, Any]]]:
         """
@@ -150,32 +761,49 @@ class Logger:
             return None
 
         self._check_and_create_log_dir(jid, open_fd=False)
+        # make sure the records still waiting are in the file
+        self.flush()
 
         filename = log_dir / jid
+        segments = log_segments(filename)
         try:
             fd = filename.open('rb')
         except FileNotFoundError:
-            log.info('Non-existing log file (%s)', filename, exc_info=True)
-            return None
+            if not segments:
+                log.info(
+                    'Non-existing log file (%s)', filename, exc_info=True)
+                return None
+            fd = None
         except OSError:
             log.error(
                 'Unable to open the log file (%s)', filename, exc_info=True)
             return None
-        if not fd:
-            return None
 
         # read the needed data from the file, we just search nb messages by
         # searching "\nM" nb times from the end of the file.  We use mmap to
         # do that efficiently, instead of seek()s and read()s which are costly.
-        with fd:
-            try:
-                lines = get_lines_from_fd(fd, nb=nb)
-            except Exception:  # file probably empty
-                log.error(
-                    'Unable to mmap the log file for (%s)',
-                    filename,
-                    exc_info=True)
-                return None
+        lines = []  # type: List[str]
+        if fd is not None:
+            with fd:
+                try:
+                    lines = get_lines_from_fd(fd, nb=nb)
+                except Exception:
+                    log.error(
+                        'Unable to mmap the log file for (%s)',
+                        filename,
+                        exc_info=True)
+                    return None
+        # the older messages are in the closed segments, only read when the
+        # current one does not have enough
+        missing = nb - _count_messages(lines)
+        for segment in reversed(segments):
+            if missing <= 0:
+                break
+            data = read_segment(segment)
+            older = data[rfind_messages(data, len(data), missing):].decode(
+                errors='replace').splitlines()
+            missing -= _count_messages(older)
+            lines = older + lines
         return parse_log_lines(lines)
 
     def log_message(self,
@@ -191,44 +819,70 @@ class Logger:
               1 = Message
               2 = Status/whatever
         """
-        if not config.get_by_tabname('use_log', jid):
+        if not self._use_log(jid):
             return True
+        if date is None:
+            date = datetime.now()
         logged_msg = build_log_message(nick, msg, date=date, typ=typ)
         if not logged_msg:
             return True
-        if jid in self._fds.keys():
-            fd = self._fds[jid]
-        else:
-            option_fd = self._check_and_create_log_dir(jid)
-            if option_fd is None:
-                return True
-            fd = option_fd
-        filename = log_dir / jid
-        try:
-            fd.write(logged_msg)
-        except OSError:
-            log.error(
-                'Unable to write in the log file (%s)',
-                filename,
-                exc_info=True)
-            return False
-        else:
-            try:
-                fd.flush()  # TODO do something better here?
-            except OSError:
-                log.error(
-                    'Unable to flush the log file (%s)',
-                    filename,
-                    exc_info=True)
-                return False
-        return True
+        fd = self._get_fd(jid)
+        if fd is None:
+            return True
+        utc_time = common.get_utc_time(date)
+        fd = self._check_segment(jid, fd, utc_time)
+        if fd is None:
+            return True
+        index = self._indexes.get(fd)
+        if index is not None:
+            index.add(utc_time, logged_msg)
+        search = self.get_search() if typ == 1 else None
+        if search is not None:
+            search.add(
+                jid.replace('\\', '/'), nick, utc_time, clean_text(msg))
+        return self._write(fd, logged_msg)
+
+    def _use_log(self, jid: str) -> bool:
+        """
+        The use_log option of this jid, cached until it changes (see
+        on_use_log_change)
+        """
+        use_log = self._use_log_cache.get(jid)
+        if use_log is None:
+            use_log = bool(config.get_by_tabname('use_log', jid))
+            self._use_log_cache[jid] = use_log
+        return use_log
+
+    def on_use_log_change(self, option: str, value: str) -> None:
+        "Forget the cached use_log values when the option is changed"
+        self._use_log_cache.clear()
 
     def log_roster_change(self, jid: str, message: str) -> bool:
         """
-        Log a roster change
+        Log a roster change. The changes of an event loop iteration (the
+        presences received at login, for example) are formatted and
+        queued in a single batch, see _queue_roster_changes.
         """
-        if not config.get_by_tabname('use_log', jid):
+        if not self._use_log(jid):
+            return True
+        self._roster_changes.append((time.time(), jid, message))
+        if self._roster_handle is None:
+            self._roster_handle = asyncio.get_event_loop().call_soon(
+                self._queue_roster_changes)
+        return True
+
+    def _queue_roster_changes(self) -> bool:
+        """
+        Format the pending roster changes and queue them in roster.log,
+        as a single record
+        """
+        if self._roster_handle is not None:
+            self._roster_handle.cancel()
+            self._roster_handle = None
+        changes = self._roster_changes
+        if not changes:
             return True
+        self._roster_changes = []
         self._check_and_create_log_dir('', open_fd=False)
         filename = log_dir / 'roster.log'
         if not self._roster_logfile:
@@ -240,26 +894,210 @@ class Logger:
                     filename,
                     exc_info=True)
                 return False
-        try:
-            str_time = common.get_utc_time().strftime('%Y%m%dT%H:%M:%SZ')
-            message = clean_text(message)
-            lines = message.split('\n')
+        records = []
+        last_second = None
+        str_time = ''
+        for change_time, jid, message in changes:
+            second = int(change_time)
+            if second != last_second:
+                last_second = second
+                str_time = time.strftime('%Y%m%dT%H:%M:%SZ',
+                                         time.gmtime(second))
+            lines = clean_text(message).split('\n')
             first_line = lines.pop(0)
             nb_lines = str(len(lines)).zfill(3)
-            self._roster_logfile.write(
-                'MI %s %s %s %s\n' % (str_time, nb_lines, jid, first_line))
-            for line in lines:
-                self._roster_logfile.write(' %s\n' % line)
-            self._roster_logfile.flush()
-        except:
+            records.append('MI %s %s %s %s\n' % (str_time, nb_lines, jid,
+                                                  first_line))
+            records.extend(' %s\n' % line for line in lines)
+        return self._write(self._roster_logfile, ''.join(records))
+
+    def _write(self, fd: IO[Any], logged_msg: str) -> bool:
+        """
+        Queue a formatted record to be written in the given file. The
+        pending records are written in a single batch (see flush), after
+        log_flush_interval seconds or once log_flush_size bytes are
+        pending, whichever comes first.
+        Return False if the records were written right away and that
+        failed.
+        """
+        self._pending.setdefault(fd, []).append(logged_msg)
+        self._pending_size += len(logged_msg.encode())
+        interval = config.get('log_flush_interval')
+        if interval <= 0 or self._pending_size >= config.get('log_flush_size'):
+            return self.flush()
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_event_loop().call_later(
+                interval, self.flush)
+        return True
+
+    def flush(self) -> bool:
+        """
+        Write all the pending records, with one write() and flush() per
+        file. Return False if a file could not be written.
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        success = self._queue_roster_changes()
+        pending = self._pending
+        self._pending = {}
+        self._pending_size = 0
+        for fd, records in pending.items():
+            index = self._indexes.get(fd)
+            if self._write_records(fd, records):
+                if index is not None:
+                    index.write()
+            else:
+                success = False
+                # the offsets it knows are wrong now, the index is synced
+                # again the next time the file is opened
+                self._indexes.pop(fd, None)
+        if self._search is not None:
+            # indexed in the thread of the database, which logs the errors
+            self._search.commit()
+        return success
+
+    @staticmethod
+    def _write_records(fd: IO[Any], records: List[str]) -> bool:
+        try:
+            fd.write(''.join(records))
+            fd.flush()
+        except (OSError, ValueError):
             log.error(
                 'Unable to write in the log file (%s)',
-                filename,
+                getattr(fd, 'name', fd),
                 exc_info=True)
             return False
         return True
 
 
+class LogPager:
+    """
+    Read the messages logged for a jid before a given time, one page at
+    a time and backwards, for the scrollback of its tab (see
+    TextBuffer.history_page). Once the start of the log file is reached,
+    the pages are read from its closed segments, the most recent first.
+
+    The pages are numbered from the most recent one (0). Only their
+    offsets are kept, so a page can be read again after the tab dropped
+    it.
+    """
+
+    def __init__(self, jid: str, page_size: int = 50):
+        self.jid = jid
+        self.page_size = page_size
+        self._before = None  # type: Optional[datetime]
+        # the (source, start, end) byte range of each page, the source
+        # being 0 for the log file and n for its n-th most recent segment
+        self._pages = []  # type: List[Tuple[int, int, int]]
+        # the segments, the most recent first, when the pages were found
+        self._segments = []  # type: List[Path]
+        # the source and the content of the last segment read
+        self._segment_data = (0, b'')  # type: Tuple[int, bytes]
+
+    def page(self, number: int,
+             before: Optional[datetime]) -> Optional[List[Dict[str, Any]]]:
+        """
+        Return the messages of the page *number*, going back from the
+        local time *before* (or from the end of the file if it is None),
+        None if there is no such page.
+        """
+        if before != self._before:
+            self._before = before
+            self._pages = []
+        if not config.get_by_tabname('use_log', self.jid):
+            return None
+        filename = log_dir / self.jid
+        segments = log_segments(filename)[::-1]
+        if segments != self._segments:
+            # a segment was closed, the offsets changed
+            self._segments = segments
+            self._segment_data = (0, b'')
+            self._pages = []
+        try:
+            fd = filename.open('rb')
+        except FileNotFoundError:
+            fd = None
+        except OSError:
+            log.error(
+                'Unable to open the log file (%s)', filename, exc_info=True)
+            return None
+        with ExitStack() as stack:
+            live = b''  # type: Union[bytes, mmap.mmap]
+            if fd is not None:
+                stack.enter_context(fd)
+                if os.fstat(fd.fileno()).st_size:
+                    live = stack.enter_context(
+                        mmap.mmap(fd.fileno(), 0, prot=mmap.PROT_READ))
+            if self._pages and self._pages[0][0] == 0 and (
+                    self._pages[0][2] > len(live)):
+                # the file was truncated
+                self._pages = []
+            if not self._pages and not self._first_page(filename, live):
+                return None
+            # the backward search of the page boundaries only goes as far
+            # as needed
+            while len(self._pages) <= number:
+                if not self._next_page(live):
+                    return None
+            source, start, end = self._pages[number]
+            data = self._data(source, live)[start:end]
+        return parse_log_data(data).messages()
+
+    def _data(self, source: int,
+              live: Union[bytes, mmap.mmap]) -> Union[bytes, mmap.mmap]:
+        if not source:
+            return live
+        if self._segment_data[0] != source:
+            self._segment_data = (source,
+                                  read_segment(self._segments[source - 1]))
+        return self._segment_data[1]
+
+    def _first_page(self, filename: Path,
+                    live: Union[bytes, mmap.mmap]) -> bool:
+        """
+        Find the last page before self._before, in the log file or in
+        the most recent segment having messages before it
+        """
+        before = self._before
+        utc_before = None
+        if before is not None:
+            utc_before = _index_time(common.get_utc_time(before))
+        for source in range(len(self._segments) + 1):
+            data = self._data(source, live)
+            if before is None:
+                end = len(data)
+            elif source == 0:
+                index = LogIndex(filename, log_dir / INDEX_DIR / self.jid)
+                if not index.sync():
+                    return False
+                end = index.find(common.get_utc_time(before))
+            else:
+                end = find_time(data, utc_before)
+            if end:
+                self._pages.append((source,
+                                    rfind_messages(data, end,
+                                                   self.page_size), end))
+                return True
+        return False
+
+    def _next_page(self, live: Union[bytes, mmap.mmap]) -> bool:
+        """
+        Find the page preceding the last one found, going to the next
+        segment at the start of a file
+        """
+        source, end, _ = self._pages[-1]
+        while not end:
+            source += 1
+            if source > len(self._segments):
+                return False
+            end = len(self._data(source, live))
+        data = self._data(source, live)
+        self._pages.append((source, rfind_messages(data, end,
+                                                   self.page_size), end))
+        return True
+
+
 def build_log_message(nick: str,
                       msg: str,
                       date: Optional[datetime] = None,
@@ -290,62 +1128,384 @@ def build_log_message(nick: str,
     return logged_msg + ''.join(' %s\n' % line for line in lines)
 
 
+def rfind_messages(data: mmap.mmap, end: int, nb: int) -> int:
+    """
+    Return the offset of the nb-th message starting before the offset
+    end (the start of a message, or the size of the file), searching
+    backwards, or 0 if there are not that many.
+    """
+    # messages begin with MI or MR, after a \n (the one at end - 1
+    # ends the previous message)
+    pos = end - 1
+    count = 0
+    while count < nb and pos > 0:
+        pos = data.rfind(b"\nM", 0, pos)
+        count += 1
+    return max(pos + 1, 0) if count == nb else 0
+
+
+def find_time(data: bytes, utc_time: int) -> int:
+    """
+    Return the offset of the first message logged at or after the UTC
+    time (in seconds since the epoch) in the data of a log file without
+    index, or its size if there is none. The times are clamped like in
+    LogIndex.
+    """
+    last = INDEX_MIN_TIME
+    for match in LOG_HEADER_RE.finditer(data):
+        last = max(_header_time(match.group(1)), last)
+        if last >= utc_time:
+            return match.start()
+    return len(data)
+
+
+def log_segments(log_path: Path) -> List[Path]:
+    """
+    Return the closed segments of a log file, the oldest first
+    """
+    directory = log_path.parent / SEGMENT_DIR / log_path.name
+    try:
+        return sorted(path for path in directory.iterdir()
+                      if not path.name.startswith('.'))
+    except OSError:
+        return []
+
+
+def segment_start(segment: Path) -> Optional[datetime]:
+    """
+    Return the UTC time at which the period of a segment starts, from
+    its name, None if it is not a known period
+    """
+    name = segment.name.split('.')[0]
+    for period in SEGMENT_PERIODS.values():
+        try:
+            return datetime.strptime(name, period)
+        except ValueError:
+            pass
+    return None
+
+
+def open_log_file(path: Path, text: bool = False) -> IO[Any]:
+    """
+    Open a log file or a segment for reading, decompressing it according
+    to its extension
+    """
+    opener = open
+    for extension, segment_opener in SEGMENT_COMPRESSIONS.values():
+        if extension and path.name.endswith(extension):
+            opener = segment_opener
+    if text:
+        return opener(str(path), 'rt', encoding='utf-8', errors='replace')
+    return opener(str(path), 'rb')
+
+
+def read_segment(segment: Path) -> bytes:
+    """
+    Return the (decompressed) content of a segment, nothing if it can not
+    be read
+    """
+    try:
+        with open_log_file(segment) as fd:
+            return fd.read()
+    except (OSError, EOFError, lzma.LZMAError):
+        log.error(
+            'Unable to read the log segment (%s)', segment, exc_info=True)
+        return b''
+
+
+def log_parts(log_path: Path,
+              start: Optional[datetime] = None,
+              end: Optional[datetime] = None) -> List[Path]:
+    """
+    Return the closed segments of a log file, the oldest first, and the
+    file itself. With a UTC time range, only the ones whose period may
+    have messages logged at or after start and before end.
+    """
+    segments = log_segments(log_path)
+    if start is None and end is None:
+        return segments + [log_path]
+    starts = [segment_start(segment) for segment in segments]
+    selected = []
+    # a period ends where the next one starts, and the current file
+    # starts after the last segment
+    for i, segment in enumerate(segments + [log_path]):
+        period_start = starts[min(i, len(starts) - 1)] if starts else None
+        period_end = starts[i + 1] if i + 1 < len(starts) else None
+        if (end is not None and period_start is not None
+                and period_start >= end):
+            continue
+        if (start is not None and period_end is not None
+                and period_end <= start):
+            continue
+        selected.append(segment)
+    return selected
+
+
+def filter_log_messages(records: Iterable[LogRecord],
+                        start: Optional[int] = None,
+                        end: Optional[int] = None,
+                        nicks: Optional[Iterable[str]] = None,
+                        pattern: Optional[Pattern] = None,
+                        info: bool = True) -> Iterator[LogRecord]:
+    """
+    Keep the messages logged at or after the UTC time start and before
+    end (in seconds since the epoch), said by one of the nicks, and whose
+    text matches the regex pattern. The info lines are only kept if info
+    is True and no nick is given.
+    """
+    nicks = None if nicks is None else set(nicks)
+    for record in records:
+        utc_time, nick, text = record
+        if start is not None and utc_time < start:
+            continue
+        if end is not None and utc_time >= end:
+            continue
+        if nick is None and not info:
+            continue
+        if nicks is not None and nick not in nicks:
+            continue
+        if pattern is not None and not pattern.search(text):
+            continue
+        yield record
+
+
+def read_log_part(path: Path, **filters) -> List[LogRecord]:
+    """
+    Read the messages of a closed segment or of a log file, selected by
+    filter_log_messages(). This is what poezio_logs runs in each process.
+    """
+    try:
+        fd = open_log_file(path, text=True)
+    except FileNotFoundError:
+        return []
+    except OSError:
+        log.error('Unable to read the log file (%s)', path, exc_info=True)
+        return []
+    with fd:
+        try:
+            return list(filter_log_messages(iter_log_messages(fd), **filters))
+        except (OSError, EOFError, lzma.LZMAError):
+            log.error(
+                'Unable to read the log file (%s)', path, exc_info=True)
+            return []
+
+
+def read_log_lines(log_path: Path) -> Iterator[str]:
+    """
+    Read the lines of a log file, starting with the ones of its closed
+    segments
+    """
+    for path in log_parts(log_path):
+        try:
+            fd = open_log_file(path, text=True)
+        except FileNotFoundError:
+            continue
+        with fd:
+            yield from fd
+
+
+def rotate_log(log_path: Path, segment_dir: Path, period: str, current: str,
+               compression: str) -> Tuple[bool, Optional[str]]:
+    """
+    Move the messages of a log file logged before the *current* period to
+    the segments of their periods in segment_dir (appending to them if
+    they already exist, unless they already end with these messages after
+    an interrupted rotation), compressed, leaving only the newer ones in
+    the file. The times are clamped like in LogIndex, so that a message is
+    never moved to an older segment than the ones before it.
+
+    Return whether messages were moved, and the period of the first
+    message left in the file (None if it is empty). Only the start of
+    the file is read if there is nothing to move. Raise OSError.
+    """
+    extension, opener = SEGMENT_COMPRESSIONS.get(
+        compression, SEGMENT_COMPRESSIONS['gzip'])
+    try:
+        fd = log_path.open('rb')
+    except FileNotFoundError:
+        return False, None
+    with fd:
+        match = LOG_HEADER_RE.match(fd.read(LOG_HEADER_SIZE))
+        if match is not None:
+            first = time.strftime(period,
+                                  time.gmtime(_header_time(match.group(1))))
+            if first >= current:
+                return False, first
+        size = os.fstat(fd.fileno()).st_size
+        if not size:
+            return False, None
+        with mmap.mmap(fd.fileno(), 0, prot=mmap.PROT_READ) as data:
+            # the period and offset of each segment to write
+            chunks = []  # type: List[Tuple[str, int]]
+            last = INDEX_MIN_TIME
+            name = None  # type: Optional[str]
+            cut = size
+            for match in LOG_HEADER_RE.finditer(data):
+                msg_time = _header_time(match.group(1))
+                if msg_time <= last:
+                    continue
+                last = msg_time
+                msg_period = time.strftime(period, time.gmtime(msg_time))
+                if msg_period == name:
+                    continue
+                name = msg_period
+                if name >= current:
+                    cut = match.start()
+                    break
+                chunks.append((name, match.start()))
+            if not chunks:
+                return False, name
+            segment_dir.mkdir(parents=True, exist_ok=True)
+            # whatever precedes the first message goes with it
+            starts = [0] + [start for _, start in chunks[1:]]
+            ends = starts[1:] + [cut]
+            # the segments are written to copies renamed when complete; if
+            # the log file was not replaced after that, their chunks are
+            # already at the end of the segments the next time
+            written = []  # type: List[Tuple[Path, Path]]
+            for (name, _), start, end in zip(chunks, starts, ends):
+                segment = segment_dir / (name + extension)
+                chunk = data[start:end]
+                if segment.exists() and _ends_with(segment, opener, chunk):
+                    continue
+                copy = segment_dir / ('.' + segment.name)
+                if segment.exists():
+                    shutil.copyfile(str(segment), str(copy))
+                with opener(str(copy), 'ab') as segment_fd:
+                    segment_fd.write(chunk)
+                written.append((copy, segment))
+            rest = segment_dir / '.rest'
+            with rest.open('wb') as rest_fd:
+                rest_fd.write(data[cut:])
+        first = None
+        if cut < size:
+            first = time.strftime(period, time.gmtime(last))
+    for copy, segment in written:
+        os.replace(str(copy), str(segment))
+    os.replace(str(rest), str(log_path))
+    return True, first
+
+
+def _ends_with(segment: Path, opener: Any, chunk: bytes) -> bool:
+    """
+    Return whether the (decompressed) content of a segment ends with chunk
+    """
+    tail = b''
+    with opener(str(segment), 'rb') as fd:
+        for block in iter(lambda: fd.read(65536), b''):
+            tail = (tail + block)[-len(chunk):]
+    return tail == chunk
+
+
 def get_lines_from_fd(fd: IO[Any], nb: int = 10) -> List[str]:
     """
     Get the last log lines from a fileno
     """
+    if not os.fstat(fd.fileno()).st_size:
+        return []
     with mmap.mmap(fd.fileno(), 0, prot=mmap.PROT_READ) as m:
-        pos = m.rfind(b"\nM")  # start of messages begin with MI or MR,
-        # after a \n
-        # number of message found so far
-        count = 0
-        while pos != -1 and count < nb - 1:
-            count += 1
-            pos = m.rfind(b"\nM", 0, pos)
-        if pos == -1:  # If we don't have enough lines in the file
-            pos = 1  # 1, because we do -1 just on the next line
-            # to get 0 (start of the file)
-        lines = m[pos - 1:].decode(errors='replace').splitlines()
+        pos = rfind_messages(m, len(m), nb)
+        lines = m[pos:].decode(errors='replace').splitlines()
     return lines
 
 
-def parse_log_lines(lines: List[str]) -> List[Dict[str, Any]]:
+def _count_messages(lines: List[str]) -> int:
+    # the other lines of a message start with a space
+    return sum(1 for line in lines if line.startswith('M'))
+
+
+class LogColumns:
     """
-    Parse raw log lines into poezio log objects
+    The messages parsed from log lines, stored by field: times is an
+    array('q') of their UTC times in seconds since the epoch, nicks has
+    None for the info lines, and texts has their continuation lines
+    joined with \\n.
     """
-    messages = []
-    color = '\x19%s}' % dump_tuple(get_theme().COLOR_LOG_MSG)
+    __slots__ = ('times', 'nicks', 'texts')
+
+    def __init__(self):
+        self.times = array('q')
+        self.nicks = []  # type: List[Optional[str]]
+        self.texts = []  # type: List[str]
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def local_time(self, index: int) -> datetime:
+        return local_time(self.times[index])
 
-    # now convert that data into actual Message objects
-    idx = 0
-    while idx < len(lines):
-        if lines[idx].startswith(' '):  # should not happen ; skip
-            idx += 1
+    def messages(self) -> List[Dict[str, Any]]:
+        """
+        The messages as poezio log objects, see parse_log_lines()
+        """
+        messages = []
+        color = '\x19%s}' % dump_tuple(get_theme().COLOR_LOG_MSG)
+        for utc_time, nick, text in zip(self.times, self.nicks, self.texts):
+            message = {
+                'history': True,
+                'time': local_time(utc_time)
+            }  # type: Dict[str, Any]
+            if nick is not None:
+                message['nickname'] = nick
+            message['txt'] = color + text
+            messages.append(message)
+        return messages
+
+
+def iter_log_messages(lines: Iterable[str]) -> Iterator[LogRecord]:
+    """
+    Parse raw log lines lazily, the lines may keep their line ending
+    """
+    lines = iter(lines)
+    for line in lines:
+        if line.startswith(' '):  # should not happen ; skip
             log.debug('fail?')
             continue
-        log_item = parse_log_line(lines[idx])
-        idx += 1
-        if not isinstance(log_item, LogItem):
-            log.debug('wrong log format? %s', log_item)
-            continue
-        message_lines = []
-        message = {
-            'history': True,
-            'time': common.get_local_time(log_item.time)
-        }
-        size = log_item.nb_lines
-        if isinstance(log_item, LogInfo):
-            message_lines.append(color + log_item.text)
-        elif isinstance(log_item, LogMessage):
-            message['nickname'] = log_item.nick
-            message_lines.append(color + log_item.text)
-        while size != 0 and idx < len(lines):
-            message_lines.append(lines[idx][1:])
-            size -= 1
-            idx += 1
-        message['txt'] = '\n'.join(message_lines)
-        messages.append(message)
-    return messages
+        header = _parse_header(line)
+        if header is not None:
+            utc_time, size, nick, text = header
+        else:
+            log_item = parse_log_line(line)
+            if log_item is None:
+                log.debug('wrong log format? %s', line)
+                continue
+            utc_time = _index_time(log_item.time)
+            size = log_item.nb_lines
+            nick = getattr(log_item, 'nick', None)
+            text = log_item.text
+        if size:
+            more = [extra[1:].rstrip('\n') for extra in islice(lines, size)]
+            text = '\n'.join([text] + more)
+        yield utc_time, nick, text
+
+
+def parse_log_columns(lines: Iterable[str]) -> LogColumns:
+    """
+    Parse raw log lines into columns
+    """
+    columns = LogColumns()
+    times = columns.times
+    nicks = columns.nicks
+    texts = columns.texts
+    for utc_time, nick, text in iter_log_messages(lines):
+        times.append(utc_time)
+        nicks.append(nick)
+        texts.append(text)
+    return columns
+
+
+def parse_log_data(data: bytes) -> LogColumns:
+    """
+    Parse the raw data of a log file into columns
+    """
+    return parse_log_columns(data.decode(errors='replace').splitlines())
+
+
+def parse_log_lines(lines: Iterable[str]) -> List[Dict[str, Any]]:
+    """
+    Parse raw log lines into poezio log objects
+    """
+    return parse_log_columns(lines).messages()
 
 
 def create_logger() -> None:
@@ -6,7 +6,9 @@
 # it under the terms of the zlib license. See the COPYING file.
 '''This is a template module just for instruction. And poopt.'''
 
-from typing import List, Tuple
+import re
+from array import array
+from typing import List, Sequence, Tuple
 
 # CFFI codepath.
 from cffi import FFI
@@ -84,7 +86,7 @@ def cut_text(string: str, width: int) -> List[Tuple[int, int]]:
     # python string). This is used to determine the position in the python
     # string at which we should cut */
     #: unsigned int
-    #spos = -1
+    spos = -1
 
     in_special_character = False
     for spos, wc in enumerate(string):
@@ -146,6 +148,30 @@ def cut_text(string: str, width: int) -> List[Tuple[int, int]]:
     return retlist
 
 
+# cut_text_many: the same as cut_text, for a list of strings and the list of
+# their widths, in a single call.
+#
+# The lines of all the strings are returned in a flat array of unsigned
+# ints, each line taking three of them: the index of the string in the
+# list, and the start and end positions of the line in that string.
+#
+# For example,
+# poopt_cut_text_many(["vivent les", "réfrigérateurs"], [6, 10]);
+# will return array('I', [0, 0, 6, 0, 6, 10, 1, 0, 10, 1, 10, 14])
+def cut_text_many(texts: Sequence[str], widths: Sequence[int]) -> array:
+    '''cut_text_many(texts, widths)
+
+    Return an array('I') of (index, start, end) triples, one per line of each text cut to its width.'''
+
+    if len(texts) != len(widths):
+        raise ValueError('texts and widths must have the same length')
+    lines = array('I')
+    for index, (string, width) in enumerate(zip(texts, widths)):
+        for start, end in cut_text(string, width):
+            lines.extend((index, start, end))
+    return lines
+
+
 # wcswidth: An emulation of the POSIX wcswidth(3) function using xwcwidth.
 def wcswidth(string: str) -> int:
     '''wcswidth(s)
@@ -183,3 +209,127 @@ def cut_by_columns(string: str, limit: int) -> str:
         spos += 1
         columns += cols
     return string[:spos]
+
+
+# The attribute flags set by the \x19b, \x19u and \x19i format chars in the
+# runs returned by parse_format. They are the same values as ATTR_BOLD,
+# ATTR_UNDERLINE and ATTR_ITALIC in poezio.windows.base_wins.
+_FORMAT_FLAGS = {'b': 1, 'u': 2, 'i': 4}
+_DIGITS = '0123456789'
+# The colors are at most 9 digits long, to fit in a C int in pooptmodule.c
+_INT_RE = re.compile('-?[0-9]{1,9}')
+
+
+# _parse_color: parses the inside of a \x19…} format char, and returns the
+# (color, char) it contains, the color being None if it is not valid.
+def _parse_color(color_str: str):
+    parts = color_str.split(',')
+    if not all(_INT_RE.fullmatch(part) for part in parts[:2]):
+        return None, None
+    if len(parts) == 1:
+        return (int(parts[0]), -1), None
+    color = (int(parts[0]), int(parts[1]))
+    return color, (parts[2] if len(parts) > 2 else '\0')
+
+
+# _scan_format: walks the format chars of the string, appends the attribute
+# runs to the runs list, and returns the string without the format chars.
+#
+# A format char is \x19 followed by one of "buaio" (in any case, like
+# addstr_colored does), or by an optional "-", a digit and anything up to
+# the next "}". Every other \x19 is kept as regular text.
+def _scan_format(string: str, runs: List) -> str:
+    stripped = []
+    color = None
+    flags = 0
+    pos = 0
+    length = len(string)
+    next_attr_char = string.find('\x19')
+    while next_attr_char != -1:
+        if next_attr_char + 1 >= length:
+            break
+        # the attribute chars are case insensitive, \x19B is \x19b
+        attr_char = string[next_attr_char + 1].lower()
+        if attr_char in 'buaio':
+            end = next_attr_char + 2
+        elif attr_char in _DIGITS or (
+                attr_char == '-' and next_attr_char + 2 < length
+                and string[next_attr_char + 2] in _DIGITS):
+            end = string.find('}', next_attr_char) + 1
+        else:
+            end = 0
+        if not end:
+            next_attr_char = string.find('\x19', next_attr_char + 1)
+            continue
+        if next_attr_char != pos:
+            stripped.append(string[pos:next_attr_char])
+            runs.append((pos, next_attr_char, (color, flags)))
+        pos = end
+        if attr_char == 'o':
+            color, flags = None, 0
+        elif attr_char in _FORMAT_FLAGS:
+            flags |= _FORMAT_FLAGS[attr_char]
+        elif attr_char != 'a':
+            new_color, char = _parse_color(string[next_attr_char + 1:end - 1])
+            if new_color is not None:
+                color = new_color
+            if char == 'o':
+                color, flags = None, 0
+            elif char in _FORMAT_FLAGS:
+                flags |= _FORMAT_FLAGS[char]
+            elif char == '':
+                flags &= ~(_FORMAT_FLAGS['b'] | _FORMAT_FLAGS['u'])
+        next_attr_char = string.find('\x19', pos)
+    if pos < length:
+        stripped.append(string[pos:])
+        runs.append((pos, length, (color, flags)))
+    return ''.join(stripped)
+
+
+# parse_format: takes a string containing poezio format chars, and returns
+# in one pass the attribute runs and the text without the format chars.
+#
+# Each run is a (start, end, (color, flags)) tuple, start and end being
+# positions in the original string, color a (fg, bg) tuple or None, and
+# flags a bitmask of 1 (bold), 2 (underline) and 4 (italic).
+#
+# For example,
+# parse_format("\x19bhello \x191}world")
+# will return
+# ([(2, 8, (None, 1)), (11, 16, ((1, -1), 1))], "hello world")
+def parse_format(string: str) -> Tuple[List[Tuple[int, int, Tuple]], str]:
+    '''parse_format(text)
+
+    Return a tuple of the list of attribute runs (start, end, (color, flags)) of the text, and the text without its format chars.'''
+
+    runs = []  # type: List[Tuple[int, int, Tuple]]
+    stripped = _scan_format(string, runs)
+    return runs, stripped
+
+
+# clean_text: returns the string without its format chars, as the second
+# element returned by parse_format, except that the uppercase attribute
+# chars are kept: this is what is written in the logs.  A regex is faster
+# than _scan_format here, since no run has to be computed.
+_FORMAT_RE = re.compile('\x19-?[0-9][^}]*}|\x19[buaio]')
+
+
+def clean_text(string: str) -> str:
+    '''clean_text(text)
+
+    Return the text without its format chars.'''
+
+    return _FORMAT_RE.sub('', string)
+
+
+# clean_text_simple: returns the string without its simple format chars,
+# i.e. removes every \x19 and the character following it.
+_SIMPLE_FORMAT_RE = re.compile('\x19.?', re.DOTALL)
+
+
+def clean_text_simple(string: str) -> str:
+    '''clean_text_simple(text)
+
+    Return the text without its simple (\\x19 followed by a char) format chars.'''
+
+    return _SIMPLE_FORMAT_RE.sub('', string)
@@ -44,36 +44,57 @@ static int xwcwidth(wchar_t c)
  ***/
 
 /**
-   cut_text: takes a string and returns a tuple of int.
-
-   Each two int tuple is a line, represented by the ending position it
-   (where it should be cut).  Not that this position is calculed using the
-   position of the python string characters, not just the individual bytes.
-
-   For example,
-   poopt_cut_text("vivent les réfrigérateurs", 6);
-   will return [(0, 6), (7, 10), (11, 17), (17, 22), (22, 24)], meaning that
-   the lines are
-   "vivent", "les", "réfrig", "érateu" and "rs"
-
+   A growable array of unsigned ints, used to store the lines computed by
+   cut_text_into.
 */
-PyDoc_STRVAR(poopt_cut_text_doc, "cut_text(text, width)\n\n\nReturn a list of two-tuple, the first int is the starting position of the line and the second is its end.");
-
-static PyObject* poopt_cut_text(PyObject* self, PyObject* args)
+struct uint_vector
 {
-    /* The list of tuples that we return */
-    PyObject* retlist = PyList_New(0);
-    /* The temporary name for the tuples */
-    PyObject* tmp;
+  unsigned int* data;
+  size_t len;
+  size_t size;
+};
 
-    /* Get the python arguments */
-    const size_t width;
-    const char* buffer;
-    const Py_ssize_t buffer_len;
+static int uint_vector_push(struct uint_vector* vector, unsigned int value)
+{
+  if (vector->len == vector->size)
+    {
+      const size_t size = vector->size ? 2 * vector->size : 64;
+      unsigned int* data = PyMem_Resize(vector->data, unsigned int, size);
+      if (data == NULL)
+        {
+          PyErr_NoMemory();
+          return -1;
+        }
+      vector->data = data;
+      vector->size = size;
+    }
+  vector->data[vector->len++] = value;
+  return 0;
+}
 
-    if (PyArg_ParseTuple(args, "s#k", &buffer, &buffer_len, &width) == 0)
-        return NULL;
+/**
+   Appends a line to the vector: its start and end positions, preceded by
+   the index of the text if it is not negative.
+*/
+static int push_line(struct uint_vector* lines, int index,
+                     unsigned int start, unsigned int end)
+{
+  if (index >= 0 && uint_vector_push(lines, index) == -1)
+    return -1;
+  if (uint_vector_push(lines, start) == -1)
+    return -1;
+  return uint_vector_push(lines, end);
+}
 
+/**
+   The common part of cut_text and cut_text_many: cuts the utf-8 buffer in
+   lines of at most width columns, and appends them to the lines vector (see
+   push_line).  Returns -1 with an exception set on error.
+*/
+static int cut_text_into(struct uint_vector* lines, int index,
+                         const char* buffer, Py_ssize_t buffer_len,
+                         size_t width)
+{
     /* Pointer to the end of the string */
     const char* const end = buffer + buffer_len;
 
@@ -133,13 +154,13 @@ static PyObject* poopt_cut_text(PyObject* self, PyObject* args)
         {
             PyErr_SetString(PyExc_UnicodeError,
                             "mbrtowc returned -1: Invalid multibyte sequence.");
-            return NULL;
+            return -1;
         }
         else if ((size_t)-2 == consumed)
         {
             PyErr_SetString(PyExc_UnicodeError,
                             "mbrtowc returned -2: Could not parse a complete multibyte character.");
-            return NULL;
+            return -1;
         }
 
         buffer += consumed;
@@ -148,13 +169,8 @@ static PyObject* poopt_cut_text(PyObject* self, PyObject* args)
         if (wc == (wchar_t)'\n')
         {
             spos++;
-            tmp = Py_BuildValue("II", start_pos, spos);
-            if (PyList_Append(retlist, tmp) == -1)
-            {
-                Py_XDECREF(tmp);
-                return NULL;
-            }
-            Py_XDECREF(tmp);
+            if (push_line(lines, index, start_pos, spos) == -1)
+                return -1;
             /* And then initiate a new line */
             start_pos = spos;
             last_space = -1;
@@ -171,13 +187,8 @@ static PyObject* poopt_cut_text(PyObject* self, PyObject* args)
         {   /* If possible, cut on a space */
             if (last_space != -1)
             {
-                tmp = Py_BuildValue("II", start_pos, last_space);
-                if (PyList_Append(retlist, tmp) == -1)
-                {
-                    Py_XDECREF(tmp);
-                    return NULL;
-                }
-                Py_XDECREF(tmp);
+                if (push_line(lines, index, start_pos, last_space) == -1)
+                    return -1;
                 start_pos = last_space + 1;
                 last_space = -1;
                 columns -= (cols_until_space + 1);
@@ -185,13 +196,8 @@ static PyObject* poopt_cut_text(PyObject* self, PyObject* args)
             else
             {
                 /* Otherwise, cut in the middle of a word */
-                tmp = Py_BuildValue("II", start_pos, spos);
-                if (PyList_Append(retlist, tmp) == -1)
-                {
-                    Py_XDECREF(tmp);
-                    return NULL;
-                }
-                Py_XDECREF(tmp);
+                if (push_line(lines, index, start_pos, spos) == -1)
+                    return -1;
                 start_pos = spos;
                 columns = 0;
             }
@@ -211,16 +217,136 @@ static PyObject* poopt_cut_text(PyObject* self, PyObject* args)
         spos++;
     }
     /* We are at the end of the string, append the last line, not finished */
-    tmp = Py_BuildValue("II", start_pos, spos);
-    if (PyList_Append(retlist, tmp) == -1)
+    return push_line(lines, index, start_pos, spos);
+}
+
+/**
+   cut_text: takes a string and returns a tuple of int.
+
+   Each two int tuple is a line, represented by the ending position it
+   (where it should be cut).  Not that this position is calculed using the
+   position of the python string characters, not just the individual bytes.
+
+   For example,
+   poopt_cut_text("vivent les réfrigérateurs", 6);
+   will return [(0, 6), (7, 10), (11, 17), (17, 22), (22, 24)], meaning that
+   the lines are
+   "vivent", "les", "réfrig", "érateu" and "rs"
+
+*/
+PyDoc_STRVAR(poopt_cut_text_doc, "cut_text(text, width)\n\n\nReturn a list of two-tuple, the first int is the starting position of the line and the second is its end.");
+
+static PyObject* poopt_cut_text(PyObject* self, PyObject* args)
+{
+    /* Get the python arguments */
+    const size_t width;
+    const char* buffer;
+    const Py_ssize_t buffer_len;
+
+    if (PyArg_ParseTuple(args, "s#k", &buffer, &buffer_len, &width) == 0)
+        return NULL;
+
+    struct uint_vector lines = {NULL, 0, 0};
+    if (cut_text_into(&lines, -1, buffer, buffer_len, width) == -1)
+    {
+        PyMem_Free(lines.data);
+        return NULL;
+    }
+
+    /* The list of tuples that we return */
+    PyObject* retlist = PyList_New(lines.len / 2);
+    if (retlist == NULL)
     {
-        Py_XDECREF(tmp);
+        PyMem_Free(lines.data);
         return NULL;
     }
-    Py_XDECREF(tmp);
+    for (size_t i = 0; i < lines.len / 2; i++)
+    {
+        PyObject* tmp = Py_BuildValue("II", lines.data[2 * i],
+                                      lines.data[2 * i + 1]);
+        if (tmp == NULL)
+        {
+            Py_DECREF(retlist);
+            PyMem_Free(lines.data);
+            return NULL;
+        }
+        PyList_SET_ITEM(retlist, i, tmp);
+    }
+    PyMem_Free(lines.data);
     return retlist;
 }
 
+/**
+   cut_text_many: the same as cut_text, for a list of strings and the list
+   of their widths, in a single call.
+
+   The lines of all the strings are returned in a flat array of unsigned
+   ints, each line taking three of them: the index of the string in the
+   list, and the start and end positions of the line in that string.
+
+   For example,
+   poopt_cut_text_many(["vivent les", "réfrigérateurs"], [6, 10]);
+   will return array('I', [0, 0, 6, 0, 6, 10, 1, 0, 10, 1, 10, 14])
+*/
+PyDoc_STRVAR(poopt_cut_text_many_doc, "cut_text_many(texts, widths)\n\n\nReturn an array('I') of (index, start, end) triples, one per line of each text cut to its width.");
+
+static PyObject* array_module = NULL;
+
+static PyObject* poopt_cut_text_many(PyObject* self, PyObject* args)
+{
+    PyObject* texts;
+    PyObject* widths;
+    if (PyArg_ParseTuple(args, "OO", &texts, &widths) == 0)
+        return NULL;
+
+    texts = PySequence_Fast(texts, "texts must be a sequence");
+    if (texts == NULL)
+        return NULL;
+    widths = PySequence_Fast(widths, "widths must be a sequence");
+    if (widths == NULL)
+    {
+        Py_DECREF(texts);
+        return NULL;
+    }
+
+    PyObject* ret = NULL;
+    struct uint_vector lines = {NULL, 0, 0};
+    const Py_ssize_t nb_texts = PySequence_Fast_GET_SIZE(texts);
+    if (PySequence_Fast_GET_SIZE(widths) != nb_texts)
+    {
+        PyErr_SetString(PyExc_ValueError,
+                        "texts and widths must have the same length");
+        goto end;
+    }
+    if (nb_texts > INT_MAX)
+    {
+        PyErr_SetString(PyExc_OverflowError, "too many texts");
+        goto end;
+    }
+    for (Py_ssize_t i = 0; i < nb_texts; i++)
+    {
+        Py_ssize_t buffer_len;
+        const char* buffer = PyUnicode_AsUTF8AndSize(
+            PySequence_Fast_GET_ITEM(texts, i), &buffer_len);
+        if (buffer == NULL)
+            goto end;
+        const size_t width = PyLong_AsUnsignedLongMask(
+            PySequence_Fast_GET_ITEM(widths, i));
+        if (width == (size_t)-1 && PyErr_Occurred())
+            goto end;
+        if (cut_text_into(&lines, (int)i, buffer, buffer_len, width) == -1)
+            goto end;
+    }
+    ret = PyObject_CallMethod(array_module, "array", "sy#", "I",
+                              lines.data ? (const char*)lines.data : "",
+                              (Py_ssize_t)(lines.len * sizeof(unsigned int)));
+ end:
+    PyMem_Free(lines.data);
+    Py_DECREF(texts);
+    Py_DECREF(widths);
+    return ret;
+}
+
 /**
    wcswidth: An emulation of the POSIX wcswidth(3) function using wcwidth
    and mbrtowc.
@@ -314,6 +440,361 @@ static PyObject* poopt_cut_by_columns(PyObject* self, PyObject* args)
   return Py_BuildValue("s#", start, ptr - start);
 }
 
+/**
+   The attribute flags set by the \x19b, \x19u and \x19i format chars in the
+   runs returned by parse_format. They are the same values as ATTR_BOLD,
+   ATTR_UNDERLINE and ATTR_ITALIC in poezio.windows.base_wins.
+*/
+#define FORMAT_BOLD 1
+#define FORMAT_UNDERLINE 2
+#define FORMAT_ITALIC 4
+
+static int format_flag(Py_UCS4 c)
+{
+  switch (c)
+    {
+    case 'b':
+      return FORMAT_BOLD;
+    case 'u':
+      return FORMAT_UNDERLINE;
+    case 'i':
+      return FORMAT_ITALIC;
+    default:
+      return 0;
+    }
+}
+
+static int is_digit(Py_UCS4 c)
+{
+  return c >= '0' && c <= '9';
+}
+
+/**
+   Parses an int of at most 9 digits, with an optional leading '-', between
+   the positions start and end of the string.  Returns 0 if it is not a
+   valid int.
+*/
+static int parse_int(int kind, const void* data, Py_ssize_t start,
+                     Py_ssize_t end, int* res)
+{
+  int negative = 0;
+  int value = 0;
+  if (start < end && PyUnicode_READ(kind, data, start) == '-')
+    {
+      negative = 1;
+      start++;
+    }
+  if (start == end || end - start > 9)
+    return 0;
+  for (; start < end; start++)
+    {
+      const Py_UCS4 c = PyUnicode_READ(kind, data, start);
+      if (!is_digit(c))
+        return 0;
+      value = value * 10 + (c - '0');
+    }
+  *res = negative ? -value : value;
+  return 1;
+}
+
+/**
+   Appends a (start, end, (color, flags)) run to the list, color being None
+   if has_color is 0, or the (fg, bg) tuple otherwise.
+*/
+static int append_run(PyObject* runs, Py_ssize_t start, Py_ssize_t end,
+                      int has_color, int fg, int bg, int flags)
+{
+  PyObject* tmp;
+  if (has_color)
+    tmp = Py_BuildValue("nn((ii)i)", start, end, fg, bg, flags);
+  else
+    tmp = Py_BuildValue("nn(Oi)", start, end, Py_None, flags);
+  if (tmp == NULL)
+    return -1;
+  const int res = PyList_Append(runs, tmp);
+  Py_DECREF(tmp);
+  return res;
+}
+
+/**
+   The common part of parse_format and clean_text: walks the format chars
+   of the string, appends the attribute runs to the runs list (unless it is
+   NULL), and returns a new string without the format chars.
+
+   A format char is \x19 followed by one of "buaio" (in any case if
+   any_case is set, like addstr_colored does), or by an optional "-", a
+   digit and anything up to the next "}".  Every other \x19 is kept as
+   regular text.
+*/
+static PyObject* scan_format(PyObject* string, PyObject* runs, int any_case)
+{
+  if (PyUnicode_READY(string) == -1)
+    return NULL;
+  const int kind = PyUnicode_KIND(string);
+  const void* const data = PyUnicode_DATA(string);
+  const Py_ssize_t length = PyUnicode_GET_LENGTH(string);
+
+  /* The printable parts of the string, as (start, end) positions. There
+   * are at most one more than the number of format chars. */
+  Py_ssize_t nb_parts = 0;
+  Py_ssize_t* parts = PyMem_New(Py_ssize_t, 2 * (length / 2 + 1));
+  if (parts == NULL)
+    return PyErr_NoMemory();
+
+  /* The current attributes */
+  int has_color = 0, fg = 0, bg = 0, flags = 0;
+  /* The start of the current printable part */
+  Py_ssize_t pos = 0;
+  Py_ssize_t stripped_len = 0;
+  Py_ssize_t spos = PyUnicode_FindChar(string, 25, 0, length, 1);
+
+  while (spos >= 0 && spos + 1 < length)
+    {
+      Py_UCS4 attr_char = PyUnicode_READ(kind, data, spos + 1);
+      /* \x19B is \x19b */
+      if (any_case && attr_char >= 'A' && attr_char <= 'Z')
+        attr_char += 'a' - 'A';
+      Py_ssize_t end = -1;
+      if (attr_char == 'b' || attr_char == 'u' || attr_char == 'a' ||
+          attr_char == 'i' || attr_char == 'o')
+        end = spos + 2;
+      else if (is_digit(attr_char) ||
+               (attr_char == '-' && spos + 2 < length &&
+                is_digit(PyUnicode_READ(kind, data, spos + 2))))
+        {
+          end = PyUnicode_FindChar(string, '}', spos, length, 1);
+          if (end == -2)
+            goto error;
+          if (end != -1)
+            end++;
+        }
+      if (end == -1)
+        {
+          /* Not a format char, keep it as regular text */
+          spos = PyUnicode_FindChar(string, 25, spos + 1, length, 1);
+          continue;
+        }
+
+      if (spos != pos)
+        {
+          if (runs != NULL &&
+              append_run(runs, pos, spos, has_color, fg, bg, flags) == -1)
+            goto error;
+          parts[2 * nb_parts] = pos;
+          parts[2 * nb_parts + 1] = spos;
+          nb_parts++;
+          stripped_len += spos - pos;
+        }
+      pos = end;
+
+      if (attr_char == 'o')
+        {
+          has_color = 0;
+          flags = 0;
+        }
+      else if (format_flag(attr_char))
+        flags |= format_flag(attr_char);
+      else if (attr_char != 'a')
+        {
+          /* A color, "fg}", "fg,bg}" or "fg,bg,char}" */
+          const Py_ssize_t color_end = end - 1;
+          Py_ssize_t comma1 = PyUnicode_FindChar(string, ',', spos + 1,
+                                                 color_end, 1);
+          if (comma1 < -1)
+            goto error;
+          if (comma1 == -1)
+            {
+              if (parse_int(kind, data, spos + 1, color_end, &fg))
+                {
+                  has_color = 1;
+                  bg = -1;
+                }
+            }
+          else
+            {
+              Py_ssize_t comma2 = PyUnicode_FindChar(string, ',', comma1 + 1,
+                                                     color_end, 1);
+              if (comma2 < -1)
+                goto error;
+              const Py_ssize_t bg_end = comma2 == -1 ? color_end : comma2;
+              int new_fg, new_bg;
+              if (parse_int(kind, data, spos + 1, comma1, &new_fg) &&
+                  parse_int(kind, data, comma1 + 1, bg_end, &new_bg))
+                {
+                  has_color = 1;
+                  fg = new_fg;
+                  bg = new_bg;
+                  if (comma2 != -1)
+                    {
+                      Py_ssize_t char_end = PyUnicode_FindChar(string, ',',
+                                                               comma2 + 1,
+                                                               color_end, 1);
+                      if (char_end < -1)
+                        goto error;
+                      if (char_end == -1)
+                        char_end = color_end;
+                      if (char_end == comma2 + 1)
+                        /* This will reset previous bold/underline
+                         * sequences if any was used */
+                        flags &= ~(FORMAT_BOLD | FORMAT_UNDERLINE);
+                      else if (char_end == comma2 + 2)
+                        {
+                          const Py_UCS4 c = PyUnicode_READ(kind, data,
+                                                           comma2 + 1);
+                          if (c == 'o')
+                            {
+                              has_color = 0;
+                              flags = 0;
+                            }
+                          else
+                            flags |= format_flag(c);
+                        }
+                    }
+                }
+            }
+        }
+      spos = PyUnicode_FindChar(string, 25, pos, length, 1);
+    }
+  if (spos == -2)
+    goto error;
+
+  if (pos < length)
+    {
+      if (runs != NULL &&
+          append_run(runs, pos, length, has_color, fg, bg, flags) == -1)
+        goto error;
+      parts[2 * nb_parts] = pos;
+      parts[2 * nb_parts + 1] = length;
+      nb_parts++;
+      stripped_len += length - pos;
+    }
+
+  /* Copy the printable parts in the new string, which must be created
+   * with the exact maximum character it contains */
+  Py_UCS4 max_char = 0;
+  for (Py_ssize_t i = 0; i < nb_parts; i++)
+    for (Py_ssize_t j = parts[2 * i]; j < parts[2 * i + 1]; j++)
+      {
+        const Py_UCS4 c = PyUnicode_READ(kind, data, j);
+        if (c > max_char)
+          max_char = c;
+      }
+  PyObject* stripped = PyUnicode_New(stripped_len, max_char);
+  if (stripped == NULL)
+    goto error;
+  const int dest_kind = PyUnicode_KIND(stripped);
+  void* const dest_data = PyUnicode_DATA(stripped);
+  Py_ssize_t dest = 0;
+  for (Py_ssize_t i = 0; i < nb_parts; i++)
+    for (Py_ssize_t j = parts[2 * i]; j < parts[2 * i + 1]; j++)
+      PyUnicode_WRITE(dest_kind, dest_data, dest++,
+                      PyUnicode_READ(kind, data, j));
+  PyMem_Free(parts);
+  return stripped;
+ error:
+  PyMem_Free(parts);
+  return NULL;
+}
+
+/**
+   parse_format: takes a string containing poezio format chars, and returns
+   in one pass the attribute runs and the text without the format chars.
+
+   Each run is a (start, end, (color, flags)) tuple, start and end being
+   positions in the original string, color a (fg, bg) tuple or None, and
+   flags a bitmask of 1 (bold), 2 (underline) and 4 (italic).
+
+   For example,
+   parse_format("\x19bhello \x191}world")
+   will return
+   ([(2, 8, (None, 1)), (11, 16, ((1, -1), 1))], "hello world")
+*/
+PyDoc_STRVAR(poopt_parse_format_doc, "parse_format(text)\n\n\nReturn a tuple of the list of attribute runs (start, end, (color, flags)) of the text, and the text without its format chars.");
+static PyObject* poopt_parse_format(PyObject* self, PyObject* args)
+{
+  PyObject* string;
+  if (PyArg_ParseTuple(args, "U", &string) == 0)
+    return NULL;
+  PyObject* runs = PyList_New(0);
+  if (runs == NULL)
+    return NULL;
+  PyObject* stripped = scan_format(string, runs, 1);
+  if (stripped == NULL)
+    {
+      Py_DECREF(runs);
+      return NULL;
+    }
+  return Py_BuildValue("NN", runs, stripped);
+}
+
+/**
+   clean_text: returns the string without its format chars, as the second
+   element returned by parse_format, except that the uppercase attribute
+   chars are kept: this is what is written in the logs.
+*/
+PyDoc_STRVAR(poopt_clean_text_doc, "clean_text(text)\n\n\nReturn the text without its format chars.");
+static PyObject* poopt_clean_text(PyObject* self, PyObject* args)
+{
+  PyObject* string;
+  if (PyArg_ParseTuple(args, "U", &string) == 0)
+    return NULL;
+  return scan_format(string, NULL, 0);
+}
+
+/**
+   clean_text_simple: returns the string without its simple format chars,
+   i.e. removes every \x19 and the character following it.
+*/
+PyDoc_STRVAR(poopt_clean_text_simple_doc, "clean_text_simple(text)\n\n\nReturn the text without its simple (\\x19 followed by a char) format chars.");
+static PyObject* poopt_clean_text_simple(PyObject* self, PyObject* args)
+{
+  PyObject* string;
+  if (PyArg_ParseTuple(args, "U", &string) == 0)
+    return NULL;
+  if (PyUnicode_READY(string) == -1)
+    return NULL;
+  const int kind = PyUnicode_KIND(string);
+  const void* const data = PyUnicode_DATA(string);
+  const Py_ssize_t length = PyUnicode_GET_LENGTH(string);
+
+  /* First pass to know the length and the maximum character of the
+   * result */
+  Py_ssize_t stripped_len = 0;
+  Py_UCS4 max_char = 0;
+  for (Py_ssize_t i = 0; i < length; i++)
+    {
+      const Py_UCS4 c = PyUnicode_READ(kind, data, i);
+      if (c == 25)
+        i++;
+      else
+        {
+          stripped_len++;
+          if (c > max_char)
+            max_char = c;
+        }
+    }
+  if (stripped_len == length)
+    {
+      Py_INCREF(string);
+      return string;
+    }
+  PyObject* stripped = PyUnicode_New(stripped_len, max_char);
+  if (stripped == NULL)
+    return NULL;
+  const int dest_kind = PyUnicode_KIND(stripped);
+  void* const dest_data = PyUnicode_DATA(stripped);
+  Py_ssize_t dest = 0;
+  for (Py_ssize_t i = 0; i < length; i++)
+    {
+      const Py_UCS4 c = PyUnicode_READ(kind, data, i);
+      if (c == 25)
+        i++;
+      else
+        PyUnicode_WRITE(dest_kind, dest_data, dest++, c);
+    }
+  return stripped;
+}
+
 /***
     Module initialization. Just taken from the xxmodule.c template from the
     python sources.
@@ -417,8 +898,12 @@ static PyTypeObject Null_Type = {
 /* List of functions defined in the module */
 static PyMethodDef poopt_methods[] = {
   {"cut_text", poopt_cut_text, METH_VARARGS, poopt_cut_text_doc},
+  {"cut_text_many", poopt_cut_text_many, METH_VARARGS, poopt_cut_text_many_doc},
   {"wcswidth", poopt_wcswidth, METH_VARARGS, poopt_wcswidth_doc},
   {"cut_by_columns", poopt_cut_by_columns, METH_VARARGS, poopt_cut_by_columns_doc},
+  {"parse_format", poopt_parse_format, METH_VARARGS, poopt_parse_format_doc},
+  {"clean_text", poopt_clean_text, METH_VARARGS, poopt_clean_text_doc},
+  {"clean_text_simple", poopt_clean_text_simple, METH_VARARGS, poopt_clean_text_simple_doc},
   {}           /* sentinel */
 };
 
@@ -456,6 +941,13 @@ PyInit_poopt(void)
   /* if (PyType_Ready(&Xxo_Type) < 0) */
   /*     goto fail; */
 
+  /* cut_text_many returns array.array objects */
+  if (array_module == NULL) {
+    array_module = PyImport_ImportModule("array");
+    if (array_module == NULL)
+      goto fail;
+  }
+
   /* Create the module and add the functions */
   m = PyModule_Create(&pooptmodule);
   if (m == NULL)
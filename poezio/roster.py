@@ -12,8 +12,9 @@ log = logging.getLogger(__name__)
 
 from poezio.config import config
 from poezio.contact import Contact
-from poezio.roster_sorting import SORTING_METHODS, GROUP_SORTING_METHODS
+from poezio.roster_sorting import contact_sort_key, group_sort_key
 
+from collections import OrderedDict
 from os import path as p
 from datetime import datetime
 from poezio.common import safeJID
@@ -41,15 +42,86 @@ class Roster:
             config.get('folded_roster_groups', section='var').split(':'))
         self.groups = {}
         self.contacts = {}
+        # the bare jids of the contacts of the roster (see exists()), as
+        # an ordered set, maintained by update_contact_groups() and
+        # __delitem__ so that the lookups are O(1)
+        self._jids = OrderedDict()  # type: OrderedDict
         self.length = 0
         self.connected = 0
 
         # Used for caching roster infos
         self.last_built = datetime.now()
         self.last_modified = datetime.now()
+        # the bare jids of the contacts modified since the last build, or
+        # None if the whole roster has to be rebuilt
+        self.modified_jids = None
+        # the number of modifications of contacts, the one of the last
+        # modification of all of them, and the one of the last
+        # modification of each contact since then, the most recent last
+        self.version = 0
+        self._full_version = 0
+        self._versions = OrderedDict()  # type: OrderedDict
 
-    def modified(self):
+    @property
+    def contact_filter(self):
+        return self._contact_filter
+
+    @contact_filter.setter
+    def contact_filter(self, value):
+        """
+        A new search rebuilds the whole roster view, without changing
+        the contacts
+        """
+        self._contact_filter = value
+        self.last_modified = datetime.now()
+        self.modified_jids = None
+
+    def modified(self, jid=None):
+        """
+        Mark the roster as modified: only the contact of the bare jid if
+        it is given (its presence, its groups…), everything otherwise.
+        """
         self.last_modified = datetime.now()
+        if jid is None:
+            self.modified_jids = None
+            for contact in self.contacts.values():
+                contact.changed()
+            self.version += 1
+            self._full_version = self.version
+            self._versions.clear()
+            return
+        jid = str(jid)
+        contact = self.contacts.get(jid)
+        if contact is not None:
+            contact.changed()
+        if self.modified_jids is not None:
+            self.modified_jids.add(jid)
+        self.version += 1
+        self._versions[jid] = self.version
+        self._versions.move_to_end(jid)
+
+    def modified_since(self, version):
+        """
+        The bare jids of the contacts modified after a version of the
+        roster, or None if all of them were
+        """
+        if version < self._full_version:
+            return None
+        jids = []
+        for jid in reversed(self._versions):
+            if self._versions[jid] <= version:
+                break
+            jids.append(jid)
+        return jids
+
+    def pop_modified(self):
+        """
+        The bare jids of the contacts modified since the last call, or
+        None if the whole roster was
+        """
+        jids = self.modified_jids
+        self.modified_jids = set()
+        return jids
 
     @property
     def needs_rebuild(self):
@@ -57,13 +129,15 @@ class Roster:
 
     def __getitem__(self, key):
         """Get a Contact from his bare JID"""
+        contact = self.contacts.get(key)
+        if contact is not None:
+            return contact
         key = safeJID(key).bare
-        if key in self.contacts and self.contacts[key] is not None:
-            return self.contacts[key]
-        if key in self.jids():
-            contact = Contact(self.__node[key])
-            self.contacts[key] = contact
+        contact = self.contacts.get(key)
+        if contact is not None:
             return contact
+        if key in self._jids:
+            return self.get_and_set(key)
 
     def __setitem__(self, key, value):
         """Set the a Contact value for the bare jid key"""
@@ -91,7 +165,9 @@ class Roster:
             group.remove(contact)
             if not group:
                 del self.groups[group.name]
-        self.modified()
+        self._jids.pop(jid, None)
+        self.length = len(self._jids)
+        self.modified(jid)
 
     def __iter__(self):
         """Iterate over the jids of the contacts"""
@@ -99,7 +175,7 @@ class Roster:
 
     def __contains__(self, key):
         """True if the bare jid is in the roster, false otherwise"""
-        return safeJID(key).bare in self.jids()
+        return key in self._jids or safeJID(key).bare in self._jids
 
     @property
     def jid(self):
@@ -120,17 +196,9 @@ class Roster:
 
     def get_groups(self, sort=''):
         """Return a list of the RosterGroups"""
-        group_list = sorted(
+        return sorted(
             (group for group in self.groups.values() if group),
-            key=lambda x: x.name.lower() if x.name else '')
-
-        for sorting in sort.split(':'):
-            if sorting == 'reverse':
-                group_list = list(reversed(group_list))
-            else:
-                method = GROUP_SORTING_METHODS.get(sorting, lambda x: 0)
-                group_list = sorted(group_list, key=method)
-        return group_list
+            key=group_sort_key(sort))
 
     def get_group(self, name):
         """Return a group or create it if not present"""
@@ -145,17 +213,11 @@ class Roster:
 
     def jids(self):
         """List of the contact JIDS"""
-        l = []
-        for key in self.__node.keys():
-            contact = self.get_and_set(key)
-            if key != self.jid and (contact and self.exists(contact)):
-                l.append(key)
-        self.update_size(l)
-        return l
+        return list(self._jids)
 
     def update_size(self, jids=None):
         if jids is None:
-            jids = self.jids()
+            jids = self._jids
         self.length = len(jids)
 
     def get_contacts(self):
@@ -168,6 +230,14 @@ class Roster:
         """
         Return a list of all the contacts sorted with a criteria
         """
+        select = getattr(self.contact_filter[0], 'select', None)
+        if select is not None:
+            # an indexed search gives the jids of the matching contacts
+            contacts = [
+                self[jid] for jid in select(self.contact_filter[1])
+                if jid != self.jid
+            ]
+            return sorted(contacts, key=contact_sort_key(sort))
         contact_list = []
         for contact in self.get_contacts():
             if contact.bare_jid != self.jid:
@@ -176,15 +246,7 @@ class Roster:
                         contact_list.append(contact)
                 else:
                     contact_list.append(contact)
-        contact_list = sorted(contact_list, key=SORTING_METHODS['name'])
-
-        for sorting in sort.split(':'):
-            if sorting == 'reverse':
-                contact_list = list(reversed(contact_list))
-            else:
-                method = SORTING_METHODS.get(sorting, lambda x: 0)
-                contact_list = sorted(contact_list, key=method)
-        return contact_list
+        return sorted(contact_list, key=contact_sort_key(sort))
 
     def save_to_config_file(self):
         """
@@ -220,6 +282,14 @@ class Roster:
                     group, folded=group in self.folded_groups)
                 self.groups[group].add(contact)
 
+        jid = str(contact.bare_jid)
+        if jid != self.jid and self.exists(contact):
+            self._jids[jid] = None
+        else:
+            self._jids.pop(jid, None)
+        self.length = len(self._jids)
+        self.modified(jid)
+
     def __len__(self):
         """
         Return the number of contacts
@@ -310,15 +380,7 @@ class RosterGroup:
                 contact for contact in self.contacts.copy()
                 if contact_filter[0](contact, contact_filter[1])
             ]
-        contact_list = sorted(contact_list, key=SORTING_METHODS['name'])
-
-        for sorting in sort.split(':'):
-            if sorting == 'reverse':
-                contact_list = list(reversed(contact_list))
-            else:
-                method = SORTING_METHODS.get(sorting, lambda x: 0)
-                contact_list = sorted(contact_list, key=method)
-        return contact_list
+        return sorted(contact_list, key=contact_sort_key(sort))
 
     def toggle_folded(self):
         """Fold/unfold the group in the roster"""
@@ -3,6 +3,8 @@ Defines the roster sorting methods used in roster.py
 (for contacts/groups)
 """
 
+from functools import lru_cache, total_ordering
+
 ########################### Contacts sorting ############################
 
 PRESENCE_PRIORITY = {
@@ -102,3 +104,85 @@ GROUP_SORTING_METHODS = {
     'none': sort_group_none,
     'sname': sort_group_sname,
 }
+
+
+############################ Composite keys #############################
+
+
+@total_ordering
+class ReverseKey:
+    """A sort key ordered the other way round"""
+    __slots__ = ('value', )
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+def _no_sort(item):
+    return 0
+
+
+def compile_sort(sort, methods, base):
+    """
+    Compile a sort option ('jid:show', for example) into a single key
+    function: sorting with it gives the order of a sort by base, then of
+    a stable sort by each method of the option in turn, 'reverse'
+    reversing the order obtained so far.
+    base must return a tuple, unique for each item.
+    """
+    steps = [
+        None if sorting == 'reverse' else methods.get(sorting, _no_sort)
+        for sorting in sort.split(':')
+    ]
+
+    def key(item):
+        value = base(item)
+        for step in steps:
+            if step is None:
+                value = ReverseKey(value)
+            else:
+                value = (step(item), value)
+        return value
+
+    return key
+
+
+def contact_base_key(contact):
+    """The order of the contacts before sorting them with roster_sort"""
+    return (sort_name(contact), str(contact.bare_jid))
+
+
+def group_base_key(group):
+    """The order of the groups before sorting them with roster_group_sort"""
+    return (group.name.lower(), group.name)
+
+
+@lru_cache(maxsize=16)
+def contact_sort_key(sort):
+    """
+    The key function of the contacts for the roster_sort option. The key
+    of each contact is cached in it until Roster.modified() is called
+    for it.
+    """
+    compiled = compile_sort(sort, SORTING_METHODS, contact_base_key)
+
+    def key(contact):
+        keys = contact.sort_keys
+        value = keys.get(sort)
+        if value is None:
+            value = keys[sort] = compiled(contact)
+        return value
+
+    return key
+
+
+@lru_cache(maxsize=16)
+def group_sort_key(sort):
+    """The key function of the groups for the roster_group_sort option"""
+    return compile_sort(sort, GROUP_SORTING_METHODS, group_base_key)
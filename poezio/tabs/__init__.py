@@ -12,11 +12,12 @@ from poezio.tabs.muclisttab import MucListTab
 from poezio.tabs.adhoc_commands_list import AdhocCommandsListTab
 from poezio.tabs.data_forms import DataFormsTab
 from poezio.tabs.bookmarkstab import BookmarksTab
+from poezio.tabs.searchtab import SearchTab
 
 __all__ = [
     'Tab', 'ChatTab', 'GapTab', 'OneToOneTab', 'STATE_PRIORITY', 'SHOW_NAME',
     'RosterInfoTab', 'MucTab', 'NS_MUC_USER', 'PrivateTab', 'ConfirmTab',
     'ConversationTab', 'StaticConversationTab', 'DynamicConversationTab',
     'XMLTab', 'ListTab', 'MucListTab', 'AdhocCommandsListTab', 'DataFormsTab',
-    'BookmarksTab'
+    'BookmarksTab', 'SearchTab'
 ]
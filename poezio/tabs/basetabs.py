@@ -29,7 +29,7 @@ from poezio import xhtml
 from poezio.common import safeJID
 from poezio.config import config
 from poezio.decorators import refresh_wrapper
-from poezio.logger import logger
+from poezio.logger import logger, LogPager
 from poezio.text_buffer import TextBuffer
 from poezio.theming import get_theme, dump_tuple
 from poezio.decorators import command_args_parser
@@ -344,6 +344,16 @@ class Tab:
         """
         return None
 
+    def memory_usage(self) -> int:
+        """
+        Returns an estimate of the memory (in bytes) used by the built
+        lines of the principal TextWin, 0 if there's none
+        """
+        text_win = self.get_text_window()
+        if text_win is None:
+            return 0
+        return text_win.memory_usage()
+
     def on_input(self, key: str, raw: bool):
         """
         raw indicates if the key should activate the associated command or not.
@@ -508,6 +518,8 @@ class ChatTab(Tab):
         if logs:
             for message in logs:
                 self._text_buffer.add_message(**message)
+        if config.get('log_scrollback'):
+            self._text_buffer.history = self.log_pager()
 
     @property
     def general_jid(self) -> JID:
@@ -517,6 +529,13 @@ class ChatTab(Tab):
         logs = logger.get_logs(safeJID(self.name).bare, log_nb)
         return logs
 
+    def log_pager(self) -> LogPager:
+        """
+        Return the reader of the logs used to scroll back past the
+        messages in memory
+        """
+        return LogPager(safeJID(self.name).bare)
+
     def log_message(self,
                     txt: str,
                     nickname: str,
@@ -437,11 +437,7 @@ class MucTab(ChatTab):
             except PresenceError:
                 self.core.room_error(presence, presence['from'].bare)
         if self.core.tabs.current_tab is self:
-            self.text_win.refresh()
-            self.user_win.refresh_if_changed(self.users)
-            self.info_header.refresh(self, self.text_win, user=self.own_user)
-            self.input.refresh()
-            self.core.doupdate()
+            self.core.schedule_refresh()
 
     def process_presence_buffer(self, last_presence):
         """
@@ -22,7 +22,7 @@ from poezio.common import safeJID
 from poezio.config import config
 from poezio.core.structs import Command
 from poezio.decorators import refresh_wrapper
-from poezio.logger import logger
+from poezio.logger import logger, LogPager
 from poezio.theming import get_theme, dump_tuple
 from poezio.decorators import command_args_parser
 
@@ -101,6 +101,9 @@ class PrivateTab(OneToOneTab):
             safeJID(self.name).full.replace('/', '\\'), log_nb)
         return logs
 
+    def log_pager(self):
+        return LogPager(safeJID(self.name).full.replace('/', '\\'))
+
     def log_message(self, txt, nickname, time=None, typ=1):
         """
         Log the messages in the archives.
@@ -11,10 +11,11 @@ import curses
 import difflib
 import os
 import ssl
+from collections import Counter, defaultdict
 from functools import partial
 from os import getenv, path
 from pathlib import Path
-from typing import Dict, Callable
+from typing import Dict, Callable, Iterable, Optional, Set
 
 from poezio import common
 from poezio import windows
@@ -47,6 +48,7 @@ class RosterInfoTab(Tab):
         self.roster_win = windows.RosterWin()
         self.contact_info_win = windows.ContactInfoWin()
         self.avatar_win = windows.ImageWin()
+        self.search = RosterSearch(roster)
         self.default_help_message = windows.HelpText(
             "Enter commands with “/”. “o”: toggle offline show")
         self.input = self.default_help_message
@@ -712,7 +714,7 @@ class RosterInfoTab(Tab):
         if jid in roster and roster[jid].subscription in ('to', 'both'):
             return self.core.information('Already subscribed.', 'Roster')
         roster.add(jid)
-        roster.modified()
+        roster.modified(jid)
         self.core.information('%s was added to the roster' % jid, 'Roster')
 
     @command_args_parser.quoted(1, 1)
@@ -777,7 +779,7 @@ class RosterInfoTab(Tab):
             self.core.information('JID already in group', 'Error')
             return
 
-        roster.modified()
+        roster.modified(contact.bare_jid)
         new_groups.add(group)
         try:
             new_groups.remove('none')
@@ -837,7 +839,7 @@ class RosterInfoTab(Tab):
             self.core.information('The groups are the same.', 'Error')
             return
 
-        roster.modified()
+        roster.modified(contact.bare_jid)
         new_groups.add(group_to)
         if 'none' in new_groups:
             new_groups.remove('none')
@@ -885,7 +887,7 @@ class RosterInfoTab(Tab):
             self.core.information('JID not in group', 'Error')
             return
 
-        roster.modified()
+        roster.modified(contact.bare_jid)
 
         new_groups.remove(group)
         name = contact.name
@@ -1078,7 +1080,7 @@ class RosterInfoTab(Tab):
         if contact is None:
             return
         contact.pending_in = False
-        roster.modified()
+        roster.modified(contact.bare_jid)
         self.core.xmpp.send_presence(pto=jid, ptype='subscribed')
         self.core.xmpp.client_roster.send_last_presence()
         if contact.subscription in ('from',
@@ -1238,7 +1240,7 @@ class RosterInfoTab(Tab):
                     found_group = True
                     group = row.name
             selected_row.toggle_folded(group)
-            roster.modified()
+            roster.modified(selected_row.bare_jid)
             return True
         return False
 
@@ -1326,7 +1328,6 @@ class RosterInfoTab(Tab):
                                           self.set_roster_filter)
         self.input.resize(1, self.width, self.height - 1, 0)
         self.input.disable_history()
-        roster.modified()
         self.refresh()
         return True
 
@@ -1342,13 +1343,11 @@ class RosterInfoTab(Tab):
 
     def set_roster_filter_slow(self, txt):
         roster.contact_filter = (jid_and_name_match_slow, txt)
-        roster.modified()
         self.refresh()
         return False
 
     def set_roster_filter(self, txt):
-        roster.contact_filter = (jid_and_name_match, txt)
-        roster.modified()
+        roster.contact_filter = (self.search, txt)
         self.refresh()
         return False
 
@@ -1357,7 +1356,6 @@ class RosterInfoTab(Tab):
         curses.curs_set(0)
         roster.contact_filter = roster.DEFAULT_FILTER
         self.reset_help_message()
-        roster.modified()
         return True
 
     def on_close(self):
@@ -1374,13 +1372,109 @@ def diffmatch(search, string):
         return False
     l = len(search)
     ratio = 0.7
+    # the characters in common are an upper bound of the matches in
+    # every window of the string
+    common = sum((Counter(search) & Counter(string)).values())
+    if 2.0 * common / (2 * l) < ratio:
+        return False
+    matcher = difflib.SequenceMatcher(None, search)
     for i in range(len(string) - l + 1):
-        if difflib.SequenceMatcher(None, search,
-                                   string[i:i + l]).ratio() >= ratio:
+        matcher.set_seq2(string[i:i + l])
+        if matcher.quick_ratio() >= ratio and matcher.ratio() >= ratio:
             return True
     return False
 
 
+def _trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class RosterSearch:
+    """
+    The search of the roster contacts (the “s” key): an index of the
+    trigrams of their jids, names and groups, updated for the contacts
+    modified since the previous search (see Roster.modified_since()).
+    The results of a search which only adds characters to the previous
+    one are found in the previous results.
+    It can be used as the function of Roster.contact_filter.
+    """
+
+    def __init__(self, roster) -> None:
+        self.roster = roster
+        self.version = None  # type: Optional[int]
+        # the lowercase jid, name and groups of each contact
+        self.texts = {}  # type: Dict[str, str]
+        self.trigrams = defaultdict(set)  # type: Dict[str, Set[str]]
+        self.query = ''
+        self.results = set()  # type: Set[str]
+
+    def __call__(self, contact: Contact, txt: str) -> bool:
+        return str(contact.bare_jid) in self.select(txt)
+
+    def _index(self, jid: str) -> Optional[str]:
+        text = self.texts.pop(jid, None)
+        if text is not None:
+            for trigram in _trigrams(text):
+                jids = self.trigrams[trigram]
+                jids.discard(jid)
+                if not jids:
+                    del self.trigrams[trigram]
+        if jid not in self.roster:
+            return None
+        contact = self.roster[jid]
+        groups = [group for group in contact.groups if group != 'none']
+        text = '\n'.join([jid, contact.name] + groups).lower()
+        self.texts[jid] = text
+        for trigram in _trigrams(text):
+            self.trigrams[trigram].add(jid)
+        return text
+
+    def update(self) -> None:
+        """Index the contacts modified since the last update"""
+        modified = None
+        if self.version is not None:
+            modified = self.roster.modified_since(self.version)
+        if modified is None:
+            self.texts = {}
+            self.trigrams = defaultdict(set)
+            self.query = ''
+            for jid in self.roster.jids():
+                self._index(jid)
+        else:
+            for jid in modified:
+                text = self._index(jid)
+                if not self.query:
+                    continue
+                if text is not None and self.query in text:
+                    self.results.add(jid)
+                else:
+                    self.results.discard(jid)
+        self.version = self.roster.version
+
+    def select(self, txt: str) -> Iterable[str]:
+        """The bare jids of the contacts matching txt"""
+        self.update()
+        txt = txt.lower()
+        if not txt:
+            return self.texts.keys()  # Everything matches
+        if txt == self.query:
+            return self.results
+        if self.query and self.query in txt:
+            candidates = self.results  # type: Iterable[str]
+        elif len(txt) >= 3:
+            indexed = sorted(
+                (self.trigrams.get(trigram, set())
+                 for trigram in _trigrams(txt)),
+                key=len)
+            candidates = indexed[0].intersection(*indexed[1:])
+        else:
+            candidates = self.texts
+        texts = self.texts
+        self.results = {jid for jid in candidates if txt in texts[jid]}
+        self.query = txt
+        return self.results
+
+
 def jid_and_name_match(contact, txt):
     """
     Match jid with text precisely
@@ -0,0 +1,113 @@
+"""
+A SearchTab lists the messages of the logs matching a /search, the most
+recent first. The results are fetched one page at a time, in the thread
+of the search database, the next page being loaded when the cursor
+reaches the end of the list.
+"""
+import asyncio
+import logging
+import sqlite3
+from typing import Dict, Callable
+
+from poezio.tabs import ListTab
+from poezio.core.structs import Command
+
+log = logging.getLogger(__name__)
+
+PAGE_SIZE = 100
+
+
+class SearchTab(ListTab):
+    """
+    A tab listing the results of a search in the logs
+    """
+    plugin_commands = {}  # type: Dict[str, Command]
+    plugin_keys = {}  # type: Dict[str, Callable]
+
+    def __init__(self, core, search, query, terms, filters):
+        """Parameters:
+        search: the LogSearch to query
+        query: the query as given to /search, for the tab name
+        terms, filters: the query, as split by log_search.parse_query()
+        """
+        ListTab.__init__(self, core, 'Search: %s' % query,
+                         '“Enter”: show the whole message.',
+                         'Searching “%s”' % query,
+                         (('room', 0), ('time', 1), ('nick', 2),
+                          ('message', 3)))
+        self.search = search
+        self.query = query
+        self.terms = terms
+        self.filters = filters
+        self.offset = 0
+        self.complete = False
+        self.loading = False
+        self.key_func['^M'] = self.show_selected
+        self.load_page()
+
+    def get_columns_sizes(self):
+        return {
+            'room': int(self.width * 2 / 8),
+            'time': 20,
+            'nick': int(self.width / 8),
+            'message':
+            self.width - int(self.width * 2 / 8) - 20 - int(self.width / 8)
+        }
+
+    def load_page(self) -> bool:
+        """
+        Start fetching the next page of results, return False if there
+        is none or if it is already being fetched
+        """
+        if self.complete or self.loading:
+            return False
+        self.loading = True
+        future = self.search.search(
+            self.terms, limit=PAGE_SIZE, offset=self.offset, **self.filters)
+        asyncio.wrap_future(future).add_done_callback(self._on_page)
+        return True
+
+    def _on_page(self, future) -> None:
+        "Show a page of results, once it is fetched"
+        self.loading = False
+        try:
+            results = future.result()
+        except sqlite3.Error as exc:
+            log.debug('Search of “%s” failed', self.query, exc_info=True)
+            self.complete = True
+            self.info_header.message = 'Search failed: %s' % exc
+            results = []
+        else:
+            self.offset += len(results)
+            self.complete = len(results) < PAGE_SIZE
+            self.listview.add_lines(
+                [(jid, time.strftime('%Y-%m-%d %H:%M:%S'), nick,
+                  txt.replace('\n', '|'), txt)
+                 for jid, nick, time, txt in results])
+            self.info_header.message = '%s%s results for “%s”' % (
+                self.offset, '' if self.complete else '+', self.query)
+        if self.core.tabs.current_tab is self:
+            self.core.schedule_refresh()
+
+    def _near_the_end(self, rows: int) -> bool:
+        """Whether the selected row is one of the last rows loaded"""
+        selected = self.listview.get_selected_row()
+        return selected is None or any(
+            row is selected for row in self.listview.lines[-rows:])
+
+    def move_cursor_down(self):
+        if self._near_the_end(1):
+            self.load_page()
+        super().move_cursor_down()
+
+    def on_scroll_down(self):
+        if self._near_the_end(self.listview.height + 1):
+            self.load_page()
+        return super().on_scroll_down()
+
+    def show_selected(self):
+        row = self.listview.get_selected_row()
+        if not row:
+            return
+        self.core.information('%s %s <%s> %s' % (row[1], row[0], row[2],
+                                                  row[4]), 'Info')
@@ -11,7 +11,7 @@ independently by their TextWins.
 import logging
 log = logging.getLogger(__name__)
 
-from typing import Union, Optional, List, Tuple
+from typing import Any, Dict, Iterable, Iterator, Union, Optional, List, Tuple
 from datetime import datetime
 from poezio.config import config
 from poezio.theming import get_theme, dump_tuple
@@ -20,7 +20,7 @@ from poezio.theming import get_theme, dump_tuple
 class Message:
     __slots__ = ('txt', 'nick_color', 'time', 'str_time', 'nickname', 'user',
                  'identifier', 'highlight', 'me', 'old_message', 'revisions',
-                 'jid', 'ack')
+                 'jid', 'ack', 'wrap_cache', 'segments', '__weakref__')
 
     def __init__(self,
                  txt: str,
@@ -71,12 +71,21 @@ class Message:
         self.revisions = revisions
         self.jid = jid
         self.ack = ack
+        # text width → wrapped lines, as array('I') of (start, end,
+        # segment) triples, see windows.text_win.cut_message
+        self.wrap_cache = None  # type: Optional[Dict[int, Any]]
+        # the text parsed into runs of (start, end, attributes), see
+        # windows.funcs.compile_segments
+        self.segments = None  # type: Optional[List[Tuple[int, int, Any]]]
 
     def _other_elems(self) -> str:
         "Helper for the repr_message function"
         acc = []
         fields = list(self.__slots__)
         fields.remove('old_message')
+        fields.remove('wrap_cache')
+        fields.remove('segments')
+        fields.remove('__weakref__')
         for field in fields:
             acc.append('%s=%s' % (field, repr(getattr(self, field))))
         return 'Message(%s, %s' % (', '.join(acc), 'old_message=')
@@ -102,6 +111,161 @@ class Message:
         return ''.join(acc)
 
 
+class RingBuffer:
+    """
+    A list-like container with a maximum length, backed by a circular
+    array: appending to a full buffer overwrites the oldest item instead
+    of shifting everything, so adding and evicting are O(1), and so is
+    indexed access.
+
+    The underlying array grows on demand up to *maxlen*, so an almost
+    empty buffer does not cost a full allocation.
+
+    *base* is the number of items ever dropped from the front, so that
+    ``base + index`` is a sequence number that stays valid for an item
+    until it is evicted.
+    """
+    __slots__ = ('maxlen', 'base', '_items', '_head', '_len')
+
+    def __init__(self, maxlen: int, iterable: Iterable[Any] = ()) -> None:
+        self.maxlen = max(maxlen, 0)
+        self.base = 0
+        self._items = []  # type: List[Any]
+        self._head = 0
+        self._len = 0
+        self.extend(iterable)
+
+    def _grow(self) -> None:
+        "Unroll the items into a larger array (amortized O(1) append)"
+        items = list(self)
+        size = min(max(16, 2 * len(items)), self.maxlen)
+        self._items = items + [None] * (size - len(items))
+        self._head = 0
+
+    def _index(self, index: int) -> int:
+        "Convert a (possibly negative) index into an array position"
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError('RingBuffer index out of range')
+        return (self._head + index) % len(self._items)
+
+    def append(self, item: Any) -> None:
+        """
+        Add an item at the end, evicting the first one if the buffer is
+        full
+        """
+        if self._len == self.maxlen:
+            self.base += 1
+            if not self.maxlen:
+                return
+            self._items[self._head] = item
+            self._head = (self._head + 1) % self.maxlen
+            return
+        if self._len == len(self._items):
+            self._grow()
+        self._items[(self._head + self._len) % len(self._items)] = item
+        self._len += 1
+
+    def extend(self, iterable: Iterable[Any]) -> None:
+        for item in iterable:
+            self.append(item)
+
+    def extendleft(self, items: List[Any]) -> int:
+        """
+        Insert the given items, in order, before the first one. Only the
+        last ones are inserted if there is not enough free space, as
+        nothing is ever evicted from the end.
+        Return the number of inserted items.
+        """
+        nb = min(len(items), self.maxlen - self._len)
+        for item in reversed(items[len(items) - nb:]):
+            if self._len == len(self._items):
+                self._grow()
+            self._head = (self._head - 1) % len(self._items)
+            self._items[self._head] = item
+            self._len += 1
+            self.base -= 1
+        return nb
+
+    def popleft(self) -> Any:
+        "Remove and return the first item"
+        if not self._len:
+            raise IndexError('pop from an empty RingBuffer')
+        item = self._items[self._head]
+        self._items[self._head] = None
+        self._head = (self._head + 1) % len(self._items)
+        self._len -= 1
+        self.base += 1
+        return item
+
+    def pop(self) -> Any:
+        "Remove and return the last item"
+        pos = self._index(-1)
+        item = self._items[pos]
+        self._items[pos] = None
+        self._len -= 1
+        return item
+
+    def clear(self) -> None:
+        self.base += self._len
+        self._items = []
+        self._head = 0
+        self._len = 0
+
+    def index(self, value: Any) -> int:
+        for i, item in enumerate(self):
+            if item is value or item == value:
+                return i
+        raise ValueError('%r is not in RingBuffer' % (value, ))
+
+    def remove(self, value: Any) -> None:
+        index = self.index(value)
+        self.splice(index, index + 1, ())
+
+    def splice(self, start: int, stop: int, items: Iterable[Any]) -> None:
+        """
+        Replace the items between start and stop with the given ones.
+        Only the items after *start* are moved, which is cheap when
+        working on the end of the buffer.
+        """
+        start, stop, _ = slice(start, stop).indices(self._len)
+        stop = max(start, stop)
+        tail = self[stop:]
+        while self._len > start:
+            self.pop()
+        self.extend(items)
+        self.extend(tail)
+
+    def __getitem__(self, key: Union[int, slice]) -> Any:
+        if isinstance(key, slice):
+            items, head, size = self._items, self._head, len(self._items)
+            return [
+                items[(head + i) % size]
+                for i in range(*key.indices(self._len))
+            ]
+        return self._items[self._index(key)]
+
+    def __setitem__(self, index: int, item: Any) -> None:
+        self._items[self._index(index)] = item
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator[Any]:
+        items, head, size = self._items, self._head, len(self._items)
+        for i in range(self._len):
+            yield items[(head + i) % size]
+
+    def __reversed__(self) -> Iterator[Any]:
+        items, head, size = self._items, self._head, len(self._items)
+        for i in range(self._len - 1, -1, -1):
+            yield items[(head + i) % size]
+
+    def __repr__(self) -> str:
+        return 'RingBuffer(%s, %r)' % (self.maxlen, list(self))
+
+
 class CorrectionError(Exception):
     pass
 
@@ -121,16 +285,37 @@ class TextBuffer:
         if messages_nb_limit is None:
             messages_nb_limit = config.get('max_messages_in_memory')
         self._messages_nb_limit = messages_nb_limit  # type: int
-        # Message objects
-        self.messages = []  # type: List[Message]
+        # Message objects, the oldest ones are dropped once the limit
+        # is reached
+        self._messages = RingBuffer(messages_nb_limit)
+        # message id → sequence number (see RingBuffer.base) of the
+        # message, to find corrected or acked messages without a scan
+        self._ids = {}  # type: Dict[str, int]
         # we keep track of one or more windows
         # so we can pass the new messages to them, as they are added, so
         # they (the windows) can build the lines from the new message
         self._windows = []
+        # where the messages older than the ones in memory are read from,
+        # a page at a time, when scrolling up (see history_page and
+        # logger.LogPager), None if there are none
+        self.history = None  # type: Optional[Any]
 
     def add_window(self, win) -> None:
         self._windows.append(win)
 
+    @property
+    def messages(self) -> RingBuffer:
+        return self._messages
+
+    @messages.setter
+    def messages(self, messages: Iterable[Message]) -> None:
+        self._messages = RingBuffer(self._messages_nb_limit, messages)
+        base = self._messages.base
+        self._ids = {
+            msg.identifier: base + i
+            for i, msg in enumerate(self._messages) if msg.identifier
+        }
+
     @property
     def last_message(self) -> Optional[Message]:
         return self.messages[-1] if self.messages else None
@@ -162,10 +347,14 @@ class TextBuffer:
             highlight=highlight,
             jid=jid,
             ack=ack)
-        self.messages.append(msg)
-
-        while len(self.messages) > self._messages_nb_limit:
-            self.messages.pop(0)
+        messages = self.messages
+        if len(messages) == messages.maxlen and messages:
+            evicted = messages[0]
+            if self._ids.get(evicted.identifier) == messages.base:
+                del self._ids[evicted.identifier]
+        messages.append(msg)
+        if msg.identifier:
+            self._ids[msg.identifier] = messages.base + len(messages) - 1
 
         ret_val = 0
         show_timestamps = config.get('show_timestamps')
@@ -189,11 +378,14 @@ class TextBuffer:
         """
         Find a message in the text buffer from its message id
         """
-        for i in range(len(self.messages) - 1, -1, -1):
-            msg = self.messages[i]
-            if msg.identifier == old_id:
-                return i
-        return -1
+        seq = self._ids.get(old_id)
+        if seq is None:
+            return -1
+        i = seq - self.messages.base
+        if i < 0:
+            del self._ids[old_id]
+            return -1
+        return i
 
     def ack_message(self, old_id: str, jid: str) -> Union[None, bool, Message]:
         """Mark a message as acked"""
@@ -223,6 +415,7 @@ class TextBuffer:
         msg.ack = value
         if append:
             msg.txt += append
+            msg.wrap_cache = msg.segments = None
         return msg
 
     def modify_message(self,
@@ -274,9 +467,35 @@ class TextBuffer:
             revisions=msg.revisions + 1,
             jid=jid)
         self.messages[i] = message
+        seq = self._ids.pop(old_id)
+        if new_id:
+            self._ids[new_id] = seq
         log.debug('Replacing message %s with %s.', old_id, new_id)
         return message
 
+    def history_page(self, number: int,
+                     before: Optional[datetime]) -> Optional[List[Message]]:
+        """
+        Return the messages of the page *number* (0 being the most recent
+        one) of the history preceding the local time *before*, None if
+        there is no such page. They are not added to the buffer.
+        """
+        if self.history is None:
+            return None
+        page = self.history.page(number, before)
+        if not page:
+            return None
+        return [
+            Message(
+                txt=msg['txt'],
+                time=msg['time'],
+                nickname=msg.get('nickname'),
+                nick_color=None,
+                history=True,
+                user=None,
+                identifier=None) for msg in page
+        ]
+
     def del_window(self, win) -> None:
         self._windows.remove(win)
 
@@ -546,6 +546,9 @@ def prepare_ccolor_palette(theme: Theme) -> None:
 def reload_theme() -> Optional[str]:
     theme_name = config.get('theme')
     global theme
+    # the attributes of the text segments are cached with their colors
+    from poezio.windows.base_wins import segment_attrs_to_curses
+    segment_attrs_to_curses.cache_clear()
     if theme_name == 'default' or not theme_name.strip():
         theme = Theme()
         return None
@@ -13,6 +13,7 @@ import logging
 log = logging.getLogger(__name__)
 
 import curses
+import functools
 import string
 
 from typing import Optional, Tuple
@@ -24,6 +25,30 @@ FORMAT_CHAR = '\x19'
 # I guess. But maybe we can find better chars that are even less risky.
 format_chars = '\x0E\x0F\x10\x11\x12\x13\x14\x15\x16\x17\x18\x1A'
 
+# Bits of the attribute flags of a text segment, see
+# windows.funcs.compile_segments
+ATTR_BOLD = 1
+ATTR_UNDERLINE = 2
+ATTR_ITALIC = 4
+
+
+@functools.lru_cache(maxsize=256)
+def segment_attrs_to_curses(attrs: Tuple[Optional[Tuple[int, int]], int]) -> int:
+    """
+    Convert the (color, flags) attributes of a segment (see
+    windows.funcs.compile_segments) into a curses attribute
+    """
+    color, flags = attrs
+    curses_attr = to_curses_attr(color) if color is not None else 0
+    if flags & ATTR_BOLD:
+        curses_attr |= curses.A_BOLD
+    if flags & ATTR_UNDERLINE:
+        curses_attr |= curses.A_UNDERLINE
+    if flags & ATTR_ITALIC:
+        curses_attr |= curses.A_ITALIC if hasattr(
+            curses, 'A_ITALIC') else curses.A_REVERSE
+    return curses_attr
+
 
 class DummyWin:
     def __getattribute__(self, name: str):
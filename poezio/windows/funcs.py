@@ -2,11 +2,12 @@
 Standalone functions used by the modules
 """
 
-import string
-from typing import Optional, List
-from poezio.windows.base_wins import FORMAT_CHAR, format_chars
+from typing import Optional, List, Tuple
+from poezio.windows.base_wins import format_chars
+from poezio.poopt import parse_format
 
-DIGITS = string.digits + '-'
+# (color tuple or None, attribute flags)
+SegmentAttrs = Tuple[Optional[Tuple[int, int]], int]
 
 
 def find_first_format_char(text: str,
@@ -30,31 +31,12 @@ def truncate_nick(nick: str, size=10) -> str:
     return nick
 
 
-def parse_attrs(text: str, previous: Optional[List[str]] = None) -> List[str]:
-    next_attr_char = text.find(FORMAT_CHAR)
-    if previous:
-        attrs = previous
-    else:
-        attrs = []
-    while next_attr_char != -1 and text:
-        if next_attr_char + 1 < len(text):
-            attr_char = text[next_attr_char + 1].lower()
-        else:
-            attr_char = '\0'
-        if attr_char == 'o':
-            attrs = []
-        elif attr_char == 'u':
-            attrs.append('u')
-        elif attr_char == 'b':
-            attrs.append('b')
-        elif attr_char == 'i':
-            attrs.append('i')
-        if attr_char in DIGITS and attr_char:
-            color_str = text[next_attr_char + 1:text.find('}', next_attr_char)]
-            if color_str:
-                attrs.append(color_str + '}')
-            text = text[next_attr_char + len(color_str) + 2:]
-        else:
-            text = text[next_attr_char + 2:]
-        next_attr_char = text.find(FORMAT_CHAR)
-    return attrs
+def compile_segments(text: str) -> List[Tuple[int, int, SegmentAttrs]]:
+    """
+    Parse the formatting chars of a text once, and return the runs of
+    printable text, as (start, end, attrs) tuples, start and end being
+    positions in the text, and attrs the (color, flags) that apply to the
+    run. This follows the rules of Win.addstr_colored, starting from an
+    empty set of attributes, and is done by poopt.parse_format.
+    """
+    return parse_format(text)[0]
@@ -5,8 +5,10 @@ one showing detailed info on the current selection)
 import logging
 log = logging.getLogger(__name__)
 
+from bisect import bisect_left
 from datetime import datetime
-from typing import Optional, List, Union, Dict
+from itertools import chain
+from typing import Any, Optional, List, Tuple, Union, Dict
 
 from poezio.windows.base_wins import Win
 
@@ -14,9 +16,44 @@ from poezio import common
 from poezio.config import config
 from poezio.contact import Contact, Resource
 from poezio.roster import Roster, RosterGroup
+from poezio.roster_sorting import contact_sort_key, group_sort_key
 from poezio.theming import get_theme, to_curses_attr
 
-Row = Union[RosterGroup, Contact]
+Row = Union[RosterGroup, Contact, Resource]
+
+
+class GroupRows:
+    """
+    The rows of a group in the roster window: its displayed contacts,
+    each followed by its resources if it is unfolded, ordered by their
+    sort keys
+    """
+    __slots__ = ('group', 'key', 'keys', 'blocks', 'length')
+
+    def __init__(self, group: RosterGroup) -> None:
+        self.group = group
+        # the key of the group, if it is displayed
+        self.key = None  # type: Any
+        # the number of its rows in the roster cache
+        self.length = 0
+        self.keys = []  # type: List[Any]
+        self.blocks = []  # type: List[List[Row]]
+
+    def add(self, key: Any, block: List[Row]) -> None:
+        index = bisect_left(self.keys, key)
+        self.keys.insert(index, key)
+        self.blocks.insert(index, block)
+
+    def remove(self, key: Any) -> None:
+        index = bisect_left(self.keys, key)
+        if index < len(self.keys) and self.keys[index] == key:
+            del self.keys[index]
+            del self.blocks[index]
+
+    def rows(self) -> List[Row]:
+        if self.group.folded:
+            return [self.group]
+        return [self.group] + list(chain.from_iterable(self.blocks))
 
 
 class RosterWin(Win):
@@ -26,6 +63,18 @@ class RosterWin(Win):
         self.start_pos = 1  # position of the start of the display
         self.selected_row = None  # type: Optional[Row]
         self.roster_cache = []  # type: List[Row]
+        # The view of the roster, updated for the modified contacts only:
+        # the rows of each group, the displayed groups ordered by their
+        # keys, and the keys of each contact in its groups (None when it
+        # is not displayed). The roster cache is spliced for the groups
+        # of these contacts only.
+        self._view_options = None  # type: Optional[Tuple[bool, str, str]]
+        self._groups = {}  # type: Dict[str, GroupRows]
+        self._group_keys = []  # type: List[Any]
+        self._group_rows = []  # type: List[GroupRows]
+        self._placed = {}  # type: Dict[str, Dict[str, Any]]
+        self._contact_key = None
+        self._group_key = None
 
     @property
     def roster_len(self) -> int:
@@ -93,40 +142,167 @@ class RosterWin(Win):
         """
         if not roster.needs_rebuild:
             return
-        log.debug('The roster has changed, rebuilding the cache…')
+        jids = roster.pop_modified()
         # This is a search
         if roster.contact_filter is not roster.DEFAULT_FILTER:
+            log.debug('The roster has changed, rebuilding the cache…')
+            self._view_options = None
             self.roster_cache = []
             sort = config.get('roster_sort', 'jid:show') or 'jid:show'
             for contact in roster.get_contacts_sorted_filtered(sort):
                 self.roster_cache.append(contact)
         else:
-            show_offline = config.get('roster_show_offline')
-            sort = config.get('roster_sort') or 'jid:show'
-            group_sort = config.get('roster_group_sort') or 'name'
-            self.roster_cache = []
-            # build the cache
-            for group in roster.get_groups(group_sort):
-                contacts_filtered = group.get_contacts()
-                if (not show_offline and group.get_nb_connected_contacts() == 0
-                    ) or not contacts_filtered:
-                    continue  # Ignore empty groups
-                self.roster_cache.append(group)
-                if group.folded:
-                    continue  # ignore folded groups
-                for contact in group.get_contacts(sort=sort):
-                    if not show_offline and len(contact) == 0:
-                        continue  # ignore offline contacts
-                    self.roster_cache.append(contact)
-                    if not contact.folded(group.name):
-                        for resource in contact.get_resources():
-                            self.roster_cache.append(resource)
+            options = (bool(config.get('roster_show_offline')),
+                       config.get('roster_sort') or 'jid:show',
+                       config.get('roster_group_sort') or 'name')
+            if jids is None or options != self._view_options:
+                log.debug('The roster has changed, rebuilding the cache…')
+                self._build_view(roster, options)
+            else:
+                for jid in jids:
+                    self._update_contact(roster, jid)
         roster.last_built = datetime.now()
         if self.selected_row in self.roster_cache:
             if self.pos < self.roster_len and self.roster_cache[self.
                                                                 pos] != self.selected_row:
                 self.pos = self.roster_cache.index(self.selected_row)
 
+    def _build_view(self, roster: Roster,
+                    options: Tuple[bool, str, str]) -> None:
+        """
+        Build the view of all the groups, with the sort options
+        """
+        self._view_options = options
+        _, sort, group_sort = options
+        self._contact_key = contact_sort_key(sort)
+        self._group_key = group_sort_key(group_sort)
+        self._groups = {}
+        self._group_keys = []
+        self._group_rows = []
+        self._placed = {}
+        for group in roster.groups.values():
+            rows = self._groups[group.name] = GroupRows(group)
+            for contact in group.contacts:
+                self._place(rows, contact)
+            # sort each group once, instead of inserting its contacts
+            order = sorted(range(len(rows.keys)), key=rows.keys.__getitem__)
+            rows.keys = [rows.keys[i] for i in order]
+            rows.blocks = [rows.blocks[i] for i in order]
+            self._order_group(rows)
+        self.roster_cache = []
+        for rows in self._group_rows:
+            group_rows = rows.rows()
+            rows.length = len(group_rows)
+            self.roster_cache.extend(group_rows)
+
+    def _update_contact(self, roster: Roster, jid: str) -> None:
+        """
+        Move the rows of a modified contact, and the headers of the
+        groups it left or joined, to their new positions
+        """
+        affected = []
+        for name, key in self._placed.pop(jid, {}).items():
+            rows = self._groups.get(name)
+            if rows is not None:
+                self._cut_group(rows)
+                if key is not None:
+                    rows.remove(key)
+                affected.append(rows)
+        contact = roster.contacts.get(jid)
+        if contact is not None:
+            for name in contact.groups:
+                group = roster.groups.get(name)
+                if group is None or contact not in group:
+                    continue
+                rows = self._groups.get(name)
+                if rows is None or rows.group is not group:
+                    if rows is not None:
+                        self._cut_group(rows)
+                        self._unorder_group(rows)
+                    rows = self._groups[name] = GroupRows(group)
+                self._cut_group(rows)
+                self._place(rows, contact, sort=True)
+                affected.append(rows)
+        for rows in affected:
+            self._order_group(rows)
+        for rows in affected:
+            self._paste_group(rows)
+
+    def _place(self, rows: GroupRows, contact: Contact,
+               sort: bool = False) -> None:
+        """
+        Add the rows of a contact to a group, if it is displayed
+        """
+        placed = self._placed.setdefault(str(contact.bare_jid), {})
+        name = rows.group.name
+        show_offline = self._view_options[0]
+        if not show_offline and len(contact) == 0:
+            # ignore offline contacts, but they count in the group sizes
+            placed[name] = None
+            return
+        block = [contact]  # type: List[Row]
+        if not contact.folded(name):
+            block.extend(contact.get_resources())
+        key = self._contact_key(contact)
+        if sort:
+            rows.add(key, block)
+        else:
+            rows.keys.append(key)
+            rows.blocks.append(block)
+        placed[name] = key
+
+    def _group_offset(self, rows: GroupRows) -> int:
+        """
+        Return the position of the rows of a displayed group in the
+        roster cache
+        """
+        index = bisect_left(self._group_keys, rows.key)
+        return sum(other.length for other in self._group_rows[:index])
+
+    def _cut_group(self, rows: GroupRows) -> None:
+        """
+        Remove the rows of a group from the roster cache
+        """
+        if not rows.length:
+            return
+        offset = self._group_offset(rows)
+        del self.roster_cache[offset:offset + rows.length]
+        rows.length = 0
+
+    def _paste_group(self, rows: GroupRows) -> None:
+        """
+        Insert the rows of a displayed group in the roster cache
+        """
+        if rows.key is None or rows.length:
+            return
+        group_rows = rows.rows()
+        offset = self._group_offset(rows)
+        self.roster_cache[offset:offset] = group_rows
+        rows.length = len(group_rows)
+
+    def _unorder_group(self, rows: GroupRows) -> None:
+        if rows.key is None:
+            return
+        index = bisect_left(self._group_keys, rows.key)
+        if index < len(self._group_keys) and \
+                self._group_rows[index] is rows:
+            del self._group_keys[index]
+            del self._group_rows[index]
+        rows.key = None
+
+    def _order_group(self, rows: GroupRows) -> None:
+        """
+        Move a group header to its position, or hide it if it does not
+        have any displayed contact
+        """
+        self._unorder_group(rows)
+        if not rows.keys:
+            return  # Ignore empty groups
+        rows.key = self._group_key(rows.group)
+        index = bisect_left(self._group_keys, rows.key)
+        self._group_keys.insert(index, rows.key)
+        self._group_rows.insert(index, rows)
+
     def refresh(self, roster: Roster) -> None:
         """
         We display a number of lines from the roster cache
@@ -5,30 +5,344 @@ Can be locked, scrolled, has a separator, etc…
 
 import logging
 import curses
+import sys
+import weakref
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from datetime import datetime
 from math import ceil, log10
-from typing import Optional, List, Union
+from typing import Dict, Iterable, Iterator, Optional, List, Sequence, Tuple, Union
 
-from poezio.windows.base_wins import Win, FORMAT_CHAR
-from poezio.windows.funcs import truncate_nick, parse_attrs
+from poezio.windows.base_wins import Win, segment_attrs_to_curses
+from poezio.windows.funcs import truncate_nick, compile_segments
 
 from poezio import poopt
 from poezio.config import config
-from poezio.theming import to_curses_attr, get_theme, dump_tuple
-from poezio.text_buffer import Message
+from poezio.theming import to_curses_attr, get_theme
+from poezio.text_buffer import Message, RingBuffer
 
 log = logging.getLogger(__name__)
 
 
 # msg is a reference to the corresponding Message object. text_start and
-# text_end are the position delimiting the text in this line.
+# text_end are the position delimiting the text in this line. segment is
+# the index of the first of the message segments displayed in this line.
 class Line:
-    __slots__ = ('msg', 'start_pos', 'end_pos', 'prepend')
+    __slots__ = ('msg', 'start_pos', 'end_pos', 'segment')
 
-    def __init__(self, msg: Message, start_pos: int, end_pos: int, prepend: str) -> None:
+    def __init__(self, msg: Message, start_pos: int, end_pos: int, segment: int) -> None:
         self.msg = msg
         self.start_pos = start_pos
         self.end_pos = end_pos
-        self.prepend = prepend
+        self.segment = segment
+
+
+# The message index of a separator line in a LineStore
+NO_MESSAGE = -0x80000000
+
+
+class LineStore:
+    """
+    A compact store for the built lines of a window, with the same
+    interface as a RingBuffer of lines (and None separators), see
+    text_buffer.RingBuffer.
+
+    Instead of one Line object per line, the positions of the lines are
+    kept in array('I') columns, and their message as an index in a list
+    of the messages (consecutive lines of a message share the same
+    entry). Line objects are only created when lines are read, which is
+    mostly done for the lines on the screen.
+
+    Message indexes are absolute (_messages[0] has the index _msg_base)
+    so that dropping or inserting messages at the front does not change
+    the others. They go below 0 when lines are inserted at the front,
+    hence the signed array('i').
+    """
+    __slots__ = ('maxlen', 'base', '_msg', '_start', '_end', '_segment',
+                 '_messages', '_msg_base')
+
+    def __init__(self, maxlen: int) -> None:
+        self.maxlen = max(maxlen, 0)
+        self.base = 0
+        self._msg = array('i')
+        self._start = array('I')
+        self._end = array('I')
+        self._segment = array('I')
+        self._messages = []  # type: List[Message]
+        self._msg_base = 0
+
+    def _line(self, index: int) -> Optional[Line]:
+        msg = self._msg[index]
+        if msg == NO_MESSAGE:
+            return None
+        return Line(self._messages[msg - self._msg_base], self._start[index],
+                    self._end[index], self._segment[index])
+
+    def _columns(self, lines: Iterable[Optional[Line]],
+                 messages: List[Message], msg_base: int):
+        """
+        Return the columns of the given lines, appending their messages
+        to *messages* (whose first one has the index *msg_base*) when
+        they are not its last one.
+        """
+        msg_col = array('i')
+        start_col = array('I')
+        end_col = array('I')
+        segment_col = array('I')
+        for line in lines:
+            if line is None:
+                msg_col.append(NO_MESSAGE)
+                start_col.append(0)
+                end_col.append(0)
+                segment_col.append(0)
+                continue
+            if not messages or messages[-1] is not line.msg:
+                messages.append(line.msg)
+            msg_col.append(msg_base + len(messages) - 1)
+            start_col.append(line.start_pos)
+            end_col.append(line.end_pos)
+            segment_col.append(line.segment)
+        return msg_col, start_col, end_col, segment_col
+
+    def drop_first(self, nb: int) -> None:
+        "Drop the nb first lines, and the messages they were the last of"
+        if nb <= 0:
+            return
+        for column in (self._msg, self._start, self._end, self._segment):
+            del column[:nb]
+        self.base += nb
+        for msg in self._msg:
+            if msg != NO_MESSAGE:
+                del self._messages[:msg - self._msg_base]
+                self._msg_base = msg
+                break
+        else:
+            self._msg_base += len(self._messages)
+            self._messages = []
+
+    def append(self, line: Optional[Line]) -> None:
+        self.extend((line, ))
+
+    def extend(self, lines: Iterable[Optional[Line]]) -> None:
+        """
+        Add lines at the end, evicting the first ones if the store is
+        full
+        """
+        columns = self._columns(lines, self._messages, self._msg_base)
+        for column, new in zip(
+            (self._msg, self._start, self._end, self._segment), columns):
+            column.extend(new)
+        self.drop_first(len(self._msg) - self.maxlen)
+
+    def extendleft(self, lines: List[Optional[Line]]) -> int:
+        """
+        Insert the given lines, in order, before the first one. Only the
+        last ones are inserted if there is not enough free space, as
+        nothing is ever evicted from the end.
+        Return the number of inserted lines.
+        """
+        nb = min(len(lines), self.maxlen - len(self._msg))
+        if nb <= 0:
+            return 0
+        lines = lines[len(lines) - nb:]
+        messages = []  # type: List[Message]
+        # the last inserted message may already be the first one
+        if self._messages:
+            shared = self._messages[0]
+            nb_new = len({id(line.msg) for line in lines
+                          if line is not None and line.msg is not shared})
+        else:
+            nb_new = len({id(line.msg) for line in lines if line is not None})
+        msg_base = self._msg_base - nb_new
+        columns = self._columns(lines, messages, msg_base)
+        self._msg, self._start, self._end, self._segment = (
+            new + column for new, column in zip(
+                columns, (self._msg, self._start, self._end, self._segment)))
+        self._messages = messages[:nb_new] + self._messages
+        self._msg_base = msg_base
+        self.base -= nb
+        return nb
+
+    def clear(self) -> None:
+        self.base += len(self._msg)
+        for column in (self._msg, self._start, self._end, self._segment):
+            del column[:]
+        self._msg_base += len(self._messages)
+        self._messages = []
+
+    def splice(self, start: int, stop: int,
+               lines: Iterable[Optional[Line]]) -> None:
+        """
+        Replace the lines between start and stop with the given ones.
+        Only the lines after *start* are moved, which is cheap when
+        working on the end of the store.
+        """
+        start, stop, _ = slice(start, stop).indices(len(self._msg))
+        stop = max(start, stop)
+        tail = self[stop:]
+        for column in (self._msg, self._start, self._end, self._segment):
+            del column[start:]
+        # only keep the messages of the remaining lines
+        for msg in reversed(self._msg):
+            if msg != NO_MESSAGE:
+                del self._messages[msg - self._msg_base + 1:]
+                break
+        else:
+            self._msg_base += len(self._messages)
+            self._messages = []
+        self.extend(lines)
+        self.extend(tail)
+
+    def memory_usage(self) -> int:
+        """
+        Return the size in bytes of the columns and of the list of
+        messages (not of the messages themselves)
+        """
+        return sum(
+            sys.getsizeof(column)
+            for column in (self._msg, self._start, self._end, self._segment,
+                           self._messages))
+
+    def __getitem__(self, key: Union[int, slice]):
+        if isinstance(key, slice):
+            return [self._line(i) for i in range(*key.indices(len(self._msg)))]
+        if key < 0:
+            key += len(self._msg)
+        if not 0 <= key < len(self._msg):
+            raise IndexError('LineStore index out of range')
+        return self._line(key)
+
+    def __len__(self) -> int:
+        return len(self._msg)
+
+    def __iter__(self) -> Iterator[Optional[Line]]:
+        for i in range(len(self._msg)):
+            yield self._line(i)
+
+    def __reversed__(self) -> Iterator[Optional[Line]]:
+        for i in range(len(self._msg) - 1, -1, -1):
+            yield self._line(i)
+
+    def __repr__(self) -> str:
+        return 'LineStore(%s, %s lines)' % (self.maxlen, len(self._msg))
+
+
+# The wrapped lines of a message are cached on it, for each text width
+# they were computed for, so that going back to a previous width (e.g. by
+# toggling the user list) does not wrap everything again. This is the
+# maximum number of lines cached for all the messages, the least recently
+# used widths are dropped first.
+WRAP_CACHE_SIZE = 65536
+
+# (id(message), width) → (weak reference to the message, number of
+# lines), in LRU order. The references are weak so that the cache does
+# not keep alive the messages dropped from the text buffers (or from
+# closed tabs), their entries are removed when they are freed.
+_wrap_cache_lru = OrderedDict()  # type: OrderedDict
+_wrap_cache_nb_lines = 0
+
+
+def _forget_wrap_cache(key: Tuple[int, int], ref: weakref.ref) -> None:
+    "Remove the entry of a freed message from the wrap cache"
+    global _wrap_cache_nb_lines
+    entry = _wrap_cache_lru.get(key)
+    if entry is not None and entry[0] is ref:
+        del _wrap_cache_lru[key]
+        _wrap_cache_nb_lines -= entry[1]
+
+
+# The (color, flags) attributes of the segments, shared between all the
+# messages since there are only a few distinct ones.
+_shared_attrs = {}  # type: Dict[Tuple, Tuple]
+
+
+def get_segments(message: Message) -> List[Tuple[int, int, Tuple]]:
+    "Return the segments of a message, parsing its text if needed"
+    if message.segments is None:
+        message.segments = [
+            (start, end, _shared_attrs.setdefault(attrs, attrs))
+            for start, end, attrs in compile_segments(message.txt)
+        ]
+    return message.segments
+
+
+def _store_cut(message: Message, width: int,
+               cuts: Iterable[Tuple[int, int]]) -> array:
+    """
+    Add the segment index to the (start, end) lines of a message wrapped to
+    the given width, and keep the result in the wrap cache, as a flat
+    array('I') of (start, end, segment) triples.
+    """
+    global _wrap_cache_nb_lines
+    segments = get_segments(message)
+    nb_segments = len(segments)
+    ret = array('I')
+    segment = 0
+    for start, end in cuts:
+        while segment < nb_segments and segments[segment][1] <= start:
+            segment += 1
+        ret.extend((start, end, segment))
+    cache = message.wrap_cache
+    if cache is None:
+        cache = message.wrap_cache = {}
+    cache[width] = ret
+    key = (id(message), width)
+    previous = _wrap_cache_lru.pop(key, None)
+    if previous is not None:
+        _wrap_cache_nb_lines -= previous[1]
+    ref = weakref.ref(message, lambda ref: _forget_wrap_cache(key, ref))
+    _wrap_cache_lru[key] = (ref, len(ret) // 3)
+    _wrap_cache_nb_lines += len(ret) // 3
+    while _wrap_cache_nb_lines > WRAP_CACHE_SIZE:
+        (_, old_width), (old_ref, nb) = _wrap_cache_lru.popitem(last=False)
+        old_message = old_ref()
+        if old_message is not None and old_message.wrap_cache is not None:
+            old_message.wrap_cache.pop(old_width, None)
+        _wrap_cache_nb_lines -= nb
+    return ret
+
+
+def cut_messages(messages: Sequence[Optional[Message]],
+                 widths: Sequence[Optional[int]]) -> List[Optional[array]]:
+    """
+    Wrap the texts of several messages, each to its width, and return for
+    each of them a flat array('I') of (start, end, segment) triples, one
+    per line, segment being the index of the first segment of the message
+    (see get_segments) in that line. The messages whose width is None are
+    not wrapped, and get None.
+
+    The texts that are not in the wrap cache are all wrapped in a single
+    poopt.cut_text_many call.
+    """
+    ret = [None] * len(messages)  # type: List[Optional[array]]
+    missing = []  # type: List[int]
+    for i, (message, width) in enumerate(zip(messages, widths)):
+        if width is None:
+            continue
+        cache = message.wrap_cache
+        if cache is not None and width in cache:
+            _wrap_cache_lru.move_to_end((id(message), width))
+            ret[i] = cache[width]
+        else:
+            missing.append(i)
+    if not missing:
+        return ret
+    cuts = [[] for _ in missing]  # type: List[List[Tuple[int, int]]]
+    lines = iter(poopt.cut_text_many([messages[i].txt for i in missing],
+                                     [widths[i] for i in missing]))
+    for index, start, end in zip(lines, lines, lines):
+        cuts[index].append((start, end))
+    for i, message_cuts in zip(missing, cuts):
+        ret[i] = _store_cut(messages[i], widths[i], message_cuts)
+    return ret
+
+
+def cut_message(message: Message, width: int) -> array:
+    """
+    Wrap the text of a message to the given width, see cut_messages.
+    """
+    return cut_messages([message], [width])[0]
 
 
 class BaseTextWin(Win):
@@ -38,9 +352,44 @@ class BaseTextWin(Win):
         Win.__init__(self)
         self.lines_nb_limit = lines_nb_limit  # type: int
         self.pos = 0
-        # Each new message is built and kept here.
+        # Each new message is built and kept here, the oldest lines are
+        # dropped once lines_nb_limit is reached.
         # on resize, we rebuild all the messages
-        self.built_lines = []  # type: List[Union[None, Line]]
+        self.built_lines = LineStore(lines_nb_limit)
+        # message id → (sequence number of the first line, number of
+        # lines), to find the lines of a message without a scan.
+        # Entries for evicted lines are pruned lazily.
+        self._lines_by_id = {}  # type: Dict[str, Tuple[int, int]]
+        # After a rebuild, only the last messages are built (enough to
+        # fill the screen, plus a margin), older ones are built on demand
+        # when scrolling up. These are the messages of the TextBuffer we
+        # were rebuilt from, and the sequence number (see RingBuffer.base)
+        # of the oldest message with built lines.
+        self._built_messages = None  # type: Optional[RingBuffer]
+        self._built_from = 0
+        # When scrolling up past the first message of the room, pages of
+        # older messages are read from its history (see
+        # TextBuffer.history_page) and their lines put on top of the
+        # built lines. These are the room, the time the history goes
+        # back from, the number of the most recent page with built lines
+        # and the number of lines of each page, the oldest first. The
+        # pages are dropped again when scrolling back down.
+        self._history_room = None
+        self._history_before = None  # type: Optional[datetime]
+        self._history_first = 0
+        self._history_pages = []  # type: List[int]
+        # When scrolled far back in the history, the lines at the bottom
+        # are dropped to make room for older ones (see _cut_bottom), and
+        # built again when scrolling back down. This is the sequence
+        # number of the first message whose lines were dropped, None if
+        # they go down to the last message.
+        self._built_to = None  # type: Optional[int]
+        # The sequence numbers of the first line of each highlighted
+        # message, in order, and of the separator line, in the built
+        # lines. They are updated when lines are indexed, see _index_lines.
+        # Evicted highlights are dropped lazily.
+        self.highlights = []  # type: List[int]
+        self.separator_seq = None  # type: Optional[int]
 
         self.lock = False
         self.lock_buffer = []  # type: List[Union[None, Line]]
@@ -57,13 +406,119 @@ class BaseTextWin(Win):
         self.lock = True
 
     def release_lock(self) -> None:
-        for line in self.lock_buffer:
-            self.built_lines.append(line)
+        self._add_lines(self.lock_buffer)
+        self.lock_buffer = []
         self.lock = False
 
+    def memory_usage(self) -> int:
+        """
+        Return an estimate, in bytes, of the memory used by the built
+        lines of the window (not counting the messages themselves, which
+        belong to the text buffer)
+        """
+        return self.built_lines.memory_usage() + sum(
+            sys.getsizeof(line) for line in self.lock_buffer)
+
+    def _add_lines(self, lines: List[Union[None, Line]]) -> bool:
+        """
+        Append built lines to the buffer and index them by message id.
+        Return False if they were not added because the lines of the
+        messages before them were dropped (see _cut_bottom), they are
+        built with those when scrolling back down.
+        """
+        if self._bottom_is_cut():
+            return False
+        free = self.built_lines.maxlen - len(self.built_lines)
+        if len(lines) > free:
+            # drop whole messages from the top, they are built again when
+            # scrolling up
+            self._drop_top(len(lines) - free, force=True)
+        self.built_lines.extend(lines)
+        self._index_lines(max(len(self.built_lines) - len(lines), 0))
+        if self.highlights and self.highlights[0] < self.built_lines.base:
+            del self.highlights[:bisect_left(self.highlights,
+                                             self.built_lines.base)]
+        if len(self._lines_by_id) > 2 * self.lines_nb_limit:
+            base = self.built_lines.base
+            self._lines_by_id = {
+                ident: (seq, nb)
+                for ident, (seq, nb) in self._lines_by_id.items()
+                if seq + nb > base
+            }
+        return True
+
+    def _index_lines(self, start: int, end: Optional[int] = None) -> None:
+        """
+        (Re)index the built lines by message id, from the index *start*
+        to *end* (or the end of the buffer), and update the positions of
+        the highlights and of the separator in that range.
+        """
+        base = self.built_lines.base
+        if end is None:
+            end = len(self.built_lines)
+        if (self.separator_seq is not None
+                and base + start <= self.separator_seq < base + end):
+            self.separator_seq = None
+        index = self._lines_by_id
+        highlights = []  # type: List[int]
+        msg = None
+        for i, line in enumerate(self.built_lines[start:end], start):
+            if line is None:
+                msg = None
+                self.separator_seq = base + i
+                continue
+            if line.msg.highlight and line.start_pos == 0:
+                highlights.append(base + i)
+            if line.msg is msg:
+                seq, nb = index[msg.identifier]
+                index[msg.identifier] = (seq, nb + 1)
+            else:
+                msg = line.msg
+                if msg.identifier:
+                    index[msg.identifier] = (base + i, 1)
+                else:
+                    msg = None
+        self.highlights[bisect_left(self.highlights, base + start):
+                        bisect_left(self.highlights, base + end)] = highlights
+
+    def _separator_index(self) -> Optional[int]:
+        """
+        Return the index of the separator in the built lines, or None
+        """
+        if self.separator_seq is None:
+            return None
+        index = self.separator_seq - self.built_lines.base
+        if index < 0:
+            self.separator_seq = None
+            return None
+        return index
+
+    def _find_lines(self, identifier: str) -> Optional[Tuple[int, int]]:
+        """
+        Return the (start, end) indexes of the lines of the message with
+        the given id, or None if it is not in the built lines.
+        """
+        if identifier not in self._lines_by_id:
+            return None
+        seq, nb = self._lines_by_id[identifier]
+        start = seq - self.built_lines.base
+        end = start + nb
+        if end <= 0 or end > len(self.built_lines):
+            del self._lines_by_id[identifier]
+            return None
+        last = self.built_lines[end - 1]
+        if last is None or last.msg.identifier != identifier:
+            log.debug('Stale line index for message %s', identifier)
+            del self._lines_by_id[identifier]
+            return None
+        return max(start, 0), end
+
     def scroll_up(self, dist: int = 14) -> bool:
         pos = self.pos
         self.pos += dist
+        missing = self.pos + self.height - len(self.built_lines)
+        if missing > 0:
+            self.build_older_lines(missing + self.height)
         if self.pos + self.height > len(self.built_lines):
             self.pos = len(self.built_lines) - self.height
             if self.pos < 0:
@@ -73,15 +528,16 @@ class BaseTextWin(Win):
     def scroll_down(self, dist: int = 14) -> bool:
         pos = self.pos
         self.pos -= dist
+        self.fill_bottom()
         if self.pos <= 0:
             self.pos = 0
+        self._drop_history_above()
         return self.pos != pos
 
     # TODO: figure out the type of history.
     def build_new_message(self,
                           message: Message,
                           history=None,
-                          clean: bool = True,
                           highlight: bool = False,
                           timestamp: bool = False,
                           nick_size: int = 10) -> int:
@@ -95,21 +551,51 @@ class BaseTextWin(Win):
             message, timestamp=timestamp, nick_size=nick_size)
         if self.lock:
             self.lock_buffer.extend(lines)
-        else:
-            self.built_lines.extend(lines)
+        elif not self._add_lines(lines):
+            return 0
         if not lines or not lines[0]:
             return 0
-        if clean:
-            while len(self.built_lines) > self.lines_nb_limit:
-                self.built_lines.pop(0)
         return len(lines)
 
-    def build_message(self, message: Message, timestamp: bool = False, nick_size: int = 10) -> List[Union[None, Line]]:
+    def build_message(self, message: Optional[Message], timestamp: bool = False, nick_size: int = 10) -> List[Union[None, Line]]:
         """
         Build a list of lines from a message, without adding it
         to a list
         """
-        return []
+        return self.build_messages([message], timestamp, nick_size)[0]
+
+    def build_messages(self, messages: Sequence[Optional[Message]], timestamp: bool = False, nick_size: int = 10) -> List[List[Union[None, Line]]]:
+        """
+        Build the lists of lines of several messages (see build_message),
+        wrapping all their texts at once.
+        """
+        widths = [
+            self.text_width(message, timestamp, nick_size)
+            for message in messages
+        ]
+        ret = []  # type: List[List[Union[None, Line]]]
+        for message, cuts in zip(messages, cut_messages(messages, widths)):
+            if cuts is None:
+                ret.append([None] if message is None else [])
+            else:
+                triples = iter(cuts)
+                ret.append([
+                    Line(
+                        msg=message,
+                        start_pos=start,
+                        end_pos=end,
+                        segment=segment)
+                    for start, end, segment in zip(triples, triples, triples)
+                ])
+        return ret
+
+    def text_width(self, message: Optional[Message], timestamp: bool,
+                   nick_size: int) -> Optional[int]:
+        """
+        Return the width the text of a message is wrapped to, or None
+        if no line is built from it (None being the line separator).
+        """
+        return None
 
     def refresh(self) -> None:
         pass
@@ -120,6 +606,27 @@ class BaseTextWin(Win):
         """
         self.addstr_colored(txt, y, x)
 
+    def write_line(self, y: int, x: int, line: Line,
+                   default_color: Optional[Tuple] = None) -> None:
+        """
+        Write the text of a built line, from the segments of its message
+        (the formatting chars are already parsed). default_color is used
+        for the segments that have no color.
+        """
+        self.move(y, x)
+        msg = line.msg
+        txt = msg.txt
+        start, end = line.start_pos, line.end_pos
+        segments = get_segments(msg)
+        for i in range(line.segment, len(segments)):
+            seg_start, seg_end, attrs = segments[i]
+            if seg_start >= end:
+                break
+            if default_color is not None and attrs[0] is None:
+                attrs = (default_color, attrs[1])
+            self.addstr(txt[max(seg_start, start):min(seg_end, end)],
+                        segment_attrs_to_curses(attrs))
+
     def write_time(self, time: str) -> int:
         """
         Write the date on the yth line of the window
@@ -154,19 +661,299 @@ class BaseTextWin(Win):
 
     # TODO: figure out the type of room.
     def rebuild_everything(self, room) -> None:
-        self.built_lines = []
+        """
+        Rebuild the lines of the last messages of the room, enough to
+        fill the screen (and the next one); older lines are built when
+        scrolling up, see build_older_lines.
+        """
+        self.built_lines.clear()
+        self._lines_by_id = {}
+        self.highlights = []
+        self.separator_seq = None
+        self._history_room = room
+        self._history_before = None
+        self._history_first = 0
+        self._history_pages = []
+        self._built_to = None
+        # the lock buffer only contains messages of the room, which
+        # are rebuilt anyway
+        self.lock_buffer = []
+        self._built_messages = room.messages
+        self._built_from = room.messages.base + len(room.messages)
+        self.build_older_lines(self.pos + 2 * self.height)
+
+    def build_older_lines(self, nb_lines: int, history: bool = True) -> int:
+        """
+        Build the lines of the messages preceding the oldest built one,
+        until at least nb_lines are added or there is nothing left to
+        build, reading them from the history of the room once all its
+        messages are built (unless history is False). Return the number
+        of added lines.
+        """
+        messages = self._built_messages
+        if messages is None:
+            return 0
+        if self._history_pages:
+            return self._build_history(nb_lines) if history else 0
+        index = self._built_from - messages.base
+        free = self.built_lines.maxlen - len(self.built_lines)
+        if index > 0 and free < nb_lines:
+            free += self._cut_bottom(nb_lines - free)
         with_timestamps = config.get('show_timestamps')
         nick_size = config.get('max_nick_length')
-        for message in room.messages:
-            self.build_new_message(
-                message,
-                clean=False,
-                timestamp=with_timestamps,
-                nick_size=nick_size)
-            if self.separator_after is message:
-                self.build_new_message(None)
-        while len(self.built_lines) > self.lines_nb_limit:
-            self.built_lines.pop(0)
+        chunks = []  # type: List[List[Union[None, Line]]]
+        nb = 0
+        while index > 0 and nb < nb_lines and nb < free:
+            # Each message gives at least one line (most of the time),
+            # so build as many messages as there are missing lines at
+            # once, then check again.
+            first = max(index - min(nb_lines, free) + nb, 0)
+            batch = [messages[i] for i in range(first, index)]
+            built = self.build_messages(
+                batch, timestamp=with_timestamps, nick_size=nick_size)
+            for message, lines in zip(reversed(batch), reversed(built)):
+                if nb >= nb_lines or nb >= free:
+                    break
+                index -= 1
+                if self.separator_after is message:
+                    lines.append(None)
+                chunks.append(lines)
+                nb += len(lines)
+        self._built_from = messages.base + max(index, 0)
+        added = 0
+        if chunks:
+            lines = [line for chunk in reversed(chunks) for line in chunk]
+            added = self.built_lines.extendleft(lines)
+            self._index_lines(0, added)
+        if index > 0 or added >= nb_lines or not history:
+            return added
+        return added + self._build_history(nb_lines - added)
+
+    def _build_history(self, nb_lines: int) -> int:
+        """
+        Put the lines of the next pages of the history of the room on top
+        of the built lines, until at least nb_lines are added or there is
+        no page left. Return the number of added lines.
+        """
+        room = self._history_room
+        if room is None or self.lock:
+            return 0
+        with_timestamps = config.get('show_timestamps')
+        nick_size = config.get('max_nick_length')
+        added = 0
+        while added < nb_lines:
+            if not self._history_pages:
+                self._history_first = 0
+                self._history_before = self._first_built_time()
+            number = self._history_first + len(self._history_pages)
+            messages = room.history_page(number, self._history_before)
+            if not messages:
+                break
+            lines = [
+                line
+                for built in self.build_messages(
+                    messages, timestamp=with_timestamps, nick_size=nick_size)
+                for line in built
+            ]
+            missing = len(lines) - (
+                self.built_lines.maxlen - len(self.built_lines))
+            if missing > 0 and self._cut_bottom(missing) < missing:
+                break
+            self.built_lines.extendleft(lines)
+            self._index_lines(0, len(lines))
+            self._history_pages.insert(0, len(lines))
+            added += len(lines)
+        return added
+
+    def _first_built_time(self) -> Optional[datetime]:
+        for line in self.built_lines:
+            if line is not None:
+                return line.msg.time
+        return None
+
+    def _bottom_is_cut(self) -> bool:
+        return self._built_to is not None or self._history_first > 0
+
+    def _cut_bottom(self, nb: int) -> int:
+        """
+        Drop at least nb lines from the bottom, whole messages (and then
+        whole pages of history) at a time, to make room for older lines.
+        Only the lines at least a screen below the visible ones are
+        dropped, so fewer lines may be. Return the number of dropped lines.
+        """
+        messages = self._built_messages
+        if messages is None:
+            return 0
+        lines = self.built_lines
+        size = len(lines)
+        limit = self.pos - self.height
+        # the first line of the messages of the room, below the history
+        history = sum(self._history_pages)
+        cut = size
+        nb_messages = 0
+        for i in range(size - 1, history - 1, -1):
+            if size - cut >= nb:
+                break
+            line = lines[i]
+            if line is None:
+                continue
+            if i > history:
+                previous = lines[i - 1]
+                if previous is not None and previous.msg is line.msg:
+                    continue
+            # the first line of a message (its separator stays with it)
+            if size - i > limit:
+                break
+            cut = i
+            nb_messages += 1
+        pages = 0
+        if cut == history:
+            while size - cut < nb and pages < len(self._history_pages):
+                page_start = cut - self._history_pages[-pages - 1]
+                if size - page_start > limit:
+                    break
+                cut = page_start
+                pages += 1
+        if cut == size:
+            return 0
+        if nb_messages:
+            if self._built_to is None:
+                self._built_to = messages.base + len(messages)
+            self._built_to -= nb_messages
+        if pages:
+            del self._history_pages[-pages:]
+            self._history_first += pages
+        lines.splice(cut, size, ())
+        self.pos -= size - cut
+        end = lines.base + cut
+        del self.highlights[bisect_left(self.highlights, end):]
+        if self.separator_seq is not None and self.separator_seq >= end:
+            self.separator_seq = None
+        return size - cut
+
+    def fill_bottom(self) -> None:
+        """
+        Build the lines dropped from the bottom again if they are (almost)
+        on the screen, see _cut_bottom.
+        """
+        if self.pos < self.height and self._bottom_is_cut():
+            self.build_newer_lines(2 * self.height - self.pos)
+
+    def build_newer_lines(self, nb_lines: int) -> int:
+        """
+        Build the lines dropped from the bottom by _cut_bottom again,
+        until at least nb_lines are added, making room by dropping the
+        oldest lines that are far enough above the screen. The visible
+        lines do not move. Return the number of added lines.
+        """
+        with_timestamps = config.get('show_timestamps')
+        nick_size = config.get('max_nick_length')
+        added = 0
+        while added < nb_lines and self._bottom_is_cut():
+            room = self._history_room
+            messages = self._built_messages
+            if self._history_first > 0:
+                page = room.history_page(self._history_first - 1,
+                                         self._history_before)
+                batch = page or []
+            elif (messages is not None
+                  and messages.base <= self._built_to
+                  < messages.base + len(messages)):
+                index = self._built_to - messages.base
+                batch = [
+                    messages[i] for i in range(
+                        index,
+                        min(index + max(nb_lines - added, 1),
+                            len(messages)))
+                ]
+            else:
+                batch = []
+            lines = []  # type: List[Union[None, Line]]
+            for message, built in zip(
+                    batch,
+                    self.build_messages(
+                        batch, timestamp=with_timestamps,
+                        nick_size=nick_size)):
+                lines.extend(built)
+                if self.separator_after is message:
+                    lines.append(None)
+            missing = len(lines) - (
+                self.built_lines.maxlen - len(self.built_lines))
+            if not lines or missing > 0 and not self._drop_top(missing):
+                # the history changed, or the messages were evicted from
+                # the room: go back to its last messages
+                log.debug('Unable to build the lines back, rebuilding')
+                self.pos = 0
+                self.rebuild_everything(room)
+                return added
+            self.built_lines.extend(lines)
+            self._index_lines(len(self.built_lines) - len(lines))
+            self.pos += len(lines)
+            added += len(lines)
+            if self._history_first > 0:
+                self._history_first -= 1
+                self._history_pages.append(len(lines))
+            else:
+                self._built_to += len(batch)
+                if self._built_to >= messages.base + len(messages):
+                    self._built_to = None
+        return added
+
+    def _drop_top(self, nb: int, force: bool = False) -> bool:
+        """
+        Drop at least nb lines from the top, whole pages of history (and
+        then whole messages) at a time, if they are far enough above the
+        screen (or anyway if force is True). Return False if there are not
+        enough of them.
+        """
+        lines = self.built_lines
+        allowed = len(lines) - self.pos - 2 * self.height
+        cut = 0
+        pages = 0
+        while cut < nb and pages < len(self._history_pages):
+            cut += self._history_pages[pages]
+            pages += 1
+        nb_messages = 0
+        if cut < nb:
+            current = None
+            for i in range(cut, len(lines)):
+                line = lines[i]
+                if line is None or line.msg is current:
+                    continue
+                if i >= nb:
+                    cut = i
+                    break
+                nb_messages += 1
+                current = line.msg
+            else:
+                cut = len(lines)
+        if not force and (cut < nb or cut > allowed):
+            return False
+        del self._history_pages[:pages]
+        self._built_from += nb_messages
+        self._drop_first_lines(cut)
+        return True
+
+    def _drop_history_above(self) -> None:
+        """
+        Drop the pages of history that are far enough above the screen
+        """
+        allowed = len(self.built_lines) - self.pos - 2 * self.height
+        cut = 0
+        pages = 0
+        for nb in self._history_pages:
+            if cut + nb > allowed:
+                break
+            cut += nb
+            pages += 1
+        if pages:
+            del self._history_pages[:pages]
+            self._drop_first_lines(cut)
+
+    def _drop_first_lines(self, nb: int) -> None:
+        self.built_lines.drop_first(nb)
+        del self.highlights[:bisect_left(self.highlights,
+                                         self.built_lines.base)]
 
     def __del__(self) -> None:
         log.debug('** TextWin: deleting %s built lines',
@@ -178,20 +965,29 @@ class TextWin(BaseTextWin):
     def __init__(self, lines_nb_limit: Optional[int] = None) -> None:
         BaseTextWin.__init__(self, lines_nb_limit)
 
-        # the Lines of the highlights in that buffer
-        self.highlights = []  # type: List[Line]
-        # the current HL position in that list NaN means that we’re not on
-        # an hl. -1 is a valid position (it's before the first hl of the
-        # list. i.e the separator, in the case where there’s no hl before
-        # it.)
-        self.hl_pos = float('nan')
-
-        # Keep track of the number of hl after the separator.
-        # This is useful to make “go to next highlight“ work after a “move to separator”.
-        self.nb_of_highlights_after_separator = 0
+        # The sequence number of the first line of the highlight we are
+        # on (see BaseTextWin.highlights), None if we are not on one.
+        # After a “move to separator”, this is the sequence number of the
+        # separator, so that “go to next highlight” goes to the first
+        # highlight after it.
+        self.hl_seq = None  # type: Optional[int]
 
         self.separator_after = None
 
+    def rebuild_everything(self, room) -> None:
+        self.hl_seq = None
+        BaseTextWin.rebuild_everything(self, room)
+
+    def _scroll_to_line(self, seq: int) -> None:
+        """
+        Scroll so that the line with the given sequence number is at the
+        top of the window.
+        """
+        self.pos = len(self.built_lines) - (
+            seq - self.built_lines.base) - self.height
+        if self.pos < 0 or self.pos >= len(self.built_lines):
+            self.pos = 0
+
     def next_highlight(self) -> None:
         """
         Go to the next highlight in the buffer.
@@ -200,33 +996,20 @@ class TextWin(BaseTextWin):
         highlights, scroll to the end of the buffer.
         """
         log.debug('Going to the next highlight…')
-        if (not self.highlights or self.hl_pos != self.hl_pos
-                or self.hl_pos >= len(self.highlights) - 1):
-            self.hl_pos = float('nan')
-            self.pos = 0
-            return
-        hl_size = len(self.highlights) - 1
-        if self.hl_pos < hl_size:
-            self.hl_pos += 1
+        highlights = self.highlights
+        if self.hl_seq is None:
+            i = len(highlights)
         else:
-            self.hl_pos = hl_size
-        log.debug("self.hl_pos = %s", self.hl_pos)
-        hl = self.highlights[self.hl_pos]
-        pos = None
-        while not pos:
-            try:
-                pos = self.built_lines.index(hl)
-            except ValueError:
-                self.highlights = self.highlights[self.hl_pos + 1:]
-                if not self.highlights:
-                    self.hl_pos = float('nan')
-                    self.pos = 0
-                    return
-                self.hl_pos = 0
-                hl = self.highlights[0]
-        self.pos = len(self.built_lines) - pos - self.height
-        if self.pos < 0 or self.pos >= len(self.built_lines):
+            i = max(
+                bisect_right(highlights, self.hl_seq),
+                bisect_left(highlights, self.built_lines.base))
+        if i >= len(highlights):
+            self.hl_seq = None
             self.pos = 0
+            return
+        self.hl_seq = highlights[i]
+        log.debug("self.hl_seq = %s", self.hl_seq)
+        self._scroll_to_line(self.hl_seq)
 
     def previous_highlight(self) -> None:
         """
@@ -236,40 +1019,36 @@ class TextWin(BaseTextWin):
         highlights, scroll to the end of the buffer.
         """
         log.debug('Going to the previous highlight…')
-        if not self.highlights or self.hl_pos <= 0:
-            self.hl_pos = float('nan')
-            self.pos = 0
-            return
-        if self.hl_pos != self.hl_pos:
-            self.hl_pos = len(self.highlights) - 1
-        else:
-            self.hl_pos -= 1
-        log.debug("self.hl_pos = %s", self.hl_pos)
-        hl = self.highlights[self.hl_pos]
-        pos = None
-        while not pos:
-            try:
-                pos = self.built_lines.index(hl)
-            except ValueError:
-                self.highlights = self.highlights[self.hl_pos + 1:]
-                if not self.highlights:
-                    self.hl_pos = float('nan')
-                    self.pos = 0
-                    return
-                self.hl_pos = 0
-                hl = self.highlights[0]
-        self.pos = len(self.built_lines) - pos - self.height
-        if self.pos < 0 or self.pos >= len(self.built_lines):
-            self.pos = 0
+        highlights = self.highlights
+        while True:
+            if self.hl_seq is None:
+                i = len(highlights) - 1
+            else:
+                i = bisect_left(highlights, self.hl_seq) - 1
+            if i >= bisect_left(highlights, self.built_lines.base):
+                break
+            # the previous highlight may be in the lines not built yet,
+            # only the messages in memory are searched, not the logs
+            if not self.build_older_lines(self.height, history=False):
+                self.hl_seq = None
+                self.pos = 0
+                return
+        self.hl_seq = highlights[i]
+        log.debug("self.hl_seq = %s", self.hl_seq)
+        self._scroll_to_line(self.hl_seq)
 
     def scroll_to_separator(self) -> None:
         """
         Scroll until separator is centered. If no separator is
         present, scroll at the top of the window
         """
-        if None in self.built_lines:
-            self.pos = len(self.built_lines) - self.built_lines.index(
-                None) - self.height + 1
+        if self.separator_after is not None:
+            while self._separator_index() is None:
+                if not self.build_older_lines(self.height, history=False):
+                    break
+        index = self._separator_index()
+        if index is not None:
+            self.pos = len(self.built_lines) - index - self.height + 1
             if self.pos < 0:
                 self.pos = 0
         else:
@@ -279,18 +1058,22 @@ class TextWin(BaseTextWin):
         # Make “next highlight” work afterwards. This makes it easy to
         # review all the highlights since the separator was placed, in
         # the correct order.
-        self.hl_pos = len(
-            self.highlights) - self.nb_of_highlights_after_separator - 1
-        log.debug("self.hl_pos = %s", self.hl_pos)
+        if self.separator_seq is not None:
+            self.hl_seq = self.separator_seq
+        else:
+            self.hl_seq = self.built_lines.base - 1
+        log.debug("self.hl_seq = %s", self.hl_seq)
 
     def remove_line_separator(self) -> None:
         """
         Remove the line separator
         """
         log.debug('remove_line_separator')
-        if None in self.built_lines:
-            self.built_lines.remove(None)
-            self.separator_after = None
+        index = self._separator_index()
+        if index is not None:
+            self.built_lines.splice(index, index + 1, ())
+            self._index_lines(index)
+        self.separator_after = None
 
     # TODO: figure out the type of room.
     def add_line_separator(self, room=None) -> None:
@@ -299,10 +1082,8 @@ class TextWin(BaseTextWin):
         room is a textbuffer that is needed to get the previous message
         (in case of resize)
         """
-        if None not in self.built_lines:
-            self.built_lines.append(None)
-            self.nb_of_highlights_after_separator = 0
-            log.debug("Resetting number of highlights after separator")
+        if self._separator_index() is None:
+            self._add_lines([None])
             if room and room.messages:
                 self.separator_after = room.messages[-1]
 
@@ -310,7 +1091,6 @@ class TextWin(BaseTextWin):
     def build_new_message(self,
                           message: Message,
                           history=None,
-                          clean: bool = True,
                           highlight: bool = False,
                           timestamp: bool = False,
                           nick_size: int = 10) -> int:
@@ -323,36 +1103,16 @@ class TextWin(BaseTextWin):
             message, timestamp=timestamp, nick_size=nick_size)
         if self.lock:
             self.lock_buffer.extend(lines)
-        else:
-            self.built_lines.extend(lines)
+        elif not self._add_lines(lines):
+            return 0
         if not lines or not lines[0]:
             return 0
-        if highlight:
-            self.highlights.append(lines[0])
-            self.nb_of_highlights_after_separator += 1
-            log.debug("Number of highlights after separator is now %s",
-                      self.nb_of_highlights_after_separator)
-        if clean:
-            while len(self.built_lines) > self.lines_nb_limit:
-                self.built_lines.pop(0)
         return len(lines)
 
-    def build_message(self, message: Optional[Message], timestamp: bool = False, nick_size: int = 10) -> List[Union[None, Line]]:
-        """
-        Build a list of lines from a message, without adding it
-        to a list
-        """
-        if message is None:  # line separator
-            return [None]
-        txt = message.txt
-        if not txt:
-            return []
-        if len(message.str_time) > 8:
-            default_color = (
-                FORMAT_CHAR + dump_tuple(get_theme().COLOR_LOG_MSG) + '}')  # type: Optional[str]
-        else:
-            default_color = None
-        ret = []  # type: List[Union[None, Line]]
+    def text_width(self, message: Optional[Message], timestamp: bool,
+                   nick_size: int) -> Optional[int]:
+        if message is None or not message.txt:
+            return None
         nick = truncate_nick(message.nickname, nick_size)
         offset = 0
         if message.ack:
@@ -373,36 +1133,20 @@ class TextWin(BaseTextWin):
                 offset += 1
             if get_theme().CHAR_TIME_RIGHT and message.str_time:
                 offset += 1
-        lines = poopt.cut_text(txt, self.width - offset - 1)
-        prepend = default_color if default_color else ''
-        attrs = []  # type: List[str]
-        for line in lines:
-            saved = Line(
-                msg=message,
-                start_pos=line[0],
-                end_pos=line[1],
-                prepend=prepend)
-            attrs = parse_attrs(message.txt[line[0]:line[1]], attrs)
-            if attrs:
-                prepend = FORMAT_CHAR + FORMAT_CHAR.join(attrs)
-            else:
-                if default_color:
-                    prepend = default_color
-                else:
-                    prepend = ''
-            ret.append(saved)
-        return ret
+        return self.width - offset - 1
 
     def refresh(self) -> None:
         log.debug('Refresh: %s', self.__class__.__name__)
         if self.height <= 0:
             return
+        self.fill_bottom()
         if self.pos == 0:
             lines = self.built_lines[-self.height:]
         else:
             lines = self.built_lines[-self.height - self.pos:-self.pos]
         with_timestamps = config.get("show_timestamps")
         nick_size = config.get("max_nick_length")
+        log_color = get_theme().COLOR_LOG_MSG
         self._win.move(0, 0)
         self._win.erase()
         offset = 0
@@ -415,9 +1159,10 @@ class TextWin(BaseTextWin):
                 elif y == 0:
                     offset = self.compute_offset(msg, with_timestamps,
                                                  nick_size)
-                self.write_text(
-                    y, offset,
-                    line.prepend + line.msg.txt[line.start_pos:line.end_pos])
+                # history messages are displayed with the log color
+                self.write_line(
+                    y, offset, line,
+                    log_color if len(msg.str_time) > 8 else None)
             else:
                 self.write_line_separator(y)
             if y != self.height - 1:
@@ -540,21 +1285,23 @@ class TextWin(BaseTextWin):
         Find a message, and replace it with a new one
         (instead of rebuilding everything in order to correct a message)
         """
+        found = self._find_lines(old_id)
+        if found is None:
+            return
+        start, end = found
         with_timestamps = config.get('show_timestamps')
         nick_size = config.get('max_nick_length')
-        for i in range(len(self.built_lines) - 1, -1, -1):
-            if self.built_lines[i] and self.built_lines[i].msg.identifier == old_id:
-                index = i
-                while index >= 0 and self.built_lines[index] and self.built_lines[index].msg.identifier == old_id:
-                    self.built_lines.pop(index)
-                    index -= 1
-                index += 1
-                lines = self.build_message(
-                    message, timestamp=with_timestamps, nick_size=nick_size)
-                for line in lines:
-                    self.built_lines.insert(index, line)
-                    index += 1
-                break
+        lines = self.build_message(
+            message, timestamp=with_timestamps, nick_size=nick_size)
+        del self._lines_by_id[old_id]
+        base = self.built_lines.base
+        self.built_lines.splice(start, end, lines)
+        if len(lines) == end - start:
+            self._index_lines(start, end)
+        else:
+            # the following lines moved (and the first ones may have been
+            # evicted if the message grew), update their positions too
+            self._index_lines(max(start - self.built_lines.base + base, 0))
 
     def __del__(self) -> None:
         log.debug('** TextWin: deleting %s built lines',
@@ -603,18 +1350,16 @@ class XMLTextWin(BaseTextWin):
             # space
             offset += 1
 
-            self.write_text(
-                y, offset,
-                line.prepend + line.msg.txt[line.start_pos:line.end_pos])
+            self.write_line(y, offset, line)
             if y != self.height - 1:
                 self.addstr('\n')
         self._win.attrset(0)
         self._refresh()
 
-    def build_message(self, message: Message, timestamp: bool = False, nick_size: int = 10) -> List[Line]:
-        txt = message.txt
-        ret = []
-        default_color = None
+    def text_width(self, message: Optional[Message], timestamp: bool,
+                   nick_size: int) -> Optional[int]:
+        if message is None:
+            return None
         nick = truncate_nick(message.nickname, nick_size)
         offset = 0
         if nick:
@@ -625,25 +1370,7 @@ class XMLTextWin(BaseTextWin):
             offset += 1
         if get_theme().CHAR_TIME_RIGHT and message.str_time:
             offset += 1
-        lines = poopt.cut_text(txt, self.width - offset - 1)
-        prepend = default_color if default_color else ''
-        attrs = []  # type: List[str]
-        for line in lines:
-            saved = Line(
-                msg=message,
-                start_pos=line[0],
-                end_pos=line[1],
-                prepend=prepend)
-            attrs = parse_attrs(message.txt[line[0]:line[1]], attrs)
-            if attrs:
-                prepend = FORMAT_CHAR + FORMAT_CHAR.join(attrs)
-            else:
-                if default_color:
-                    prepend = default_color
-                else:
-                    prepend = ''
-            ret.append(saved)
-        return ret
+        return self.width - offset - 1
 
     def write_prefix(self, nickname, color) -> None:
         self._win.attron(to_curses_attr(color))
@@ -25,6 +25,7 @@ from typing import List, Dict, Optional, Union, Tuple
 
 from slixmpp.xmlstream import ET
 from poezio.config import config
+from poezio import poopt
 from poezio.colors import ncurses_color_to_rgb
 
 digits = '0123456789'  # never trust the modules
@@ -458,8 +459,7 @@ def clean_text(s: str) -> str:
     Remove all xhtml-im attributes (\x19etc) from the string with the
     complete color format, i.e \x19xxx}
     """
-    s = re.sub(xhtml_attr_re, "", s)
-    return s
+    return poopt.clean_text(s)
 
 
 def clean_text_simple(string: str) -> str:
@@ -467,11 +467,7 @@ def clean_text_simple(string: str) -> str:
     Remove all \x19 from the string formatted with simple colors:
     \x198
     """
-    pos = string.find('\x19')
-    while pos != -1:
-        string = string[:pos] + string[pos + 2:]
-        pos = string.find('\x19')
-    return string
+    return poopt.clean_text_simple(string)
 
 
 def convert_simple_to_full_colors(text: str) -> str:
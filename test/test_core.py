@@ -0,0 +1,108 @@
+"""
+Test the refresh scheduler of the Core
+"""
+from types import SimpleNamespace
+
+from poezio.core import core as core_module
+from poezio.core.core import Core
+
+
+class LoopShim:
+    """An event loop running the idle callbacks and the timers by hand"""
+
+    def __init__(self):
+        self.now = 100.0
+        self.idle = []
+        self.timers = []
+
+    def time(self):
+        return self.now
+
+    def idle_call(self, callback):
+        self.idle.append(callback)
+
+    def call_later(self, delay, callback, *args):
+        self.timers.append((self.now + delay, callback, args))
+
+    def run_idle(self):
+        idle, self.idle = self.idle, []
+        for callback in idle:
+            callback()
+
+    def advance(self, delay):
+        self.now += delay
+        timers, self.timers = self.timers, []
+        for when, callback, args in timers:
+            if when <= self.now:
+                callback(*args)
+            else:
+                self.timers.append((when, callback, args))
+
+
+class ConfigShim:
+    def __init__(self, **options):
+        self.options = options
+
+    def get(self, option, default=''):
+        return self.options.get(option, default)
+
+
+def make_core(monkeypatch, max_fps):
+    loop = LoopShim()
+    monkeypatch.setattr(core_module, 'asyncio',
+                        SimpleNamespace(get_event_loop=lambda: loop))
+    monkeypatch.setattr(core_module, 'config', ConfigShim(max_fps=max_fps))
+    core = Core.__new__(Core)
+    core.running = True
+    core._refresh_scheduled = False
+    core._refresh_window_needed = False
+    core._refresh_tab_win_needed = False
+    core._last_refresh = 0.0
+    core.refreshes = []
+    core.refresh_window = lambda: core.refreshes.append('window')
+    core.refresh_tab_win = lambda: core.refreshes.append('tab_win')
+    return core, loop
+
+
+def test_schedule_refresh_coalesces(monkeypatch):
+    core, loop = make_core(monkeypatch, max_fps=0)
+    # a burst of stanzas handled in the same loop iteration
+    for _ in range(500):
+        core.schedule_refresh()
+        core.schedule_refresh(tab_win_only=True)
+    assert len(loop.idle) == 1
+    assert core.refreshes == []
+    loop.run_idle()
+    # the window refresh includes the tab list
+    assert core.refreshes == ['window']
+
+    core.schedule_refresh(tab_win_only=True)
+    core.schedule_refresh(tab_win_only=True)
+    loop.run_idle()
+    assert core.refreshes == ['window', 'tab_win']
+
+
+def test_schedule_refresh_max_fps(monkeypatch):
+    core, loop = make_core(monkeypatch, max_fps=10)
+    core.schedule_refresh()
+    loop.run_idle()
+    assert core.refreshes == ['window']
+
+    # the next refresh waits for the end of the frame
+    loop.advance(0.02)
+    core.schedule_refresh()
+    core.schedule_refresh()
+    assert loop.idle == [] and len(loop.timers) == 1
+    loop.advance(0.05)
+    loop.run_idle()
+    assert core.refreshes == ['window']
+    loop.advance(0.04)
+    loop.run_idle()
+    assert core.refreshes == ['window', 'window']
+
+    # and a refresh requested after a whole frame is done right away
+    loop.advance(0.5)
+    core.schedule_refresh()
+    assert loop.timers == []
+    loop.run_idle()
+    assert core.refreshes == ['window'] * 3
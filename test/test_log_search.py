@@ -0,0 +1,70 @@
+"""
+Test the full-text search in the logs
+"""
+import datetime
+
+import pytest
+
+from poezio.log_search import LogSearch, match_expression, parse_query
+from poezio.common import get_utc_time
+from poezio.logger import build_log_message
+
+
+def test_parse_query():
+    terms, filters = parse_query(
+        ['room:a@example.com', 'hello', 'nick:toto', 'after:2017-03-01',
+         'http://example.com'])
+    assert terms == ['hello', 'http://example.com']
+    assert filters == {
+        'room': 'a@example.com',
+        'nick': 'toto',
+        'after': datetime.datetime(2017, 3, 1)
+    }
+    with pytest.raises(ValueError):
+        parse_query(['before:yesterday'])
+
+
+def test_match_expression():
+    assert match_expression(['foo', 'bar*', '"a b"', '*']) == \
+        '"foo" "bar"* """a b"""'
+
+
+def test_search(tmp_path):
+    search = LogSearch(tmp_path / '.search.db')
+    date = datetime.datetime(2017, 3, 1, 12, 0, 0)
+    utc = get_utc_time(date)
+    messages = [
+        ('a@example.com', 'toto', 'hello world'),
+        ('a@example.com', 'titi', 'hello there'),
+        ('b@example.com', 'toto', 'Hello, worldwide\nsecond line'),
+    ]
+    for i, (jid, nick, txt) in enumerate(messages):
+        search.add(jid, nick, utc + datetime.timedelta(minutes=i), txt)
+    assert search.commit().result()
+
+    def found(*terms, **filters):
+        results = search.search(terms, **filters).result()
+        return [(jid, nick, txt) for jid, nick, time, txt in results]
+
+    assert found('hello') == messages[::-1]
+    assert found('hello', 'world') == [messages[0]]
+    assert found('world*') == [messages[2], messages[0]]
+    assert found('hello', room='a@example.com', nick='toto') == [messages[0]]
+    assert found('hello', limit=1, offset=1) == [messages[1]]
+    assert found('"hello there"') == [messages[1]]
+    after = date + datetime.timedelta(minutes=1)
+    assert found('hello', after=after) == messages[:0:-1]
+    assert found('hello', before=after) == [messages[0]]
+    assert search.search(['there']).result()[0][2] == after
+    assert found('line') == [messages[2]]
+
+    (tmp_path / 'c@example.com').write_text(
+        build_log_message('toto', 'hello again', date) +
+        build_log_message('', 'toto joined', date, typ=2) +
+        build_log_message('titi', 'multi\nhello', date))
+    (tmp_path / 'roster.log').write_text(
+        build_log_message('', 'hello online', date, typ=2))
+    assert search.rebuild(tmp_path) == 2
+    assert found('hello') == [('c@example.com', 'titi', 'multi\nhello'),
+                              ('c@example.com', 'toto', 'hello again')]
+    search.close()
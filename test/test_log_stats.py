@@ -0,0 +1,82 @@
+"""
+Test the statistics of the logs
+"""
+import datetime
+import gzip
+
+from poezio import log_stats
+from poezio.log_stats import LogStats, StatsCache, format_stats
+from poezio.logger import build_log_message
+
+
+def test_log_stats(monkeypatch, tmp_path):
+    date = datetime.datetime(2017, 3, 1, 12, 0, 0)
+    log_file = tmp_path / 'a@example.com'
+    log_file.write_text(
+        build_log_message('toto', 'hello', date) +
+        build_log_message('', 'toto joined', date, typ=2) +
+        build_log_message('titi', 'multi\nline', date) +
+        build_log_message('toto', 'later', date + datetime.timedelta(hours=1)))
+    segments = tmp_path / '.segments' / 'a@example.com'
+    segments.mkdir(parents=True)
+    with gzip.open(str(segments / '2017-02.gz'), 'wt') as fd:
+        fd.write(build_log_message('tata', 'old', date.replace(month=2)))
+
+    stats = log_stats.log_stats([log_file])
+    assert len(stats) == 4
+    assert stats.nicks == {'toto': 2, 'titi': 1, 'tata': 1}
+    assert stats.per_day() == [('2017-02-01', 1), ('2017-03-01', 3)]
+    assert stats.per_hour()[12] == 3 and stats.per_hour()[13] == 1
+    assert stats.size == log_file.stat().st_size + len(
+        build_log_message('tata', 'old', date.replace(month=2)).encode())
+    assert format_stats(stats)[0].startswith('4 messages')
+    report = format_stats(stats)
+    days = report.index('Messages per day:')
+    assert report[days + 1:days + 3] == [
+        '  2017-02-01       1', '  2017-03-01       3']
+    report = format_stats(stats, last_days=1)
+    days = report.index('Messages per day (the last 1):')
+    assert report[days + 1:days + 3] == ['  2017-03-01       3',
+                                         'Busiest days:']
+    assert log_stats.stats_report(stats)['days'] == {
+        '2017-02-01': 1, '2017-03-01': 3}
+    assert format_stats(LogStats()) == ['No message in the logs (0 bytes)']
+
+    # the cached results are used while the files do not change
+    scanned = []
+    scan_file = log_stats.scan_file
+
+    def spy(path, stats, start=0):
+        scanned.append((path.name, start))
+        scan_file(path, stats, start)
+
+    monkeypatch.setattr(log_stats, 'scan_file', spy)
+    assert log_stats.log_stats([log_file]).to_json() == stats.to_json()
+    assert scanned == []
+
+    # and a log file which grew is only scanned from its previous end
+    size = log_file.stat().st_size
+    with log_file.open('a') as fd:
+        fd.write(build_log_message('titi', 'new', date))
+    stats = log_stats.log_stats([log_file])
+    assert scanned == [('a@example.com', size)]
+    assert stats.nicks['titi'] == 2 and len(stats) == 5
+
+    # a cache which can not be read is ignored
+    (tmp_path / log_stats.STATS_CACHE).write_text('{')
+    assert len(StatsCache(tmp_path).get(log_file)) == 4
+
+
+def test_scan_chunks(monkeypatch, tmp_path):
+    monkeypatch.setattr(log_stats, 'CHUNK_SIZE', 64)
+    date = datetime.datetime(2017, 3, 1, 12, 0, 0)
+    data = ''.join(build_log_message('toto', 'message %d' % i, date)
+                   for i in range(20))
+    (tmp_path / 'plain').write_text(data)
+    with gzip.open(str(tmp_path / 'compressed.gz'), 'wt') as fd:
+        fd.write(data)
+    for name in ('plain', 'compressed.gz'):
+        stats = LogStats()
+        log_stats.scan_file(tmp_path / name, stats)
+        assert stats.nicks == {'toto': 20}
+        assert stats.size == len(data.encode())
@@ -1,9 +1,15 @@
 """
 Test the functions in the `logger` module
 """
+import asyncio
+import calendar
 import datetime
+import os
+import re
+import pytest
 from poezio.logger import LogMessage, parse_log_line, parse_log_lines, build_log_message
 from poezio.common import get_utc_time, get_local_time
+from poezio.config import DEFAULT_CONFIG
 
 def test_parse_message():
     line = 'MR 20170909T09:09:09Z 000 <nick>  body'
@@ -31,3 +37,283 @@ def test_log_and_parse_messages():
         {'time': msg1['date'], 'history': True, 'txt': '\x195,-1}coucou', 'nickname': 'toto'},
         {'time': msg2['date'], 'history': True, 'txt': '\x195,-1}coucou\ncoucou', 'nickname': 'toto'},
     ]
+
+
+class LogConfigShim:
+    def __init__(self, values):
+        self.values = values
+
+    def get(self, option, default=None):
+        if option in self.values:
+            return self.values[option]
+        return DEFAULT_CONFIG['Poezio'][option]
+
+    def get_by_tabname(self, option, tabname, default=None):
+        return self.get(option)
+
+
+def test_buffered_writes(monkeypatch, tmp_path):
+    from poezio import logger
+    values = {'use_log': True, 'log_flush_interval': 60,
+              'log_flush_size': 200}
+    monkeypatch.setattr(logger, 'config', LogConfigShim(values))
+    monkeypatch.setattr(logger, 'log_dir', tmp_path)
+    log_file = tmp_path / 'room@example.com'
+    writer = logger.Logger()
+    try:
+        assert writer.log_message('room@example.com', 'toto', 'coucou')
+        assert writer.log_message('room@example.com', 'toto', 'toto')
+        # still buffered
+        assert log_file.read_text() == ''
+        assert writer.flush()
+        assert log_file.read_text().count('<toto>') == 2
+
+        # enough pending bytes trigger the write without waiting
+        writer.log_message('room@example.com', 'toto', 'x' * 200)
+        assert log_file.read_text().count('<toto>') == 3
+        # the size is counted in bytes, not in characters
+        writer.log_message('room@example.com', 'toto', 'é' * 90)
+        assert log_file.read_text().count('<toto>') == 4
+
+        values['log_flush_interval'] = 0
+        writer.log_message('room@example.com', 'toto', 'now')
+        assert log_file.read_text().count('<toto>') == 5
+    finally:
+        writer.close('room@example.com')
+
+
+def test_fd_pool(monkeypatch, tmp_path):
+    from poezio import logger
+    values = {'use_log': True, 'log_flush_interval': 60,
+              'log_max_open_files': 2}
+    monkeypatch.setattr(logger, 'config', LogConfigShim(values))
+    monkeypatch.setattr(logger, 'log_dir', tmp_path)
+    writer = logger.Logger()
+    try:
+        writer.log_message('a@example.com', 'toto', 'coucou')
+        writer.log_message('b@example.com', 'toto', 'coucou')
+        writer.log_message('a@example.com', 'toto', 'coucou')
+        assert list(writer._fds) == ['b@example.com', 'a@example.com']
+        assert (writer.fd_hits, writer.fd_misses) == (1, 2)
+
+        # the least recently used file is closed, with its pending records
+        writer.log_message('c@example.com', 'toto', 'coucou')
+        assert list(writer._fds) == ['a@example.com', 'c@example.com']
+        assert (tmp_path / 'b@example.com').read_text().count('<toto>') == 1
+        assert (tmp_path / 'a@example.com').read_text() == ''
+
+        # and reopened on demand
+        writer.log_message('b@example.com', 'toto', 'coucou')
+        assert list(writer._fds) == ['c@example.com', 'b@example.com']
+        assert (tmp_path / 'a@example.com').read_text().count('<toto>') == 2
+        assert (writer.fd_hits, writer.fd_misses) == (1, 4)
+
+        writer._fds_last_use['c@example.com'] -= 600
+        writer._close_idle()
+        assert list(writer._fds) == ['b@example.com']
+        assert writer.flush()
+        assert (tmp_path / 'b@example.com').read_text().count('<toto>') == 2
+    finally:
+        writer.reload_all()
+    assert not writer._fds
+
+
+def test_roster_changes_batch(monkeypatch, tmp_path):
+    from poezio import logger
+    values = {'use_log': True, 'log_flush_interval': 0}
+    shim = LogConfigShim(values)
+    asked = []
+
+    def get_by_tabname(option, tabname, default=None):
+        asked.append(tabname)
+        return shim.get(option)
+
+    shim.get_by_tabname = get_by_tabname
+    monkeypatch.setattr(logger, 'config', shim)
+    monkeypatch.setattr(logger, 'log_dir', tmp_path)
+    writer = logger.Logger()
+    loop = asyncio.new_event_loop()
+    monkeypatch.setattr(asyncio, 'get_event_loop', lambda: loop)
+    try:
+        for i in range(100):
+            jid = 'contact%d@example.com' % (i % 10)
+            assert writer.log_roster_change(jid, 'got online')
+        assert writer.log_roster_change('a@example.com', 'two\nlines')
+        # written in one batch at the end of the loop iteration
+        assert not (tmp_path / 'roster.log').exists()
+        loop.call_soon(loop.stop)
+        loop.run_forever()
+        lines = (tmp_path / 'roster.log').read_text().splitlines()
+        assert len(lines) == 102
+        assert lines[-2].endswith(' 001 a@example.com two')
+        assert lines[-1] == ' lines'
+        # use_log is only looked up once per jid, until it changes
+        assert len([jid for jid in asked if jid]) == 11
+        values['use_log'] = False
+        writer.on_use_log_change('use_log', 'false')
+        writer.log_roster_change('a@example.com', 'got offline')
+        assert writer.flush()
+        assert len((tmp_path / 'roster.log').read_text().splitlines()) == 102
+    finally:
+        loop.close()
+
+
+def test_log_index(monkeypatch, tmp_path):
+    from poezio import logger
+    monkeypatch.setattr(logger, 'config', LogConfigShim({'use_log': True}))
+    monkeypatch.setattr(logger, 'log_dir', tmp_path)
+    jid = 'room@example.com'
+    start = datetime.datetime(2017, 3, 1, 12, 0, 0)
+    dates = [start + datetime.timedelta(minutes=i) for i in range(10)]
+    # an older message, logged last, doesn't break the ordering
+    dates.append(start - datetime.timedelta(days=1))
+    writer = logger.Logger()
+    try:
+        for i, date in enumerate(dates):
+            writer.log_message(jid, 'toto', 'msg %s\nline' % i, date=date)
+        logs = writer.get_logs_between(jid, dates[2], dates[5])
+        assert [msg['txt'][-10:] for msg in logs] == [
+            'msg 2\nline', 'msg 3\nline', 'msg 4\nline'
+        ]
+        assert [msg['time'] for msg in logs] == dates[2:5]
+        logs = writer.get_logs_before(jid, 2, dates[3])
+        assert [msg['time'] for msg in logs] == dates[1:3]
+        logs = writer.get_logs_before(jid, 3, 9)
+        assert [msg['time'] for msg in logs] == dates[6:9]
+        assert len(writer.get_logs_before(jid, 5)) == 5
+        assert writer.get_logs_between(jid, dates[-1], dates[0]) == []
+    finally:
+        writer.close(jid)
+
+    # messages written without the index are indexed when it is used
+    index_file = tmp_path / logger.INDEX_DIR / jid
+    index_file.write_bytes(index_file.read_bytes()[:logger.INDEX_RECORD.size])
+    logs = writer.get_logs_before(jid, 20)
+    assert [msg['time'] for msg in logs] == dates
+    assert index_file.stat().st_size == logger.INDEX_RECORD.size * 11
+
+    # and a truncated log file makes it rebuilt
+    (tmp_path / jid).write_text(logger.build_log_message('toto', 'a', start))
+    logs = writer.get_logs_before(jid, 20)
+    assert [msg['time'] for msg in logs] == [start]
+
+
+def test_log_pager(monkeypatch, tmp_path):
+    from poezio import logger
+    monkeypatch.setattr(logger, 'config', LogConfigShim({'use_log': True}))
+    monkeypatch.setattr(logger, 'log_dir', tmp_path)
+    jid = 'room@example.com'
+    start = datetime.datetime(2017, 3, 1, 12, 0, 0)
+    dates = [start + datetime.timedelta(minutes=i) for i in range(25)]
+    writer = logger.Logger()
+    try:
+        for i, date in enumerate(dates):
+            writer.log_message(jid, 'toto', 'msg %s\nline' % i, date=date)
+        writer.flush()
+    finally:
+        writer.close(jid)
+    pager = logger.LogPager(jid, page_size=10)
+    pages = [pager.page(i, None) for i in range(3)]
+    assert [[msg['time'] for msg in page] for page in pages] == [
+        dates[15:], dates[5:15], dates[:5]]
+    assert pager.page(3, None) is None
+    # the pages are read again from their offsets, before another date
+    assert [msg['time'] for msg in pager.page(1, None)] == dates[5:15]
+    assert [msg['time'] for msg in pager.page(0, dates[12])] == dates[2:12]
+    assert [msg['txt'][-10:] for msg in pager.page(1, dates[12])] == [
+        'msg 0\nline', 'msg 1\nline']
+
+
+def test_log_segments(monkeypatch, tmp_path):
+    from poezio import logger
+    values = {'use_log': True, 'log_segment_period': 'month'}
+    monkeypatch.setattr(logger, 'config', LogConfigShim(values))
+    monkeypatch.setattr(logger, 'log_dir', tmp_path)
+    jid = 'room@example.com'
+    dates = [datetime.datetime(2017, month, day, 12, 0, 0)
+             for month in (1, 2, 3) for day in (1, 2)]
+    # a log file from before the segments
+    (tmp_path / jid).write_text(''.join(
+        build_log_message('toto', 'msg %s' % i, date)
+        for i, date in enumerate(dates[:4])))
+    writer = logger.Logger()
+    try:
+        # opening it closes the segments of the past months
+        writer.log_message(jid, 'toto', 'msg 4', date=dates[4])
+        segments = logger.log_segments(tmp_path / jid)
+        assert [path.name for path in segments] == [
+            '2017-01.gz', '2017-02.gz']
+        assert logger.read_segment(segments[0]).count(b'<toto>') == 2
+        # and so does a message of a new month
+        writer.log_message(jid, 'toto', 'msg 5', date=dates[5])
+        writer.log_message(jid, 'toto', 'now')
+        writer.flush()
+        assert len(logger.log_segments(tmp_path / jid)) == 3
+        assert (tmp_path / jid).read_text().count('<toto>') == 1
+    finally:
+        writer.close(jid)
+    dates.append(None)
+
+    def times(logs):
+        return [msg['time'] for msg in logs]
+
+    assert times(writer.get_logs(jid, 10))[:-1] == dates[:-1]
+    assert times(writer.get_logs(jid, 3))[:-1] == dates[4:6]
+    assert times(writer.get_logs_between(jid, dates[1], dates[5])) == dates[1:5]
+    assert times(writer.get_logs_before(jid, 3, dates[4])) == dates[1:4]
+    assert [line for line in logger.read_log_lines(tmp_path / jid)
+            if line.startswith('MR')][0].endswith('msg 0\n')
+
+    # the pages stop at the start of each segment
+    pager = logger.LogPager(jid, page_size=4)
+    pages = [times(pager.page(i, None)) for i in range(4)]
+    assert pages == [[pages[0][0]], dates[4:6], dates[2:4], dates[:2]]
+    assert pager.page(4, None) is None
+    assert times(pager.page(0, dates[3])) == dates[2:3]
+    assert times(pager.page(1, dates[3])) == dates[:2]
+
+    # poezio_logs only reads the parts of the requested range
+    log_path = tmp_path / jid
+    parts = logger.log_parts(log_path, start=get_utc_time(dates[2]),
+                             end=get_utc_time(dates[3]))
+    assert [path.name for path in parts] == ['2017-02.gz']
+    assert len(logger.log_parts(log_path, start=get_utc_time(dates[4]))) == 2
+    assert logger.log_parts(log_path) == logger.log_segments(log_path) + [
+        log_path]
+    end = calendar.timegm(get_utc_time(dates[3]).timetuple())
+    records = logger.read_log_part(parts[0], end=end, nicks=['toto'])
+    assert [text for _, _, text in records] == ['msg 2']
+    assert logger.read_log_part(parts[0], nicks=['tata']) == []
+    records = logger.read_log_part(parts[0], pattern=re.compile('3$'))
+    assert [text for _, _, text in records] == ['msg 3']
+
+
+def test_rotate_log_interrupted(monkeypatch, tmp_path):
+    from poezio import logger
+    dates = [datetime.datetime(2017, month, day, 12, 0, 0)
+             for month in (1, 2, 3) for day in (1, 2)]
+    log_path = tmp_path / 'room@example.com'
+    content = ''.join(build_log_message('toto', 'msg %s' % i, date)
+                      for i, date in enumerate(dates))
+    log_path.write_text(content)
+    segment_dir = tmp_path / 'segments'
+    replace = os.replace
+
+    def crash(src, dst):
+        if dst == str(log_path):
+            raise OSError('crash')
+        replace(src, dst)
+
+    # the segments are written, but not the log file
+    monkeypatch.setattr(os, 'replace', crash)
+    with pytest.raises(OSError):
+        logger.rotate_log(log_path, segment_dir, '%Y-%m', '2017-03', 'gzip')
+    monkeypatch.setattr(os, 'replace', replace)
+    assert log_path.read_text() == content
+    assert logger.rotate_log(log_path, segment_dir, '%Y-%m', '2017-03',
+                             'gzip') == (True, '2017-03')
+    segments = sorted(path.name for path in segment_dir.iterdir())
+    assert segments == ['2017-01.gz', '2017-02.gz']
+    for name in segments:
+        assert logger.read_segment(segment_dir / name).count(b'<toto>') == 2
+    assert log_path.read_text().count('<toto>') == 2
@@ -0,0 +1,153 @@
+"""
+Compare the log parser of the `logger` module with the previous,
+regex-based one. Run this file to benchmark them:
+
+    python3 test/test_logger_parsing.py
+"""
+import datetime
+import re
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from poezio.common import get_local_time
+from poezio.logger import (LogInfo, LogMessage, build_log_message,
+                           local_time, parse_log_data, parse_log_line,
+                           parse_log_lines)
+from poezio.theming import dump_tuple, get_theme
+
+MESSAGE_LOG_RE = re.compile(r'^MR (\d{4})(\d{2})(\d{2})T'
+                            r'(\d{2}):(\d{2}):(\d{2})Z '
+                            r'(\d+) <([^\xa0]+)> \xa0(.*)$')
+INFO_LOG_RE = re.compile(r'^MI (\d{4})(\d{2})(\d{2})T'
+                         r'(\d{2}):(\d{2}):(\d{2})Z '
+                         r'(\d+) (.*)$')
+
+
+def reference_parse_log_line(msg):
+    match = re.match(MESSAGE_LOG_RE, msg)
+    if match:
+        return LogMessage(*match.groups())
+    match = re.match(INFO_LOG_RE, msg)
+    if match:
+        return LogInfo(*match.groups())
+    return None
+
+
+def reference_parse_log_lines(lines):
+    messages = []
+    color = '\x19%s}' % dump_tuple(get_theme().COLOR_LOG_MSG)
+    idx = 0
+    while idx < len(lines):
+        if lines[idx].startswith(' '):
+            idx += 1
+            continue
+        log_item = reference_parse_log_line(lines[idx])
+        idx += 1
+        if log_item is None:
+            continue
+        message_lines = []
+        message = {'history': True, 'time': get_local_time(log_item.time)}
+        size = log_item.nb_lines
+        if isinstance(log_item, LogMessage):
+            message['nickname'] = log_item.nick
+        message_lines.append(color + log_item.text)
+        while size != 0 and idx < len(lines):
+            message_lines.append(lines[idx][1:])
+            size -= 1
+            idx += 1
+        message['txt'] = '\n'.join(message_lines)
+        messages.append(message)
+    return messages
+
+
+def make_log(nb):
+    start = datetime.datetime(2017, 3, 1)
+    records = []
+    for i in range(nb):
+        date = start + datetime.timedelta(minutes=7 * i)
+        if i % 10 == 9:
+            records.append(build_log_message('', 'toto joined', date, typ=2))
+        elif i % 5 == 4:
+            records.append(
+                build_log_message('nick%d' % (i % 3), 'a\nb  c\n d', date))
+        else:
+            records.append(build_log_message('n<i> ck', 'hello %d' % i, date))
+    return ''.join(records)
+
+
+ODD_LINES = [
+    'MR 20170909T09:09:09Z 000 <nick> \xa0body\n',
+    'MR 20170909T09:09:09Z 0001 <a> b> \xa0body> \xa0x',
+    'MI 20170909T09:09:09Z 000 ',
+    'MI 20170909T09:09:09Z 000',
+    'MR 20170909T09:09:09Z 000 <> \xa0body',
+    'MR 20170909T09:09:09Z 000 <a\xa0b> \xa0body',
+    'MR 20170909T09:09:09Z 000 <ab>  body',
+    'MR 20170909T09:09:09Z 000 <ab>\xa0body',
+    'MR 20170909T09:09:09Z +00 <ab> \xa0body',
+    'MR 2017 909T09:09:09Z 000 <ab> \xa0body',
+    'MR 20170909T09:0a:09Z 000 <ab> \xa0body',
+    'MR 20170909T09:09:09Z 000 <ab> \xa0a\nb',
+    'MR 20170909T09:09:09Z 000 <a\nb> \xa0ab',
+    'MX 20170909T09:09:09Z 000 <ab> \xa0body',
+    'MR 20170909T09:09:09Z',
+    '',
+]
+
+
+def test_parse_log_line_same_results():
+    for line in make_log(50).splitlines(keepends=True) + ODD_LINES:
+        expected = reference_parse_log_line(line)
+        item = parse_log_line(line)
+        assert type(item) is type(expected)
+        if expected is not None:
+            assert vars(item) == vars(expected)
+
+
+def test_parse_log_lines_same_results():
+    data = make_log(500)
+    lines = data.splitlines()
+    assert parse_log_lines(lines) == reference_parse_log_lines(lines)
+    assert parse_log_data(data.encode()).messages() == \
+        reference_parse_log_lines(lines)
+
+
+def test_parse_log_data_columns():
+    columns = parse_log_data(make_log(10).encode())
+    assert len(columns) == 10
+    assert columns.nicks[9] is None
+    assert columns.nicks[4] == 'nick1'
+    assert columns.texts[4] == 'a\nb  c\n d'
+    assert columns.times[1] - columns.times[0] == 7 * 60
+    assert columns.local_time(0) == datetime.datetime(2017, 3, 1)
+
+
+def test_local_time_buckets():
+    # around the DST changes of 2017 in Europe and in North America
+    epoch = datetime.datetime(1970, 1, 1)
+    for day in ((2017, 3, 12), (2017, 3, 26), (2017, 10, 29), (2017, 11, 5)):
+        start = datetime.datetime(*day)
+        for minutes in range(0, 24 * 60, 7):
+            utc_time = start + datetime.timedelta(minutes=minutes)
+            seconds = int((utc_time - epoch).total_seconds())
+            assert local_time(seconds) == get_local_time(utc_time)
+
+
+def benchmark(nb=50000, repeat=5):
+    data = make_log(nb)
+    lines = data.splitlines()
+    for name, func in (('regexes', reference_parse_log_lines),
+                       ('slicing', parse_log_lines)):
+        best = min(timeit.repeat(lambda: func(lines), number=1,
+                                 repeat=repeat))
+        print('%s: %d messages in %.3fs' % (name, nb, best))
+    best = min(timeit.repeat(lambda: parse_log_data(data.encode()),
+                             number=1, repeat=repeat))
+    print('columns: %d messages in %.3fs' % (nb, best))
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -2,7 +2,11 @@
 Test of the poopt module
 """
 
-from poezio.poopt import cut_text
+import re
+
+from poezio.poopt import cut_text, cut_text_many, parse_format, clean_text, \
+    clean_text_simple
+from poezio.xhtml import xhtml_attr_re
 
 def test_cut_text():
 
@@ -14,3 +18,64 @@ def test_cut_text():
 
     text = 'vivent les réfrigérateurs'
     assert cut_text(text, 6) == [(0, 6), (6, 10), (11, 17), (17, 23), (23, 25)]
+
+def test_cut_text_many():
+    texts = ['12345678901234567890', 'vivent les réfrigérateurs', '']
+    widths = [5, 6, 10]
+    lines = cut_text_many(texts, widths)
+    assert lines.typecode == 'I'
+    assert [tuple(lines[i:i + 3]) for i in range(0, len(lines), 3)] == [
+        (index, start, end)
+        for index, (text, width) in enumerate(zip(texts, widths))
+        for start, end in cut_text(text, width)
+    ]
+    assert len(cut_text_many([], [])) == 0
+
+FORMATTED_TEXTS = [
+    '',
+    'no format',
+    '\x19bhello \x191}Bonj\x192,3,u}our\x19o plain\x19o',
+    '\x191}Toto \x192,-1}titi\x19b Tata',
+    '\x19-1}négatif\x19a\x19i italique \x193,4,}é😆',
+    'unknown \x19z and \x19 alone\x19',
+    'not closed \x191,2 \x19bbold',
+]
+
+def test_parse_format():
+    text = '\x19bhello \x191}Bonj\x192,3,u}our\x19o plain\x19o'
+    runs, stripped = parse_format(text)
+    assert runs == [
+        (2, 8, (None, 1)),
+        (11, 15, ((1, -1), 1)),
+        (22, 25, ((2, 3), 3)),
+        (27, 33, (None, 0)),
+    ]
+    assert stripped == 'hello Bonjour plain'
+
+    assert parse_format('\x19b\x191,2,}x\x19i\x193,4,o}y') == (
+        [(8, 9, ((1, 2), 0)), (18, 19, (None, 0))], 'xy')
+    assert parse_format('no format') == ([(0, 9, (None, 0))], 'no format')
+    assert parse_format('') == ([], '')
+
+def test_parse_format_stripped():
+    for text in FORMATTED_TEXTS:
+        runs, stripped = parse_format(text)
+        assert stripped == re.sub(xhtml_attr_re, '', text)
+        assert stripped == ''.join(text[start:end] for start, end, _ in runs)
+
+def test_clean_text():
+    for text in FORMATTED_TEXTS:
+        assert clean_text(text) == re.sub(xhtml_attr_re, '', text)
+
+def test_clean_text_simple():
+    assert clean_text_simple('\x198toto\x19b titi\x19') == 'toto titi'
+    assert clean_text_simple('\x19\x19\x19xé😆') == 'é😆'
+    assert clean_text_simple('no format') == 'no format'
+
+def test_parse_format_uppercase():
+    # the attribute chars are case insensitive
+    assert parse_format('\x19Bbold\x19Uunder\x19Iital\x19Aa\x19Oplain') == (
+        [(2, 6, (None, 1)), (8, 13, (None, 3)), (15, 19, (None, 7)),
+         (21, 22, (None, 7)), (24, 29, (None, 0))], 'boldunderitalaplain')
+    # but clean_text, used for the logs, only removes the lowercase ones
+    assert clean_text('\x19Bbold\x19o \x19Aa') == '\x19Bbold \x19Aa'
@@ -0,0 +1,263 @@
+"""
+Test the Roster class of the `roster` module
+"""
+import random
+
+import poezio.core  # the tabs are imported by the core first
+from poezio import roster as roster_module
+from poezio.roster import Roster
+from poezio.roster_sorting import (SORTING_METHODS, compile_sort,
+                                   contact_base_key)
+from poezio.tabs.rostertab import RosterSearch, diffmatch
+from poezio.windows import roster_win
+from poezio.windows.roster_win import RosterWin
+
+
+class ItemShim(dict):
+    def __init__(self, jid, groups=()):
+        dict.__init__(self, groups=list(groups), name='')
+        self.jid = jid
+        self.resources = {}
+
+
+class NodeShim(dict):
+    jid = 'me@example.com'
+
+    def __missing__(self, jid):
+        # like slixmpp, unknown items are created on access
+        item = self[jid] = ItemShim(jid)
+        return item
+
+
+class ConfigShim:
+    def __init__(self, **options):
+        self.options = options
+
+    def get(self, option, default='', section=None):
+        return self.options.get(option, default)
+
+
+def test_roster_membership(monkeypatch):
+    monkeypatch.setattr(roster_module, 'config', ConfigShim())
+    roster = Roster()
+    node = NodeShim()
+    roster.set_node(node)
+    node['a@example.com'] = ItemShim('a@example.com', ['friends'])
+    node['b@example.com'] = ItemShim('b@example.com')
+    node['me@example.com'] = ItemShim('me@example.com')
+    for jid in node:
+        roster.update_contact_groups(jid)
+
+    assert roster.jids() == ['a@example.com', 'b@example.com']
+    assert len(roster) == 2
+    assert 'a@example.com' in roster
+    assert 'a@example.com/resource' in roster
+    assert 'me@example.com' not in roster
+    assert roster['b@example.com/resource'].bare_jid == 'b@example.com'
+    # an item created by slixmpp, for a presence for example, is not a
+    # contact until it gets in the roster groups
+    node['c@example.com']
+    assert 'c@example.com' not in roster
+    assert roster['c@example.com'] is None
+    assert roster['d@example.com'] is None
+
+    # a roster push moving a contact to another group
+    node['a@example.com']['groups'] = ['family']
+    roster.update_contact_groups('a@example.com')
+    assert 'a@example.com' in roster
+    assert 'a@example.com' in [
+        contact.bare_jid for contact in roster.groups['family']]
+    assert len(roster.groups['friends']) == 0
+
+    del roster['a@example.com']
+    assert 'a@example.com' not in roster
+    assert roster.jids() == ['b@example.com']
+    assert len(roster) == 1
+
+
+def test_compile_sort():
+    rng = random.Random(0)
+    contacts = []
+    for i in range(40):
+        item = ItemShim('%s@example.com' % i)
+        item['name'] = rng.choice(['', 'Toto', 'titi', 'tata'])
+        for resource in range(rng.randrange(3)):
+            item.resources[str(resource)] = {
+                'show': rng.choice(['', 'away', 'xa', 'dnd']),
+                'priority': rng.randrange(3)
+            }
+        contacts.append(roster_module.Contact(item))
+    for sort in ('jid:show', 'show', 'name:reverse', 'resource:reverse:show',
+                 'reverse:online:name', 'unknown', ''):
+        expected = sorted(contacts, key=contact_base_key)
+        for sorting in sort.split(':'):
+            if sorting == 'reverse':
+                expected = list(reversed(expected))
+            else:
+                expected = sorted(
+                    expected, key=SORTING_METHODS.get(sorting, lambda x: 0))
+        key = compile_sort(sort, SORTING_METHODS, contact_base_key)
+        assert sorted(contacts, key=key) == expected
+
+
+def test_roster_win_updates(monkeypatch):
+    config = ConfigShim(roster_sort='show:jid', roster_group_sort='size')
+    monkeypatch.setattr(roster_module, 'config', config)
+    monkeypatch.setattr(roster_win, 'config', config)
+    roster = Roster()
+    node = NodeShim()
+    roster.set_node(node)
+    for i in range(30):
+        jid = '%02d@example.com' % i
+        node[jid] = ItemShim(jid, ['group%d' % (i % 4)] if i % 5 else [])
+        roster.update_contact_groups(jid)
+    incremental = RosterWin()
+    rng = random.Random(0)
+
+    def check():
+        incremental.build_roster_cache(roster)
+        full = RosterWin()
+        roster.modified()
+        full.build_roster_cache(roster)
+        assert incremental.roster_cache == full.roster_cache
+        return full.roster_cache
+
+    assert check() == []
+    for i in range(60):
+        jid = '%02d@example.com' % rng.randrange(30)
+        item = node[jid]
+        change = rng.randrange(4)
+        if change == 0:
+            item.resources[str(i)] = {'show': 'away', 'priority': i}
+        elif change == 1:
+            item.resources.clear()
+        elif change == 2:
+            item['groups'] = ['group%d' % rng.randrange(6)]
+            roster.update_contact_groups(jid)
+        else:
+            roster[jid].toggle_folded(roster[jid].groups[0])
+        roster.modified(jid)
+        cache = incremental.roster_cache
+        check()
+        # the rows of the other groups are left in place
+        assert incremental.roster_cache is cache
+
+    rows = check()
+    assert rows and isinstance(rows[0], roster_module.RosterGroup)
+    del roster['05@example.com']
+    assert roster['05@example.com'] is None
+    check()
+    config.options['roster_show_offline'] = True
+    roster.modified()
+    rows = check()
+    assert sum(
+        isinstance(row, roster_module.Contact) for row in rows) == sum(
+            len(group) for group in roster.groups.values())
+
+
+def test_sort_keys_cache(monkeypatch):
+    monkeypatch.setattr(roster_module, 'config', ConfigShim())
+    roster = Roster()
+    node = NodeShim()
+    roster.set_node(node)
+    for jid in ('a@example.com', 'b@example.com'):
+        node[jid] = ItemShim(jid, ['friends'])
+        roster.update_contact_groups(jid)
+    node['b@example.com'].resources[''] = {'show': 'dnd'}
+    roster.modified('b@example.com')
+
+    group = roster.groups['friends']
+    assert [c.bare_jid for c in group.get_contacts(sort='show')] == [
+        'b@example.com', 'a@example.com']
+    a, b = roster['a@example.com'], roster['b@example.com']
+    assert 'show' in a.sort_keys and 'show' in b.sort_keys
+    # the keys are only computed again for the modified contact
+    node['a@example.com'].resources[''] = {'show': ''}
+    roster.modified('a@example.com')
+    assert a.sort_keys == {} and 'show' in b.sort_keys
+    assert [c.bare_jid for c in group.get_contacts(sort='show')] == [
+        'a@example.com', 'b@example.com']
+    assert [c.bare_jid for c in roster.get_contacts_sorted_filtered(
+        'show:reverse')] == ['b@example.com', 'a@example.com']
+    roster.modified()
+    assert a.sort_keys == {} and b.sort_keys == {}
+    assert roster.get_groups('size') == [group]
+
+
+def test_contact_resources():
+    item = ItemShim('a@example.com')
+    item.resources['phone'] = {'show': 'away', 'priority': 1}
+    item.resources['laptop'] = {'show': '', 'priority': 5}
+    contact = roster_module.Contact(item)
+    best = contact.get_highest_priority_resource()
+    assert best.jid == 'a@example.com/laptop'
+    assert [res.jid for res in contact.get_resources()] == [
+        'a@example.com/laptop', 'a@example.com/phone']
+    # the resources are cached, and read the updated presences
+    assert contact.get_highest_priority_resource() is best
+    item.resources['laptop']['show'] = 'dnd'
+    assert best.presence == 'dnd'
+    # a new resource, or a new priority once the contact changed
+    item.resources['desktop'] = {'show': 'xa', 'priority': 10}
+    assert contact.get_highest_priority_resource().jid == \
+        'a@example.com/desktop'
+    item.resources['phone']['priority'] = 20
+    contact.changed()
+    assert contact.get_highest_priority_resource().jid == \
+        'a@example.com/phone'
+    item.resources.clear()
+    assert contact.get_highest_priority_resource() is None
+    assert list(contact.resources) == []
+
+
+def test_roster_search(monkeypatch):
+    monkeypatch.setattr(roster_module, 'config', ConfigShim())
+    roster = Roster()
+    node = NodeShim()
+    roster.set_node(node)
+    for jid, name, groups in (('toto@example.com', 'Toto', ['Friends']),
+                              ('titi@example.org', '', []),
+                              ('tata@example.com', 'Tutu', ['Work'])):
+        node[jid] = ItemShim(jid, groups)
+        node[jid]['name'] = name
+        roster.update_contact_groups(jid)
+    search = RosterSearch(roster)
+    assert set(search.select('')) == set(roster.jids())
+    assert search.select('T') == {
+        'toto@example.com', 'titi@example.org', 'tata@example.com'}
+    assert search.select('a@example.c') == {'tata@example.com'}
+    assert search.select('example.co') == {
+        'toto@example.com', 'tata@example.com'}
+    # the groups and the names are searched too, but not 'none'
+    assert search.select('friend') == {'toto@example.com'}
+    assert search.select('tutu') == {'tata@example.com'}
+    assert search.select('none') == set()
+
+    # the modified contacts are indexed again, the others are not
+    search.select('example.com')
+    node['titi@example.org']['name'] = 'example.community'
+    roster.update_contact_groups('titi@example.org')
+    del roster['toto@example.com']
+    indexed = []
+    index = search._index
+    monkeypatch.setattr(search, '_index',
+                        lambda jid: indexed.append(jid) or index(jid))
+    assert search.select('example.com') == {
+        'titi@example.org', 'tata@example.com'}
+    assert sorted(indexed) == ['titi@example.org', 'toto@example.com']
+    assert [contact.bare_jid for contact in roster.get_contacts()
+            if search(contact, 'work')] == ['tata@example.com']
+
+    # all the contacts are indexed again after a modification of all of them
+    node['tata@example.com']['name'] = 'Tata'
+    roster.modified()
+    assert search.select('tutu') == set()
+    assert search.select('tata') == {'tata@example.com'}
+
+    roster.contact_filter = (search, 'EXAMPLE.')
+    assert [contact.bare_jid
+            for contact in roster.get_contacts_sorted_filtered('jid')] == [
+                'tata@example.com', 'titi@example.org']
+
+    assert diffmatch('exmple', 'toto@example.com')
+    assert not diffmatch('exmpel', 'toto@domain.org')
@@ -0,0 +1,87 @@
+"""
+Test the RingBuffer used to store the messages and lines
+"""
+import pytest
+from poezio.text_buffer import RingBuffer
+
+
+def test_append_evicts_oldest():
+    buf = RingBuffer(3)
+    buf.extend(range(5))
+    assert list(buf) == [2, 3, 4]
+    assert len(buf) == 3
+    assert buf[0] == 2
+    assert buf[-1] == 4
+    assert list(reversed(buf)) == [4, 3, 2]
+    with pytest.raises(IndexError):
+        buf[3]
+
+
+def test_slices():
+    buf = RingBuffer(40, range(100))
+    assert buf[-5:] == [95, 96, 97, 98, 99]
+    assert buf[-10:-5] == [90, 91, 92, 93, 94]
+    assert buf[:-4:-1] == [99, 98, 97]
+    assert buf[:] == list(range(60, 100))
+
+
+def test_pop_and_splice():
+    buf = RingBuffer(5, range(7))
+    assert buf.popleft() == 2
+    assert buf.pop() == 6
+    assert list(buf) == [3, 4, 5]
+    buf.splice(1, 2, ['a', 'b', 'c'])
+    assert list(buf) == [3, 'a', 'b', 'c', 5]
+    buf.splice(1, 4, ['d'])
+    assert list(buf) == [3, 'd', 5]
+    buf.append(None)
+    assert None in buf
+    buf.remove(None)
+    assert list(buf) == [3, 'd', 5]
+    buf.clear()
+    assert not buf
+
+
+class ConfigShim:
+    def get(self, *args, **kwargs):
+        return ''
+
+
+@pytest.fixture
+def buffer(monkeypatch):
+    from poezio import text_buffer
+    monkeypatch.setattr(text_buffer, 'config', ConfigShim())
+    return text_buffer.TextBuffer(messages_nb_limit=3)
+
+
+def test_find_message_after_eviction(buffer):
+    for i in range(5):
+        buffer.add_message('message %s' % i, identifier='id%s' % i, jid='a@b/c')
+    assert buffer._find_message('id0') == -1
+    assert buffer._find_message('id1') == -1
+    assert buffer._find_message('id2') == 0
+    assert buffer._find_message('id4') == 2
+
+
+def test_find_message_after_correction(buffer):
+    buffer.add_message('hello', identifier='first', jid='a@b/c')
+    buffer.add_message('world', identifier='second', jid='a@b/c')
+    msg = buffer.modify_message('hello!', 'first', 'third', jid='a@b/c')
+    assert buffer._find_message('first') == -1
+    assert buffer._find_message('third') == 0
+    assert buffer.messages[0] is msg
+    assert buffer.ack_message('second', 'a@b/c').ack == 1
+
+
+def test_find_message_after_assignment(buffer):
+    from poezio.text_buffer import TextBuffer
+    source = TextBuffer(messages_nb_limit=10)
+    for i in range(5):
+        source.add_message('message %s' % i, identifier='id%s' % i, jid='a@b/c')
+    # more messages than the limit, the first ones are dropped
+    buffer.messages = source.messages
+    assert [msg.identifier for msg in buffer.messages] == ['id2', 'id3', 'id4']
+    assert buffer._find_message('id1') == -1
+    assert buffer._find_message('id2') == 0
+    assert buffer.messages[buffer._find_message('id4')].identifier == 'id4'
+    assert buffer.ack_message('id3', 'a@b/c').identifier == 'id3'
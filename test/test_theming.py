@@ -22,3 +22,13 @@ def test_dump_tuple():
     assert dump_tuple((1, 2, 'u')) == '1,2,u'
 
 
+
+def test_reload_theme_clears_segment_attrs(monkeypatch):
+    from poezio import theming
+    from poezio.windows import base_wins
+    monkeypatch.setattr(theming, 'config', {'theme': 'default'})
+    monkeypatch.setattr(base_wins, 'to_curses_attr', lambda color: 0)
+    base_wins.segment_attrs_to_curses(((1, -1), 0))
+    assert base_wins.segment_attrs_to_curses.cache_info().currsize
+    assert theming.reload_theme() is None
+    assert not base_wins.segment_attrs_to_curses.cache_info().currsize
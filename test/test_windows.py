@@ -1,3 +1,5 @@
+import sys
+
 import pytest
 
 class ConfigShim(object):
@@ -71,3 +73,224 @@ class TestInput(object):
 
         assert input.text == 'this is a line of textz'
 
+
+class TextConfigShim(object):
+    def get(self, option, *args, **kwargs):
+        return {'show_timestamps': True, 'max_nick_length': 25}.get(option, '')
+
+@pytest.fixture
+def text_win(monkeypatch):
+    from poezio import text_buffer
+    from poezio.windows import text_win
+    monkeypatch.setattr(text_buffer, 'config', TextConfigShim())
+    monkeypatch.setattr(text_win, 'config', TextConfigShim())
+    buffer = text_buffer.TextBuffer(messages_nb_limit=100)
+    win = text_win.TextWin(lines_nb_limit=1000)
+    win.width, win.height = 30, 5
+    buffer.add_window(win)
+    for i in range(60):
+        buffer.add_message('message %s, long enough to be wrapped' % i,
+                           nickname='nick', identifier='id%s' % i,
+                           jid='a@b/c')
+    return buffer, win
+
+def dump_lines(win):
+    return [(line.msg.identifier, line.start_pos) if line else None
+            for line in win.built_lines]
+
+class TestTextWin(object):
+
+    def test_lazy_rebuild(self, text_win):
+        buffer, win = text_win
+        all_lines = dump_lines(win)
+        win.rebuild_everything(buffer)
+        assert len(win.built_lines) < len(all_lines)
+        assert dump_lines(win) == all_lines[-len(win.built_lines):]
+        while win.scroll_up(win.height):
+            pass
+        assert dump_lines(win) == all_lines
+
+    def test_modify_message(self, text_win):
+        buffer, win = text_win
+        message = buffer.modify_message('short', 'id50', 'new50', jid='a@b/c')
+        win.modify_message('id50', message)
+        lines = dump_lines(win)
+        assert ('new50', 0) in lines
+        assert 'id50' not in {line[0] for line in lines}
+        start, end = win._find_lines('id55')
+        assert {line[0] for line in lines[start:end]} == {'id55'}
+
+    def test_highlights(self, text_win):
+        buffer, win = text_win
+        win.add_line_separator(buffer)
+        for i in range(60, 70):
+            buffer.add_message('message %s' % i, nickname='nick',
+                               identifier='id%s' % i, highlight=i % 3 == 1)
+        highlighted = ['id61', 'id64', 'id67']
+
+        def current():
+            return win.built_lines[win.hl_seq - win.built_lines.base].msg.identifier
+
+        win.rebuild_everything(buffer)
+        win.scroll_to_separator()
+        assert win.built_lines[win.separator_seq - win.built_lines.base] is None
+        for identifier in highlighted:
+            win.next_highlight()
+            assert current() == identifier
+        win.next_highlight()
+        assert win.hl_seq is None and win.pos == 0
+        for identifier in reversed(highlighted):
+            win.previous_highlight()
+            assert current() == identifier
+
+    def test_previous_highlight_without_history(self, text_win):
+        buffer, win = text_win
+
+        class Pager:
+            def page(self, number, before):
+                raise AssertionError('the logs were read')
+
+        buffer.history = Pager()
+        win.rebuild_everything(buffer)
+        # no highlight: all the messages in memory are built, then the
+        # window goes back to the bottom
+        win.previous_highlight()
+        assert win.hl_seq is None and win.pos == 0
+        assert win.built_lines[0].msg.identifier == 'id0'
+
+    def test_line_store(self, text_win):
+        from poezio.text_buffer import RingBuffer
+        from poezio.windows.text_win import LineStore
+        buffer, win = text_win
+        lines = list(win.built_lines)
+        ring, store = RingBuffer(50), LineStore(50)
+        for ring_or_store in (ring, store):
+            ring_or_store.extend(lines[20:60])
+            ring_or_store.extend([None] + lines[60:80])
+            ring_or_store.extendleft(lines[:30])
+            ring_or_store.splice(5, 10, lines[:2])
+
+        def dump(lines):
+            return [(line.msg, line.start_pos, line.end_pos, line.segment)
+                    if line else None for line in lines]
+
+        assert (ring.base, len(ring)) == (store.base, len(store))
+        assert dump(ring) == dump(store)
+        assert dump(ring[-10:-2]) == dump(store[-10:-2])
+        assert 0 < store.memory_usage() < sum(
+            sys.getsizeof(line) for line in ring)
+
+    def test_wrap_cache(self, text_win, monkeypatch):
+        from poezio.windows import text_win as text_win_module
+        buffer, win = text_win
+        message = buffer.messages[-1]
+        lines = text_win_module.cut_message(message, 20)
+        assert text_win_module.cut_message(message, 20) is lines
+        assert 20 in message.wrap_cache
+        monkeypatch.setattr(text_win_module, 'WRAP_CACHE_SIZE', 0)
+        text_win_module.cut_message(message, 10)
+        assert not message.wrap_cache
+
+    def test_wrap_cache_weak(self, text_win):
+        import gc
+        from poezio.text_buffer import Message
+        from poezio.windows import text_win as text_win_module
+        message = Message('some text to wrap', None, 'nick', None, False,
+                          None, None)
+        text_win_module.cut_message(message, 7)
+        key = (id(message), 7)
+        assert key in text_win_module._wrap_cache_lru
+        nb_lines = text_win_module._wrap_cache_nb_lines
+        # the cache does not keep the dropped messages alive
+        del message
+        gc.collect()
+        assert key not in text_win_module._wrap_cache_lru
+        assert text_win_module._wrap_cache_nb_lines < nb_lines
+
+    def test_history_scrollback(self, text_win):
+        from datetime import datetime, timedelta
+        buffer, win = text_win
+        start = datetime(2017, 3, 1, 12, 0, 0)
+
+        class Pager:
+            def page(self, number, before):
+                if number >= 5:
+                    return None
+                return [{'txt': 'old %s' % i,
+                         'time': start + timedelta(minutes=i),
+                         'nickname': 'old'}
+                        for i in range(40 - 10 * number, 50 - 10 * number)]
+
+        buffer.history = Pager()
+        all_lines = dump_lines(win)
+        win.built_lines.maxlen = 150
+        win.rebuild_everything(buffer)
+        seen = []
+
+        def visible():
+            end = len(win.built_lines) - win.pos
+            return [line.msg.txt for line in
+                    win.built_lines[end - win.height:end]
+                    if line and line.start_pos == 0]
+
+        while win.scroll_up(win.height):
+            assert len(win.built_lines) <= 150
+            seen = visible() + seen
+        assert win._bottom_is_cut()
+        old = ['old %s' % i for i in range(50)]
+        assert [txt.split('\x19')[0] for txt in dict.fromkeys(seen)
+                if txt.startswith('old')] == old
+        while win.scroll_down(win.height):
+            assert len(win.built_lines) <= 150
+        assert not win._bottom_is_cut()
+        assert not win._history_pages
+        assert dump_lines(win) == all_lines[-len(win.built_lines):]
+
+    def test_scrollback_after_full_line_store(self, text_win):
+        from datetime import datetime
+        buffer, win = text_win
+
+        class Pager:
+            calls = 0
+
+            def page(self, number, before):
+                if number >= 2:
+                    return None
+                self.calls += 1
+                return [{'txt': 'old %s' % (10 * (1 - number) + i),
+                         'time': datetime(2017, 3, 1, 12, 0, 0),
+                         'nickname': 'old'}
+                        for i in range(10)]
+
+        buffer.history = pager = Pager()
+        win.built_lines.maxlen = 60
+        win.rebuild_everything(buffer)
+        for i in range(60, 90):
+            buffer.add_message('message %s, long enough to be wrapped' % i,
+                               nickname='nick', identifier='id%s' % i,
+                               jid='a@b/c')
+        assert len(win.built_lines) <= 60
+        assert win._built_messages is buffer.messages
+        first = win.built_lines[0] or win.built_lines[1]
+        assert buffer.messages[win._built_from - buffer.messages.base] \
+            is first.msg
+        seen = set()
+        while win.scroll_up(win.height):
+            assert len(win.built_lines) <= 60
+            seen.update(line.msg.identifier for line in win.built_lines
+                        if line)
+        assert {'id%s' % i for i in range(90)} <= seen
+        assert pager.calls == 2
+
+def test_compile_segments():
+    from poezio.windows.funcs import compile_segments
+    from poezio.windows.base_wins import ATTR_BOLD, ATTR_UNDERLINE
+    text = '\x19bhello \x191}Bonj\x192,3,u}our\x19o plain\x19o'
+    assert compile_segments(text) == [
+        (2, 8, (None, ATTR_BOLD)),
+        (11, 15, ((1, -1), ATTR_BOLD)),
+        (22, 25, ((2, 3), ATTR_BOLD | ATTR_UNDERLINE)),
+        (27, 33, (None, 0)),
+    ]
+    assert compile_segments('no format') == [(0, 9, (None, 0))]
+    assert compile_segments('') == []